@@ -1,9 +1,14 @@
 # Copyright (c) 2024, KhaledBinAmir and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class BiometricDeviceCommand(Document):
 	pass
+
+
+def on_doctype_update():
+	# Serves the per-device queue lookup: open commands of a device by priority, oldest first
+	frappe.db.add_index("Biometric Device Command", ["biometric_device", "status", "priority", "initiated_on"])
@@ -42,6 +42,48 @@ class BiometricIntegrationSettings(Document):
 
         self.example_cleaned_ids = "\n".join(cleaned_ids)
 
+    def on_update(self):
+        """
+        Bump the site's settings version once the change is committed, so every process on every node
+        drops its cached snapshot and can't reload the old values before the commit.
+        """
+        frappe.db.after_commit.add(bump_settings_version)
+
+# Per-site settings snapshots, site name mapped to (version, snapshot)
+_settings_cache = {}
+# Counter in the site's Redis cache, shared by all processes and nodes serving the site
+SETTINGS_VERSION_KEY = "biometric_integration:settings_version"
+
+def get_settings_version():
+    """The current site's settings version, one Redis GET and no database query."""
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(SETTINGS_VERSION_KEY)) or 0)
+
+def bump_settings_version():
+    cache = frappe.cache()
+    cache.incr(cache.make_key(SETTINGS_VERSION_KEY))
+
+def get_settings():
+    """
+    Process-local snapshot of Biometric Integration Settings for the current site.
+
+    The snapshot is rebuilt only when the site's version stamp changes, and carries the
+    compiled Clean ID Regex as `clean_id_pattern`.
+
+    Returns:
+        frappe._dict: The settings values.
+    """
+    site_name = frappe.local.site
+    version = get_settings_version()
+    cached = _settings_cache.get(site_name)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    settings = frappe.get_doc("Biometric Integration Settings").as_dict()
+    settings.clean_id_pattern = re.compile(settings.clean_id_regex) if settings.clean_id_regex else None
+    _settings_cache[site_name] = (version, settings)
+    return settings
+
 def get_device_employee_id(employee_id):
     """
     Convert an ERP Employee ID to a Device Employee ID based on the mapping method.
@@ -55,7 +97,7 @@ def get_device_employee_id(employee_id):
     if not employee_id:
         frappe.throw("Employee ID is required.")
 
-    settings = frappe.get_cached_doc("Biometric Integration Settings")
+    settings = get_settings()
 
     if settings.employee_id_mapping_method == "Use Device ID Field":
         device_employee_id = frappe.get_value("Employee", {"name": employee_id}, settings.device_id_field)
@@ -66,7 +108,7 @@ def get_device_employee_id(employee_id):
     elif settings.employee_id_mapping_method == "Clean Employee ID with Regex":
         if not settings.clean_id_regex:
             frappe.throw("Clean ID Regex is not configured.")
-        cleaned_id = re.sub(settings.clean_id_regex, "", employee_id)
+        cleaned_id = settings.clean_id_pattern.sub("", employee_id)
         if not cleaned_id:
             frappe.throw(f"Failed to clean Employee ID '{employee_id}' using regex '{settings.clean_id_regex}'.")
         return cleaned_id
@@ -86,7 +128,7 @@ def get_erp_employee_id(device_employee_id):
     if not device_employee_id:
         frappe.throw("Device Employee ID is required.")
 
-    settings = frappe.get_cached_doc("Biometric Integration Settings")
+    settings = get_settings()
 
     if settings.employee_id_mapping_method == "Use Device ID Field":
         erp_employee_id = frappe.get_value("Employee", {settings.device_id_field: device_employee_id}, "name")
@@ -100,4 +142,43 @@ def get_erp_employee_id(device_employee_id):
             frappe.throw(f"ERP Employee ID not found for cleaned ID '{device_employee_id}'.")
         return erp_employee_id
 
-    frappe.throw(f"Unsupported mapping method: {settings.employee_id_mapping_method}")
\ No newline at end of file
+    frappe.throw(f"Unsupported mapping method: {settings.employee_id_mapping_method}")
+
+def get_employee_lookup_field():
+    """
+    The Employee field that holds Device Employee IDs under the configured mapping method.
+    """
+    settings = get_settings()
+
+    if settings.employee_id_mapping_method == "Use Device ID Field":
+        return settings.device_id_field
+    elif settings.employee_id_mapping_method == "Clean Employee ID with Regex":
+        return "name"
+
+    frappe.throw(f"Unsupported mapping method: {settings.employee_id_mapping_method}")
+
+def get_erp_employee_ids(device_employee_ids):
+    """
+    Convert many Device Employee IDs to ERP Employee IDs with a single query.
+
+    Args:
+        device_employee_ids (list): The Device Employee IDs.
+
+    Returns:
+        dict: Device Employee ID (as str) mapped to a dict with the ERP Employee 'name' and 'employee_name'.
+            IDs without a matching Employee are left out.
+    """
+    device_employee_ids = list({str(device_employee_id) for device_employee_id in device_employee_ids if device_employee_id})
+    if not device_employee_ids:
+        return {}
+
+    lookup_field = get_employee_lookup_field()
+    employees = frappe.get_all(
+        "Employee",
+        filters={lookup_field: ["in", device_employee_ids]},
+        fields=["name", "employee_name", f"{lookup_field} as device_employee_id"],
+    )
+    return {
+        str(employee.device_employee_id): {"name": employee.name, "employee_name": employee.employee_name}
+        for employee in employees
+    }
@@ -1,9 +1,21 @@
 # Copyright (c) 2024, KhaledBinAmir and Contributors
 # See license.txt
 
-# import frappe
 from frappe.tests.utils import FrappeTestCase
+from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import (
+	bump_settings_version,
+	get_settings,
+	get_settings_version,
+)
 
 
 class TestBiometricIntegrationSettings(FrappeTestCase):
-	pass
+	def test_bumped_version_reloads_the_snapshot(self):
+		version = get_settings_version()
+		settings = get_settings()
+		self.assertIs(get_settings(), settings)
+
+		bump_settings_version()
+
+		self.assertEqual(get_settings_version(), version + 1)
+		self.assertIsNot(get_settings(), settings)
@@ -0,0 +1,83 @@
+import json
+import click
+from frappe.commands import pass_context
+from frappe.utils import get_datetime
+
+@click.command("replay-biometric-data")
+@click.option("--device", "devices", multiple=True, help="Device ID to replay, can be given more than once")
+@click.option("--since", help="Replay requests received at or after this time, e.g. '2024-12-20 08:00'")
+@click.option("--until", help="Replay requests received before this time")
+@click.option("--request-code", "request_codes", multiple=True, help="Request code to replay, defaults to realtime_glog and realtime_enroll_data")
+@click.option("--lanes", default=8, type=int, help="Devices replayed in parallel")
+@click.option("--dry-run", is_flag=True, default=False, help="Only count the requests that would be replayed")
+def replay_biometric_data(devices, since, until, request_codes, lanes, dry_run):
+    """Replay archived raw device requests through the listener's protocol handlers."""
+    from biometric_integration.services.replay import replay_archive
+
+    stats = replay_archive(
+        device_ids=list(devices) or None,
+        since=get_datetime(since) if since else None,
+        until=get_datetime(until) if until else None,
+        request_codes=list(request_codes) or None,
+        lanes=lanes,
+        dry_run=dry_run,
+    )
+    click.echo(json.dumps(stats, indent=2))
+
+@click.command("reconcile-biometric-users")
+@click.option("--device", "devices", multiple=True, help="Device to reconcile, can be given more than once")
+@click.option("--dry-run", is_flag=True, default=False, help="Only count the commands that would be created")
+@pass_context
+def reconcile_biometric_users(context, devices, dry_run):
+    """Queue the user commands needed to bring devices in line with the ERP."""
+    import frappe
+    from biometric_integration.services.user_reconciler import reconcile_device_users
+
+    for site in context.sites:
+        frappe.init(site=site)
+        frappe.connect()
+        try:
+            stats = reconcile_device_users(device_names=list(devices) or None, dry_run=dry_run)
+            click.echo(f"{site}: {json.dumps(stats, indent=2)}")
+        finally:
+            frappe.destroy()
+
+@click.command("import-biometric-users")
+@click.option("--device", "devices", multiple=True, required=True, help="EBKN device to import from, can be given more than once")
+@click.option("--restart", is_flag=True, default=False, help="Start over instead of continuing an interrupted import")
+@pass_context
+def import_biometric_users(context, devices, restart):
+    """Queue an import of the users and enroll templates already stored on EBKN devices."""
+    import frappe
+    from biometric_integration.services.user_import import start_user_import
+
+    for site in context.sites:
+        frappe.init(site=site)
+        frappe.connect()
+        try:
+            for device in devices:
+                if not frappe.db.exists("Biometric Device", device):
+                    continue
+                command = start_user_import(device, restart=restart)
+                click.echo(f"{site}: device {device} imports users with command {command}")
+        finally:
+            frappe.destroy()
+
+@click.command("rebuild-biometric-device-registry")
+@click.option("--workers", default=8, type=int, help="Sites scanned in parallel")
+@click.option("--dry-run", is_flag=True, default=False, help="Only report how the device registry differs from the sites")
+def rebuild_biometric_device_registry(workers, dry_run):
+    """Rebuild the bench-wide device to site map from every site and report device IDs claimed by several sites."""
+    from biometric_integration.services.device_registry import rebuild_device_registry
+
+    stats = rebuild_device_registry(workers=workers, dry_run=dry_run)
+    click.echo(json.dumps(stats, indent=2))
+    if stats["failed_sites"]:
+        click.echo("Some sites could not be scanned, the device registry was left as it was.", err=True)
+
+commands = [
+    replay_biometric_data,
+    reconcile_biometric_users,
+    import_biometric_users,
+    rebuild_biometric_device_registry,
+]
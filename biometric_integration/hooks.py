@@ -248,3 +248,16 @@ doc_events = {
         "on_trash": "biometric_integration.services.device_mapping.validate_and_update_device_site_map",
     }
 }
+
+scheduler_events = {
+    "cron": {
+        "*/5 * * * *": [
+            "biometric_integration.services.pull_sync.sync_all_devices",
+            "biometric_integration.services.attendance_queue.process_dirty_attendance",
+        ],
+    },
+    "daily": [
+        "biometric_integration.services.user_reconciler.reconcile_all_devices",
+        "biometric_integration.services.command_processor.archive_closed_commands",
+    ],
+}
@@ -0,0 +1,70 @@
+import frappe
+from frappe.utils import now_datetime
+from biometric_integration.services.enroll_templates import get_template_count, get_template_hash
+
+BATCH_SIZE = 200
+
+def execute():
+    """Move enroll payloads from Biometric Device User.ebkn_enroll_data_json to Biometric Device User Template."""
+    if not frappe.db.has_column("Biometric Device User", "ebkn_enroll_data_json"):
+        return
+
+    while True:
+        users = frappe.db.sql(
+            """
+            SELECT name, ebkn_enroll_data_json FROM `tabBiometric Device User`
+            WHERE ebkn_enroll_data_json IS NOT NULL AND ebkn_enroll_data_json != ''
+            LIMIT %s
+            """,
+            BATCH_SIZE,
+            as_dict=True,
+        )
+        if not users:
+            break
+
+        now = now_datetime()
+        existing = set(frappe.get_all(
+            "Biometric Device User Template",
+            filters={"name": ["in", [user.name for user in users]]},
+            pluck="name",
+        ))
+        values = []
+        summaries = {}
+        for user in users:
+            try:
+                template_count = get_template_count(frappe.parse_json(user.ebkn_enroll_data_json))
+            except ValueError:
+                template_count = 0
+            template_hash = get_template_hash(user.ebkn_enroll_data_json)
+
+            if user.name not in existing:
+                values.append([
+                    user.name, user.name, "EBKN", template_count, template_hash, user.ebkn_enroll_data_json,
+                    now, now, "Administrator", "Administrator",
+                ])
+            summaries[user.name] = (template_count, template_hash)
+
+        if values:
+            frappe.db.bulk_insert(
+                "Biometric Device User Template",
+                fields=[
+                    "name", "biometric_device_user", "brand", "template_count", "template_hash", "enroll_data_json",
+                    "creation", "modified", "owner", "modified_by",
+                ],
+                values=values,
+            )
+        # One UPDATE per batch stores the summaries and clears the leftover column, the field is gone from the doctype
+        cases = " ".join(["WHEN %s THEN %s"] * len(summaries))
+        placeholders = ", ".join(["%s"] * len(summaries))
+        count_values = [value for name, (count, _) in summaries.items() for value in (name, count)]
+        hash_values = [value for name, (_, template_hash) in summaries.items() for value in (name, template_hash)]
+        frappe.db.sql(
+            f"""UPDATE `tabBiometric Device User`
+            SET enroll_template_count = CASE name {cases} END,
+                enroll_template_hash = CASE name {cases} END,
+                enroll_data_updated_on = %s,
+                ebkn_enroll_data_json = NULL
+            WHERE name IN ({placeholders})""",
+            count_values + hash_values + [now] + list(summaries),
+        )
+        frappe.db.commit()
@@ -0,0 +1,136 @@
+import threading
+import time
+
+# Requests handled at the same time before new ones are shed
+MAX_IN_FLIGHT = 64
+# Share of MAX_IN_FLIGHT one site's requests may hold, so requests queued behind a slow site leave slots for the others
+MAX_SITE_SHARE = 0.25
+# Sustained requests per second allowed per device, and how many may arrive back to back
+DEVICE_RATE = 10.0
+DEVICE_BURST = 50
+# Buckets of devices idle for this many seconds are dropped
+IDLE_BUCKET_TTL = 600
+
+SHED_OVERLOAD = "overload"
+SHED_RATE_LIMITED = "rate_limited"
+SHED_PROTOCOL_BUSY = "protocol_busy"
+SHED_MEMORY = "memory"
+SHED_SITE_UNAVAILABLE = "site_unavailable"
+SHED_SITE_SHARE = "site_share"
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class AdmissionController:
+    """
+    Decide whether the listener takes a request now or sheds it so the device retries later.
+
+    A request is shed when MAX_IN_FLIGHT requests are already being handled, when its site already
+    holds its share of them, or when its device has used up its token bucket. Every admitted request
+    must be released with the site it was admitted for.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, device_rate=DEVICE_RATE, device_burst=DEVICE_BURST,
+                 site_share=MAX_SITE_SHARE):
+        self.max_in_flight = max_in_flight
+        self.max_site_in_flight = max(1, int(max_in_flight * site_share))
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.in_flight = 0
+        self.in_flight_by_site = {}
+        self.admitted = 0
+        self.shed = {
+            SHED_OVERLOAD: 0, SHED_RATE_LIMITED: 0, SHED_PROTOCOL_BUSY: 0, SHED_MEMORY: 0,
+            SHED_SITE_UNAVAILABLE: 0, SHED_SITE_SHARE: 0,
+        }
+        self.shed_by_device = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def admit(self, dev_id=None, site_name=None):
+        """
+        Try to admit a request.
+
+        Args:
+            dev_id (str): The device sending the request, None if unknown.
+            site_name (str): The site the device is mapped to, None if unmapped.
+
+        Returns:
+            str: None if admitted, otherwise the reason the request is shed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune > IDLE_BUCKET_TTL:
+                self._prune(now)
+
+            if self.in_flight >= self.max_in_flight:
+                return self._record_shed(SHED_OVERLOAD, dev_id)
+
+            if site_name and self.in_flight_by_site.get(site_name, 0) >= self.max_site_in_flight:
+                return self._record_shed(SHED_SITE_SHARE, dev_id)
+
+            if dev_id:
+                bucket = self._buckets.get(dev_id)
+                if bucket is None:
+                    bucket = self._buckets[dev_id] = TokenBucket(self.device_rate, self.device_burst, now)
+                if not bucket.take(now):
+                    return self._record_shed(SHED_RATE_LIMITED, dev_id)
+
+            self.in_flight += 1
+            if site_name:
+                self.in_flight_by_site[site_name] = self.in_flight_by_site.get(site_name, 0) + 1
+            self.admitted += 1
+            return None
+
+    def release(self, site_name=None):
+        with self._lock:
+            self.in_flight -= 1
+            if site_name:
+                remaining = self.in_flight_by_site[site_name] - 1
+                if remaining:
+                    self.in_flight_by_site[site_name] = remaining
+                else:
+                    del self.in_flight_by_site[site_name]
+
+    def record_shed(self, reason, dev_id=None):
+        with self._lock:
+            return self._record_shed(reason, dev_id)
+
+    def _record_shed(self, reason, dev_id):
+        self.shed[reason] += 1
+        if dev_id:
+            self.shed_by_device[dev_id] = self.shed_by_device.get(dev_id, 0) + 1
+        return reason
+
+    def _prune(self, now):
+        self._last_prune = now
+        for dev_id, bucket in list(self._buckets.items()):
+            if now - bucket.updated > IDLE_BUCKET_TTL:
+                del self._buckets[dev_id]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "max_site_in_flight": self.max_site_in_flight,
+                "in_flight_by_site": dict(self.in_flight_by_site),
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "shed_by_device": dict(sorted(self.shed_by_device.items(), key=lambda item: item[1], reverse=True)[:20]),
+            }
+
+admission_controller = AdmissionController()
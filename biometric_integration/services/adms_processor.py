@@ -0,0 +1,148 @@
+from biometric_integration.services.create_checkin import create_employee_checkins
+from biometric_integration.services.device_mapping import get_biometric_assets_dir, get_site_for_device
+from biometric_integration.services.punch_records import build_punches, normalize_log_types, parse_iso_timestamps, parse_user_ids
+from urllib.parse import urlsplit, parse_qs
+import threading
+import logging
+import json
+import os
+
+# ATTLOG status values that mean the employee is coming in (check-in, break-in, overtime-in)
+IN_STATUSES = {"0", "3", "4"}
+ADMS_TABLES = ("ATTLOG", "OPERLOG", "ATTPHOTO")
+
+_stamp_lock = threading.Lock()
+
+def get_adms_stamp_map_path():
+    return os.path.join(get_biometric_assets_dir(), "adms_stamps.json")
+
+def load_adms_stamp_map():
+    file_path = get_adms_stamp_map_path()
+    if os.path.exists(file_path):
+        try:
+            with open(file_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error("Error loading ADMS stamp map: %s", e)
+            return {}
+    return {}
+
+def save_adms_stamp_map(stamp_map):
+    file_path = get_adms_stamp_map_path()
+    tmp_path = f"{file_path}.tmp"
+    try:
+        # A crash mid-write must not leave a truncated map, the device would resend everything
+        with open(tmp_path, "w") as f:
+            json.dump(stamp_map, f, indent=4)
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        logging.error("Error saving ADMS stamp map: %s", e)
+
+def get_stamps(serial):
+    return load_adms_stamp_map().get(serial, {})
+
+def set_stamp(serial, table, stamp):
+    with _stamp_lock:
+        stamp_map = load_adms_stamp_map()
+        stamp_map.setdefault(serial, {})[table] = stamp
+        save_adms_stamp_map(stamp_map)
+
+def reply_text(body="OK", status=200):
+    return body, status, {"Content-Type": "text/plain"}
+
+def parse_attlog(text):
+    """
+    Parse a whole ATTLOG upload in one pass.
+
+    Each line is `PIN<TAB>YYYY-MM-DD HH:MM:SS<TAB>status<TAB>verify<TAB>workcode...`.
+
+    Args:
+        text (str): The request body.
+
+    Returns:
+        list: Punch records.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    rows = [line.split("\t") for line in lines]
+    records, rejected = build_punches(
+        parse_user_ids([fields[0] for fields in rows]),
+        parse_iso_timestamps([fields[1] if len(fields) > 1 else None for fields in rows]),
+        normalize_log_types([fields[2].strip() if len(fields) > 2 else "0" for fields in rows], IN_STATUSES),
+    )
+    for position in rejected:
+        logging.warning("Skipping malformed ATTLOG line: %r", lines[position])
+    return records
+
+def handle_adms(request, raw_data, headers):
+    """
+    Handle a ZKTeco ADMS (push SDK) request on /iclock/cdata, /iclock/getrequest or /iclock/devicecmd.
+
+    Args:
+        request (BaseHTTPRequestHandler): The request, used for its method and path.
+        raw_data (bytes): The request body.
+        headers (dict): The HTTP headers.
+
+    Returns:
+        tuple: Response body, HTTP status code, and headers.
+    """
+    try:
+        url = urlsplit(request.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        serial = query.get("SN")
+
+        if not serial:
+            logging.error("ADMS request without SN.")
+            return reply_text("ERROR", 400)
+
+        device_info = get_site_for_device(serial)
+        if not device_info or device_info.get("disabled"):
+            logging.error("ADMS request from unknown or disabled device %s.", serial)
+            return reply_text("ERROR", 403)
+
+        if url.path.endswith("/cdata"):
+            if request.command == "GET":
+                return handle_options(serial)
+            return handle_cdata_upload(serial, query, raw_data)
+
+        # Device commands are not issued to ZKTeco terminals yet
+        return reply_text("OK")
+
+    except Exception as e:
+        logging.error("Error in handle_adms: %s", e, exc_info=True)
+        return reply_text("ERROR", 400)
+
+def handle_options(serial):
+    """Answer the device's start-up handshake with its options and the last stamps we stored."""
+    stamps = get_stamps(serial)
+    lines = [f"GET OPTION FROM: {serial}"]
+    lines += [f"{table}Stamp={stamps.get(table) or 'None'}" for table in ADMS_TABLES]
+    lines += [
+        "ErrorDelay=30",
+        "Delay=10",
+        "TransTimes=00:00;14:05",
+        "TransInterval=1",
+        "TransFlag=TransData AttLog OpLog",
+        "Realtime=1",
+        "Encrypt=None",
+    ]
+    return reply_text("\n".join(lines))
+
+def handle_cdata_upload(serial, query, raw_data):
+    table = query.get("table")
+    stamp = query.get("Stamp")
+    text = raw_data.decode("utf-8", errors="replace")
+
+    if table == "ATTLOG":
+        records = parse_attlog(text)
+        if not create_employee_checkins(records, device_id=serial):
+            # No OK and no new stamp, the device uploads the same batch again
+            return reply_text("ERROR")
+        logging.info("Stored %s ADMS attendance logs from device %s", len(records), serial)
+        count = len(records)
+    else:
+        count = len([line for line in text.splitlines() if line.strip()])
+
+    if stamp and table in ADMS_TABLES:
+        set_stamp(serial, table, stamp)
+
+    return reply_text(f"OK: {count}")
@@ -0,0 +1,99 @@
+import logging
+import os
+import threading
+from biometric_integration.services.device_mapping import get_biometric_assets_dir
+from biometric_integration.services.raw_archive import get_raw_data_dir
+from biometric_integration.services.state_backend import BLOCK_SEQUENCE, PARTIAL_DATA, get_state_backend
+
+# Seconds after its last block that an unfinished transfer is considered abandoned
+PARTIAL_TRANSFER_TTL = 15 * 60
+# Bytes biometric_assets may use before the oldest raw request logs are deleted
+ASSETS_DISK_QUOTA = 5 * 1024 * 1024 * 1024
+SWEEP_INTERVAL = 300
+
+_sweeper_stop = threading.Event()
+
+def sweep_partial_transfers(ttl=PARTIAL_TRANSFER_TTL):
+    """
+    Delete partial transfers and sequence entries that have not received a block for `ttl` seconds.
+
+    A shared state backend expires them on its own, this only has work to do with local files.
+
+    Returns:
+        dict: Number of expired sequence entries and partial transfers removed.
+    """
+    backend = get_state_backend()
+    sequences = backend.expire_entries(BLOCK_SEQUENCE, ttl)
+    live = set(backend.get_all(BLOCK_SEQUENCE))
+    files = backend.expire_blobs(PARTIAL_DATA, ttl, keep=live)
+    return {"sequences": sequences, "files": files}
+
+def get_directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def enforce_disk_quota(quota=ASSETS_DISK_QUOTA):
+    """
+    Delete the oldest raw request logs until biometric_assets is within `quota` bytes.
+
+    Raw logs are named by the time they were received, so name order is age order and a
+    body and its metadata sidecar are removed together.
+
+    Returns:
+        dict: Bytes used before the sweep, and files and bytes removed.
+    """
+    used = get_directory_size(get_biometric_assets_dir())
+    stats = {"used": used, "files": 0, "bytes": 0}
+    if used <= quota:
+        return stats
+
+    with os.scandir(get_raw_data_dir()) as entries:
+        raw_files = sorted((entry for entry in entries if entry.is_file()), key=lambda entry: entry.name)
+
+    for entry in raw_files:
+        if used - stats["bytes"] <= quota:
+            break
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        stats["files"] += 1
+        stats["bytes"] += size
+
+    if used - stats["bytes"] > quota:
+        logging.warning("biometric_assets uses %s bytes after removing all raw logs, quota is %s", used - stats['bytes'], quota)
+    return stats
+
+def sweep_assets():
+    """Expire abandoned transfers and bring biometric_assets within its disk quota."""
+    transfers = sweep_partial_transfers()
+    quota = enforce_disk_quota()
+    if transfers["sequences"] or transfers["files"] or quota["files"]:
+        logging.info("Assets sweep: expired %s, removed raw logs %s", transfers, quota)
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    """Start the background thread that sweeps biometric_assets every `interval` seconds."""
+    _sweeper_stop.clear()
+
+    def run():
+        while True:
+            try:
+                sweep_assets()
+            except Exception as e:
+                logging.error("Error in assets sweeper: %s", e, exc_info=True)
+            if _sweeper_stop.wait(interval):
+                return
+
+    thread = threading.Thread(target=run, name="biometric-assets-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+def stop_sweeper():
+    _sweeper_stop.set()
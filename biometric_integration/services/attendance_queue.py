@@ -0,0 +1,119 @@
+import itertools
+import logging
+import frappe
+import redis
+from frappe.utils import getdate, now_datetime
+
+# Redis set of "<employee>|<shift date>" whose attendance must be recomputed
+DIRTY_ATTENDANCE_KEY = "biometric_integration:dirty_attendance"
+# Pairs taken from the set per round of the coalescing job
+ATTENDANCE_BATCH_SIZE = 500
+
+def mark_attendance_dirty(pairs):
+    """
+    Record that the attendance of these employees on these shift dates needs recomputing.
+
+    Pairs arriving in many batches before the job runs collapse into one entry each.
+
+    Args:
+        pairs (iterable): (employee, shift date) tuples.
+    """
+    members = {f"{employee}|{getdate(shift_date)}" for employee, shift_date in pairs if employee and shift_date}
+    if members:
+        frappe.cache().sadd(DIRTY_ATTENDANCE_KEY, *members)
+
+def take_dirty_attendance(count=ATTENDANCE_BATCH_SIZE):
+    """Pop up to `count` dirty (employee, shift date) pairs."""
+    cache = frappe.cache()
+    # RedisWrapper.spop takes no count, pop through a plain client on the same pool, from the key sadd wrote to
+    client = redis.Redis(connection_pool=cache.connection_pool)
+    members = client.spop(cache.make_key(DIRTY_ATTENDANCE_KEY), count) or []
+    pairs = []
+    for member in members:
+        employee, shift_date = frappe.safe_decode(member).split("|", 1)
+        pairs.append((employee, getdate(shift_date)))
+    return pairs
+
+def get_attendance_processor():
+    """
+    Get the HRMS helpers that mark attendance from check-ins, or None if HRMS is not installed.
+    """
+    try:
+        from hrms.hr.doctype.employee_checkin.employee_checkin import mark_attendance_and_link_log
+    except ImportError:
+        return None
+    return mark_attendance_and_link_log
+
+def recompute_attendance(pairs, mark_attendance_and_link_log):
+    """
+    Mark attendance for the given pairs from their unlinked check-ins, the way HRMS auto attendance does
+    for a whole shift type, but touching only these employees.
+
+    Returns:
+        list: Pairs whose shift has not ended yet, to be processed again later.
+    """
+    now = now_datetime()
+    pending = []
+
+    for employee, shift_date in pairs:
+        logs = frappe.get_all(
+            "Employee Checkin",
+            fields="*",
+            filters={
+                "employee": employee,
+                "shift_start": ["between", [f"{shift_date} 00:00:00", f"{shift_date} 23:59:59"]],
+                "shift": ["is", "set"],
+                "attendance": ["is", "not set"],
+                "skip_auto_attendance": 0,
+            },
+            order_by="shift, time",
+        )
+        for shift, shift_logs in itertools.groupby(logs, key=lambda log: log.shift):
+            shift_logs = list(shift_logs)
+            shift_type = frappe.get_cached_doc("Shift Type", shift)
+            if not shift_type.enable_auto_attendance:
+                continue
+            if shift_logs[0].shift_actual_end and shift_logs[0].shift_actual_end > now:
+                # More punches may still come, decide once the shift is over
+                pending.append((employee, shift_date))
+                continue
+            if hasattr(shift_type, "should_mark_attendance") and not shift_type.should_mark_attendance(employee, shift_date):
+                continue
+
+            attendance_status, working_hours, late_entry, early_exit, in_time, out_time = shift_type.get_attendance(shift_logs)
+            mark_attendance_and_link_log(
+                shift_logs, attendance_status, shift_date, working_hours, late_entry, early_exit, in_time, out_time, shift
+            )
+
+    return pending
+
+def process_dirty_attendance():
+    """
+    Scheduled job that recomputes attendance only for the employees and shift dates that received punches,
+    so its cost follows the number of new punches rather than headcount.
+    """
+    mark_attendance_and_link_log = get_attendance_processor()
+    if not mark_attendance_and_link_log:
+        return
+
+    processed = 0
+    pending = []
+    while True:
+        pairs = take_dirty_attendance()
+        if not pairs:
+            break
+        try:
+            pending.extend(recompute_attendance(pairs, mark_attendance_and_link_log))
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            logging.error("Error recomputing attendance: %s", e, exc_info=True)
+            # Keep them for the next run
+            pending.extend(pairs)
+            break
+        processed += len(pairs)
+
+    # Re-queued only after the loop, or the same unfinished shifts would be popped again
+    mark_attendance_dirty(pending)
+    if processed:
+        logging.info("Recomputed attendance for %s employee shift dates, %s left for later", processed, len(pending))
@@ -1,12 +1,164 @@
 import logging
 import frappe
-import base64
-import json
+import threading
+from collections import deque
+from frappe.utils import add_days, add_to_date, now_datetime
 from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import get_device_employee_id
+from biometric_integration.services.user_reconciler import record_synced_digest
+from biometric_integration.services.command_state import QUEUED_COMMAND_STATUSES, transition_command
+from biometric_integration.services.device_mapping import update_device_site_map_entry
+from biometric_integration.services.user_commands import get_enable_user_command, get_set_user_info_command
+from biometric_integration.services.user_import import IMPORT_COMMAND_TYPE, IMPORT_FAILED, get_next_import_step, handle_import_result
+
+CLOSED_COMMAND_STATUSES = ["Completed", "Error", "Closed"]
+# Days a closed command stays in the queue table before it is moved to Biometric Device Command History
+COMMAND_ARCHIVE_AFTER_DAYS = 7
+COMMAND_ARCHIVE_BATCH_SIZE = 1000
+HISTORY_FIELDS = [
+    "biometric_device", "biometric_device_user", "employee", "brand", "no_of_attempts", "command_type",
+    "status", "priority", "initiated_on", "closed_on", "device_response", "target_digest",
+]
+
+# Commands prepared ahead per device, so a command chained into a result reply doesn't wait on document loads
+COMMAND_PREFETCH_SIZE = 4
+# Seconds a command handed to a device waits for its result before it is sent again
+COMMAND_ACK_TIMEOUT = 5 * 60
+
+_prefetch_buffers = {}
+_prefetch_lock = threading.Lock()
+
+def get_next_commands(device_id, limit=1):
+    """
+    Names of the next commands to send to the device: highest priority first, first in first out within a priority.
+    """
+    return frappe.get_all(
+        "Biometric Device Command",
+        filters={"biometric_device": device_id, "status": ["in", QUEUED_COMMAND_STATUSES]},
+        order_by="priority desc, initiated_on asc, creation asc",
+        limit_page_length=limit,
+        pluck="name",
+    )
+
+def get_next_command(device_id):
+    commands = get_next_commands(device_id)
+    return commands[0] if commands else None
+
+def has_unacknowledged_command(device_id):
+    """
+    Whether a command handed to the device is still waiting for its result.
+
+    A command whose result did not arrive within COMMAND_ACK_TIMEOUT is queued again to be resent.
+    """
+    command = frappe.db.get_value(
+        "Biometric Device Command",
+        {"biometric_device": device_id, "status": "Processing"},
+        ["name", "modified", "no_of_attempts"],
+        as_dict=True,
+    )
+    if not command:
+        return False
+    if command.modified > add_to_date(now_datetime(), seconds=-COMMAND_ACK_TIMEOUT):
+        return True
+
+    logging.warning("Command %s of device %s was not acknowledged, sending it again", command.name, device_id)
+    transition_command(
+        command.name, "Reattempt", {"no_of_attempts": (command.no_of_attempts or 0) + 1}, from_statuses=["Processing"]
+    )
+    return False
+
+def try_prepare_command(command_name):
+    """
+    Build a command's data, moving the command to Error if it can't be built so the commands behind it still go out.
+
+    Returns:
+        dict: The command data, or None if the command was moved to Error.
+    """
+    try:
+        command_data = prepare_command_data(frappe.get_doc("Biometric Device Command", command_name))
+        error = None if command_data else "Command type not supported for this device brand"
+    except Exception as e:
+        logging.error("Error preparing command %s: %s", command_name, e, exc_info=True)
+        command_data, error = None, str(e)
+
+    if error:
+        transition_command(
+            command_name, "Error", {"device_response": error, "closed_on": now_datetime()}, from_statuses=QUEUED_COMMAND_STATUSES
+        )
+    return command_data
+
+def prefetch_commands(device_id):
+    """
+    Prepare the device's next COMMAND_PREFETCH_SIZE commands and replace its prefetch buffer with them.
+
+    Returns:
+        int: Number of queued commands found, including those moved to Error because they could not be prepared.
+    """
+    command_names = get_next_commands(device_id, COMMAND_PREFETCH_SIZE)
+    buffer = deque()
+    for command_name in command_names:
+        if frappe.db.get_value("Biometric Device Command", command_name, "command_type") == IMPORT_COMMAND_TYPE:
+            # An import's next step depends on its cursor at the time it is sent
+            buffer.append((command_name, None))
+            continue
+        command_data = try_prepare_command(command_name)
+        if command_data:
+            buffer.append((command_name, command_data))
+
+    with _prefetch_lock:
+        _prefetch_buffers[device_id] = buffer
+    return len(command_names)
+
+def take_prefetched_command(device_id):
+    """
+    Pop the next prepared command of the device and mark it Processing, skipping commands that were
+    closed or handed out since they were buffered.
+
+    Args:
+        device_id (str): The ID of the biometric device.
+    """
+    while True:
+        with _prefetch_lock:
+            buffer = _prefetch_buffers.get(device_id)
+            if not buffer:
+                return None
+            command_name, command_data = buffer.popleft()
+        command_data = command_data or try_prepare_command(command_name)
+        if command_data and transition_command(command_name, "Processing", from_statuses=QUEUED_COMMAND_STATUSES):
+            return command_data
+
+def clear_prefetched_commands(device_id):
+    with _prefetch_lock:
+        _prefetch_buffers.pop(device_id, None)
+
+def get_device_command(device_id):
+    """
+    Hand out the device's next command, marking it Processing. The caller commits.
+
+    Nothing is handed out while the device still owes the result of an earlier command.
+
+    Returns:
+        dict: Command data, or None if there is nothing to send.
+    """
+    if has_unacknowledged_command(device_id):
+        return None
+
+    command_data = take_prefetched_command(device_id)
+    if command_data:
+        return command_data
+
+    # Buffer the next pending or reattempt commands, again while the ones found could not be sent
+    while prefetch_commands(device_id):
+        command_data = take_prefetched_command(device_id)
+        if command_data:
+            return command_data
+
+    logging.info("No pending or reattempt commands found for device %s.", device_id)
+    update_has_pending_command(device_id, 0)
+    return None
 
 def process_device_command(device_id):
     """
-    Process the next available command for the given biometric device.
+    Process the next available command for the given biometric device, committing every transition it made.
 
     Args:
         device_id (str): The ID of the biometric device.
@@ -15,61 +167,94 @@ def process_device_command(device_id):
         dict: Contains command data if a command was processed, otherwise None.
     """
     try:
-        # Check for the next pending or reattempt command
-        command_name = frappe.db.exists("Biometric Device Command", {"biometric_device": device_id, "status": ["in", ["Pending", "Reattempt"]]})
-        if not command_name:
-            logging.info(f"No pending or reattempt commands found for device {device_id}.")
-            update_has_pending_command(device_id, 0)
-            return None
-
-        # Fetch the command document
-        command_doc = frappe.get_doc("Biometric Device Command", command_name)
-        return prepare_command_data(command_doc)
+        command_data = get_device_command(device_id)
+        frappe.db.commit()
+        return command_data
 
     except Exception as e:
-        logging.error(f"Error processing device command for device {device_id}: {str(e)}", exc_info=True)
+        frappe.db.rollback()
+        logging.error("Error processing device command for device %s: %s", device_id, e, exc_info=True)
         return None
 
-def handle_device_response(device_id, trans_id, cmd_return_code):
+def handle_device_response(device_id, trans_id, cmd_return_code, result_data=None):
     """
     Handle the response from the device after receiving a chunk.
 
+    Once a command completes, the device's next queued command is returned in the same reply,
+    so a backlog drains for as long as the device keeps acknowledging instead of one command per poll.
+    The completed command and the command chained to it are committed together.
+
     Args:
         device_id (str): The ID of the biometric device.
         trans_id (str): The transaction ID associated with the command.
         cmd_return_code (str): The return code from the device.
+        result_data (dict): The parsed result the device sent with the return code, if any.
 
     Returns:
-        dict: The next chunk data or confirmation of completion.
+        dict: The next chunk, the next command, or confirmation of completion.
     """
     try:
-        # Fetch the command document
-        command_doc = frappe.get_doc("Biometric Device Command", trans_id)
-
-        if cmd_return_code != "OK":
-            logging.error(f"Device {device_id} reported error for command {trans_id}. Return code: {cmd_return_code}")
-            command_doc.status = "Error"
-            command_doc.device_response = cmd_return_code
-            command_doc.save()
-            frappe.db.commit()
-            return {"response_code": "ERROR"}
-
-        # Prepare and send the next chunk
+        response = apply_device_response(device_id, trans_id, cmd_return_code, result_data)
+        frappe.db.commit()
+        return response
+
+    except Exception as e:
+        frappe.db.rollback()
+        logging.error("Error handling response for device %s and command %s: %s", device_id, trans_id, e, exc_info=True)
+        return {"response_code": "ERROR"}
+
+def apply_device_response(device_id, trans_id, cmd_return_code, result_data=None):
+    """Move the command on for the device's response and build the reply, see handle_device_response. The caller commits."""
+    # Fetch the command document
+    command_doc = frappe.get_doc("Biometric Device Command", trans_id)
+
+    if command_doc.command_type == IMPORT_COMMAND_TYPE:
+        next_step_data = handle_import_result(command_doc, cmd_return_code, result_data)
+        if next_step_data is IMPORT_FAILED:
+            return dict(IMPORT_FAILED)
+        if next_step_data:
+            # The device answered, restart the acknowledgement timeout for the next step
+            transition_command(trans_id, "Processing", from_statuses=["Processing"])
+            return next_step_data
+
+    elif cmd_return_code != "OK":
+        logging.error("Device %s reported error for command %s. Return code: %s", device_id, trans_id, cmd_return_code)
+        transition_command(trans_id, "Error", {"device_response": cmd_return_code, "closed_on": now_datetime()})
+        return {"response_code": "ERROR"}
+
+    else:
+        # Prepare and send the next chunk, only block transfers have more than one
         next_chunk_data = prepare_command_data(command_doc)
-        if next_chunk_data:
-            logging.info(f"Sending next chunk for command {trans_id} to device {device_id}.")
+        if next_chunk_data and "blk_no" in next_chunk_data:
+            logging.info("Sending next chunk for command %s to device %s.", trans_id, device_id)
             return next_chunk_data
 
-        logging.info(f"All chunks for command {trans_id} sent to device {device_id}. Command completed.")
-        command_doc.status = "Completed"
-        command_doc.device_response = "Success"
-        command_doc.save()
-        frappe.db.commit()
+    logging.info("All chunks for command %s sent to device %s. Command completed.", trans_id, device_id)
+    completed = transition_command(
+        trans_id,
+        "Completed",
+        {"device_response": "Success", "closed_on": now_datetime()},
+        on_applied=lambda: record_synced_digest(
+            command_doc.biometric_device_user, command_doc.biometric_device, command_doc.get("target_digest")
+        ),
+    )
+    if not completed:
+        # A repeated acknowledgement, the next command was already chained to the first one
+        logging.info("Command %s of device %s was already closed.", trans_id, device_id)
         return {"response_code": "OK"}
 
+    # Chain the next queued command into this reply, a failure there must not lose the acknowledgement
+    frappe.db.savepoint("chain_command")
+    try:
+        next_command_data = get_device_command(device_id)
     except Exception as e:
-        logging.error(f"Error handling response for device {device_id} and command {trans_id}: {str(e)}", exc_info=True)
-        return {"response_code": "ERROR"}
+        frappe.db.rollback(save_point="chain_command")
+        logging.error("Error chaining the next command to device %s: %s", device_id, e, exc_info=True)
+        next_command_data = None
+    if next_command_data:
+        logging.info("Chaining command %s to device %s.", next_command_data.get("trans_id"), device_id)
+        return next_command_data
+    return {"response_code": "OK"}
 
 def update_has_pending_command(device_id, has_pending_command):
     """
@@ -78,78 +263,80 @@ def update_has_pending_command(device_id, has_pending_command):
     Args:
         device_id (str): The ID of the biometric device.
         has_pending_command (int): The value to set (0 or 1).
+
+    The caller commits.
     """
     try:
-        device_doc = frappe.get_doc("Biometric Device", device_id)
-        device_doc.has_pending_command = has_pending_command
-        device_doc.save()
-        frappe.db.commit()
-        logging.info(f"Updated has_pending_command for device {device_id} to {has_pending_command}.")
+        # Neither the device document nor its hooks are needed for a flag, set it and its map entry directly
+        frappe.db.set_value("Biometric Device", device_id, "has_pending_command", has_pending_command, update_modified=False)
+        update_device_site_map_entry(device_id, has_pending_command=has_pending_command)
+        logging.info("Updated has_pending_command for device %s to %s.", device_id, has_pending_command)
     except Exception as e:
-        logging.error(f"Error updating has_pending_command for device {device_id}: {str(e)}", exc_info=True)
+        logging.error("Error updating has_pending_command for device %s: %s", device_id, e, exc_info=True)
+
+# Builders of the data sent to a device, per brand and command type. Commands of other types are never sent,
+# their device bodies are not implemented yet.
+COMMAND_BUILDERS = {
+    ("EBKN", "Create User"): get_set_user_info_command,
+    ("EBKN", "Update User Data"): get_set_user_info_command,
+    ("EBKN", "Update User Status"): get_enable_user_command,
+    ("EBKN", IMPORT_COMMAND_TYPE): get_next_import_step,
+}
+
+def is_command_supported(brand, command_type):
+    return (brand, command_type) in COMMAND_BUILDERS
 
 def prepare_command_data(command_doc):
+    """
+    Build the data sent to the device for a command.
 
-    try:
-        device_user = frappe.get_doc("Biometric Device User", command_doc.biometric_device_user)
-    except frappe.DoesNotExistError:
-        device_user = None
-
-    if command_doc.brand == "EBKN" and command_doc.command_type == "Create User":
-        employee = frappe.get_doc("Employee", command_doc.employee)
-        if employee:
-            return {
-                "trans_id": "5434",
-                "cmd_code": "DELETE_USER",
-                # Escaped JSON
-                "body": json.dumps(json.dumps({"user_id": "00000001"}))
-            }
-        else:
-            return None
-    
-    if command_doc.brand == "EBKN" and command_doc.command_type == "":
-
-        # Fetch the binary enroll data attachment
-        file_url = "/file/d9430b1af2/enroll_data_5.bin"#device_user.ebkn_enroll_data
-
-        # Get file content using the File DocType
-        file_id = frappe.db.get_value("File", {"file_url": file_url}, "name")
-        if not file_id:
-            logging.error("No file found for the given file URL.")
-            raise FileNotFoundError("No file found for the given file URL.")
-
-        file_doc = frappe.get_doc("File", file_id)
-        data_bytes = file_doc.get_content()
-
-        # Split data into chunks
-        max_chunk_size = 1024  # Define chunk size limit
-        chunks = [data_bytes[i:i + max_chunk_size] for i in range(0, len(data_bytes), max_chunk_size)]
-
-        # Determine next chunk to send
-        last_sent = command_doc.last_sent_data_block or 0
-        if last_sent >= len(chunks):
-            logging.info(f"All chunks sent for command {command_doc.name}.")
-            return None
-
-        next_chunk = chunks[last_sent]
-
-        # Determine block number
-        blk_no = last_sent + 1  # Start block numbers from 1
-        if last_sent == len(chunks) - 1:  # If it's the final block
-            blk_no = 0
-
-        # Log debug information
-        logging.debug(f"Sending to device: trans_id={command_doc.name}, blk_no={blk_no}, chunk_size={len(next_chunk)}")
-
-        # Update command document with the last sent block
-        command_doc.last_sent_data_block = last_sent + 1
-        #command_doc.save()
-        #frappe.db.commit()
-
-        return {
-            "trans_id": command_doc.name,
-            "cmd_code": "SET_USER_INFO",
-            "blk_no": blk_no,
-            "body": next_chunk
-        }
-    return None
\ No newline at end of file
+    Returns:
+        dict: The command data, or None if no builder exists for the command's brand and type.
+    """
+    builder = COMMAND_BUILDERS.get((command_doc.brand, command_doc.command_type))
+    return builder(command_doc) if builder else None
+
+def archive_closed_commands(older_than_days=COMMAND_ARCHIVE_AFTER_DAYS, batch_size=COMMAND_ARCHIVE_BATCH_SIZE):
+    """
+    Move commands closed more than `older_than_days` ago to Biometric Device Command History, a batch per transaction,
+    so the queue table only holds open and recently closed commands.
+
+    Returns:
+        int: Number of commands archived.
+    """
+    cutoff = add_days(now_datetime(), -older_than_days)
+    archived = 0
+
+    while True:
+        commands = frappe.get_all(
+            "Biometric Device Command",
+            filters={"status": ["in", CLOSED_COMMAND_STATUSES], "modified": ["<", cutoff]},
+            fields=["name", "creation", "owner"] + HISTORY_FIELDS,
+            order_by="modified asc",
+            limit_page_length=batch_size,
+        )
+        if not commands:
+            break
+
+        now = now_datetime()
+        values = [
+            [command.name, command.name, command.creation, now, command.owner, "Administrator"]
+            + [command.get(field) for field in HISTORY_FIELDS]
+            for command in commands
+        ]
+        frappe.db.bulk_insert(
+            "Biometric Device Command History",
+            fields=["name", "command", "creation", "modified", "owner", "modified_by"] + HISTORY_FIELDS,
+            values=values,
+            ignore_duplicates=True,
+        )
+        frappe.db.delete("Biometric Device Command", {"name": ["in", [command.name for command in commands]]})
+        frappe.db.commit()
+
+        archived += len(commands)
+        if len(commands) < batch_size:
+            break
+
+    if archived:
+        logging.info("Archived %s closed biometric device commands", archived)
+    return archived
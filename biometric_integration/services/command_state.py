@@ -0,0 +1,89 @@
+import frappe
+from frappe.utils import now_datetime
+
+QUEUED_COMMAND_STATUSES = ["Pending", "Reattempt"]
+OPEN_COMMAND_STATUSES = QUEUED_COMMAND_STATUSES + ["Processing"]
+# Statuses a command may move to from each open status, closed commands never change again
+TRANSITIONS = {
+    "Pending": {"Processing", "Completed", "Error", "Reattempt", "Closed"},
+    "Reattempt": {"Processing", "Completed", "Error", "Closed"},
+    "Processing": {"Completed", "Error", "Reattempt", "Closed"},
+}
+# Transitions kept in the command's version history, the rest are routine and would only bloat tabVersion
+VERSIONED_STATUSES = {"Error", "Closed"}
+
+class InvalidTransition(Exception):
+    pass
+
+def get_allowed_from_statuses(status):
+    """The statuses a command can be in for it to move to `status`."""
+    from_statuses = [from_status for from_status, to_statuses in TRANSITIONS.items() if status in to_statuses]
+    if not from_statuses:
+        raise InvalidTransition(f"No command can move to status {status}")
+    return from_statuses
+
+def apply_transition(command_name, status, values=None, from_statuses=None, on_applied=None):
+    """
+    Move a command to `status` with a single guarded UPDATE, without loading the document or running hooks.
+
+    The update only matches while the command is still in one of `from_statuses`, so a duplicate
+    or late acknowledgement can't move a closed command again.
+
+    Args:
+        command_name (str): The Biometric Device Command.
+        status (str): The new status.
+        values (dict): Other fields to set with the status.
+        from_statuses (list): Statuses the command is expected to be in, defaults to all that may move to `status`.
+        on_applied (callable): Called in the same transaction if the command did move.
+
+    Returns:
+        bool: True if the command moved, False if it was not in an expected status.
+    """
+    from_statuses = from_statuses or get_allowed_from_statuses(status)
+    updates = dict(values or {}, status=status, modified=now_datetime())
+
+    # The row stays locked until the transaction ends, so the status read is the one the update replaces
+    previous = frappe.db.get_value(
+        "Biometric Device Command", command_name, list(updates), as_dict=True, for_update=True
+    )
+    if not previous or previous.status not in from_statuses:
+        return False
+
+    assignments = ", ".join(f"`{field}` = %({field})s" for field in updates)
+    frappe.db.sql(
+        f"""
+        UPDATE `tabBiometric Device Command`
+        SET {assignments}
+        WHERE name = %(command_name)s
+        """,
+        dict(updates, command_name=command_name),
+    )
+
+    if status in VERSIONED_STATUSES:
+        add_version(command_name, previous, updates)
+    if on_applied:
+        on_applied()
+    return True
+
+def add_version(command_name, previous, updates):
+    changed = [[field, previous.get(field), value] for field, value in updates.items() if field != "modified" and previous.get(field) != value]
+    if not changed:
+        return
+    frappe.get_doc({
+        "doctype": "Version",
+        "ref_doctype": "Biometric Device Command",
+        "docname": command_name,
+        "data": frappe.as_json({"changed": changed}),
+    }).insert(ignore_permissions=True)
+
+def transition_command(command_name, status, values=None, from_statuses=None, on_applied=None):
+    """
+    Move a command to `status` on the request's own connection, see apply_transition.
+
+    Nothing is committed here: the caller commits once for its whole request, so a completed command,
+    the next command handed out and the device's pending flag all change in the same transaction.
+
+    Returns:
+        bool: True if the command moved, False if it was not in an expected status.
+    """
+    return apply_transition(command_name, status, values=values, from_statuses=from_statuses, on_applied=on_applied)
@@ -3,7 +3,10 @@ import logging
 import frappe
 from datetime import datetime
 from frappe.model.document import Document
-from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import get_erp_employee_id
+from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import get_erp_employee_id, get_settings
+from biometric_integration.services.employee_index import resolve_employees
+from biometric_integration.services.attendance_queue import mark_attendance_dirty
+from biometric_integration.services.prewarm import record_punches
 from biometric_integration.utils.site_session import init_site, destroy_site
 
 def create_employee_checkin(employee_field_value, timestamp, device_id=None, log_type=None):
@@ -12,7 +15,7 @@ def create_employee_checkin(employee_field_value, timestamp, device_id=None, log
 
     Args:
         employee_field_value (int): The unique value identifying the employee (attendance_device_id).
-        timestamp (str): The timestamp in '%Y-%m-%d %H:%M:%S' format.
+        timestamp (datetime|str): The punch time, a string in '%Y-%m-%d %H:%M:%S' format is parsed.
         device_id (str): The unique device ID to resolve which site to connect to.
         log_type (str): "IN" or "OUT" indicating check-in direction.
 
@@ -21,8 +24,33 @@ def create_employee_checkin(employee_field_value, timestamp, device_id=None, log
     """
     try:
         init_site(device_id=device_id)
+    except Exception as e:
+        logging.error("Could not initialize site for device %s: %s", device_id, e)
+        return False
+
+    try:
+        return insert_employee_checkin(employee_field_value, timestamp, device_id=device_id, log_type=log_type)
+    finally:
+        destroy_site()
+
+def insert_employee_checkin(employee_field_value, timestamp, device_id=None, log_type=None, commit=True):
+    """
+    Insert an Employee Checkin record in the site context that is already initialized.
+
+    Args:
+        employee_field_value (int): The unique value identifying the employee (attendance_device_id).
+        timestamp (datetime|str): The punch time, a string in '%Y-%m-%d %H:%M:%S' format is parsed.
+        device_id (str): The device the punch came from.
+        log_type (str): "IN" or "OUT" indicating check-in direction.
+        commit (bool): Commit the transaction after the insert.
+
+    Returns:
+        bool: True if the check-in was successfully created, False otherwise.
+    """
+    record_punches(1)
+    try:
         # Fetch settings with caching
-        settings = frappe.get_cached_doc("Biometric Integration Settings")
+        settings = get_settings()
 
         # Resolve ERP Employee ID using the provided device ID
         employee_id = get_erp_employee_id(employee_field_value)
@@ -32,20 +60,22 @@ def create_employee_checkin(employee_field_value, timestamp, device_id=None, log
                 logging.warning(f"Skipping check-in for unknown Employee ID: {employee_field_value}")
                 return False  # Skip processing as per settings
 
-            logging.info(f"Processing check-in for unknown Employee ID: {employee_field_value}")
+            logging.info("Processing check-in for unknown Employee ID: %s", employee_field_value)
 
         # Prepare the Employee Checkin document
         checkin = frappe.new_doc("Employee Checkin")
         checkin.employee = employee_id
         checkin.log_type = log_type
-        checkin.time = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+        checkin.time = timestamp if isinstance(timestamp, datetime) else datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
         checkin.device_id = device_id
 
         # Insert the document into the database
         checkin.insert()
-        frappe.db.commit()
-        destroy_site()
-        logging.info(f"Check-in successfully created for Employee {employee_id} at {timestamp}")
+        if checkin.get("shift_start"):
+            mark_attendance_dirty([(checkin.employee, checkin.shift_start)])
+        if commit:
+            frappe.db.commit()
+        logging.info("Check-in successfully created for Employee %s at %s", employee_id, timestamp)
         return True
 
     except frappe.exceptions.ValidationError as ve:
@@ -64,4 +94,109 @@ def create_employee_checkin(employee_field_value, timestamp, device_id=None, log
 
     except Exception as e:
         logging.error(f"Unexpected error creating check-in: {str(e)}", exc_info=True)
-        return False
\ No newline at end of file
+        return False
+
+def create_employee_checkins(records, device_id):
+    """
+    Create many Employee Checkin records from one device in the resolved site, committed together.
+
+    Args:
+        records (list): Punch records, see services.punch_records.
+        device_id (str): The unique device ID to resolve which site to connect to.
+
+    Returns:
+        bool: True if the whole batch was stored (duplicates and skipped unknowns included), False otherwise.
+    """
+    try:
+        init_site(device_id=device_id)
+    except Exception as e:
+        logging.error("Could not initialize site for device %s: %s", device_id, e)
+        return False
+
+    try:
+        return insert_employee_checkins(records, device_id=device_id)
+    finally:
+        destroy_site()
+
+def insert_employee_checkins(records, device_id=None, commit=True):
+    """
+    Insert many Employee Checkin records in the site context that is already initialized.
+
+    Employees are resolved through the cached employee index and duplicates are detected with one query,
+    then each new check-in is inserted as a document so its validation and hooks run, HRMS filling in the shift.
+    Each (employee, shift date) that received a punch is queued for attendance recomputation.
+
+    A check-in the doctype rejects, e.g. one without an employee, is logged and skipped so the rest of the batch is kept.
+
+    Args:
+        records (list): Punch records, see services.punch_records.
+        device_id (str): The device the punches came from.
+        commit (bool): Commit the transaction after the inserts.
+
+    Returns:
+        bool: True if the whole batch was stored (duplicates and skipped unknowns included), False otherwise.
+    """
+    if not records:
+        return True
+
+    record_punches(len(records))
+    try:
+        settings = get_settings()
+        employees = resolve_employees(record.employee_field_value for record in records)
+
+        rows = {}
+        for record in records:
+            employee = employees.get(str(record.employee_field_value))
+            if not employee and not settings.get("do_not_skip_unknown_employee_checkin"):
+                logging.warning("Skipping check-in for unknown Employee ID: %s", record.employee_field_value)
+                continue
+
+            employee_id = employee["name"] if employee else None
+            # The same punch may appear twice in one batch
+            rows.setdefault((employee_id, record.timestamp), record)
+
+        if rows:
+            existing = frappe.get_all(
+                "Employee Checkin",
+                filters={
+                    "employee": ["in", list({employee_id for employee_id, _ in rows if employee_id})],
+                    "time": ["in", list({timestamp for _, timestamp in rows})],
+                },
+                fields=["employee", "time"],
+            )
+            for checkin in existing:
+                if rows.pop((checkin.employee, checkin.time), None):
+                    logging.warning("Duplicate check-in detected for Employee %s at %s", checkin.employee, checkin.time)
+
+        inserted = 0
+        dirty_attendance = set()
+        for (employee_id, timestamp), record in rows.items():
+            frappe.db.savepoint("employee_checkin")
+            try:
+                checkin = frappe.get_doc({
+                    "doctype": "Employee Checkin",
+                    "employee": employee_id,
+                    "log_type": record.log_type,
+                    "time": timestamp,
+                    "device_id": device_id,
+                }).insert()
+            except frappe.exceptions.ValidationError as e:
+                frappe.db.rollback(save_point="employee_checkin")
+                logging.warning("Skipping check-in for Employee ID %s at %s: %s", record.employee_field_value, timestamp, e)
+                continue
+
+            inserted += 1
+            if checkin.get("shift_start"):
+                dirty_attendance.add((checkin.employee, checkin.shift_start))
+
+        mark_attendance_dirty(dirty_attendance)
+        if commit:
+            frappe.db.commit()
+        if inserted:
+            logging.info("Inserted %s check-ins from device %s", inserted, device_id)
+        return True
+
+    except Exception as e:
+        frappe.db.rollback()
+        logging.error("Unexpected error creating check-ins: %s", e, exc_info=True)
+        return False
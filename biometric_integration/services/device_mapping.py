@@ -1,7 +1,7 @@
 import frappe
-import json
 import os
 import logging
+from biometric_integration.services.state_backend import DEVICE_SITE, get_state_backend
 
 def get_biometric_assets_dir():
     """
@@ -13,57 +13,46 @@ def get_biometric_assets_dir():
     os.makedirs(assets_dir, exist_ok=True)
     return assets_dir
 
-def get_device_site_map_path():
-    """
-    Get the path to the device-site mapping JSON file (device_site.json) in the biometric_assets directory.
-    """
-    assets_dir = get_biometric_assets_dir()
-    file_path = os.path.join(assets_dir, "device_site.json")
-    logging.debug(f"Device site map path resolved to: {file_path}")
-    return file_path
-
 def load_device_site_map():
     """
-    Load the device-site map from the device_site.json file.
+    Load the whole device-site map from the state backend.
 
     Returns:
         dict: The device-site mapping.
     """
-    file_path = get_device_site_map_path()
-    logging.debug(f"Loading device site map from: {file_path}")
-
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r") as f:
-                device_site_map = json.load(f)
-                logging.debug(f"Loaded device site map: {device_site_map}")
-                return device_site_map
-        except Exception as e:
-            logging.error(f"Error loading device site map: {str(e)}")
-            return {}
-    else:
-        logging.error(f"Device site map file does not exist at: {file_path}. Returning empty map.")
+    try:
+        return get_state_backend().get_all(DEVICE_SITE)
+    except Exception as e:
+        logging.error("Error loading device site map: %s", e)
         return {}
 
 def save_device_site_map(device_site_map):
     """
-    Save the device-site map to the device_site.json file.
+    Replace the whole device-site map in the state backend.
 
     Args:
         device_site_map (dict): The device-site mapping to save.
     """
-    file_path = get_device_site_map_path()
-    logging.debug(f"Saving device site map to: {file_path}")
     try:
-        with open(file_path, "w") as f:
-            json.dump(device_site_map, f, indent=4)
-            logging.debug("Device site map saved successfully.")
+        get_state_backend().replace_all(DEVICE_SITE, device_site_map)
     except Exception as e:
         logging.error(f"Error saving device site map: {str(e)}")
 
+def update_device_site_map_entry(device_id, **values):
+    """
+    Update fields of a device's entry in the device-site map without going through the Biometric Device hooks.
+
+    Args:
+        device_id (str): The ID of the biometric device.
+        **values: Fields to set, e.g. has_pending_command.
+    """
+    # One atomic update, so a concurrent hook or listener writing the same entry is not overwritten
+    if not get_state_backend().update_fields(DEVICE_SITE, device_id, values):
+        logging.error("Device ID %s is not mapped to any site.", device_id)
+
 def get_site_for_device(device_id):
     """
-    Fetch the site name and has_pending_command for a given device ID using the JSON file.
+    Fetch the site name and has_pending_command for a given device ID from the state backend.
 
     Args:
         device_id (str): The ID of the biometric device.
@@ -72,15 +61,14 @@ def get_site_for_device(device_id):
         dict: Contains 'site_name' and 'has_pending_command' or None if not found.
     """
     try:
-        logging.debug(f"Fetching site for device ID: {device_id}")
-        device_site_map = load_device_site_map()
-        device_info = device_site_map.get(device_id)
+        logging.debug("Fetching site for device ID: %s", device_id)
+        device_info = get_state_backend().get(DEVICE_SITE, device_id)
 
         if not device_info:
             logging.error(f"Device ID {device_id} is not mapped to any site.")
             return None
 
-        logging.debug(f"Resolved site info for device ID {device_id}: {device_info}")
+        logging.debug("Resolved site info for device ID %s: %s", device_id, device_info)
         return {
             "site_name": device_info.get("site_name"),
             "disabled" : device_info.get("disabled", 0),
@@ -90,6 +78,20 @@ def get_site_for_device(device_id):
         logging.error(f"Error fetching site for device ID {device_id}: {str(e)}")
         return None
 
+def get_sites_for_devices(device_ids):
+    """
+    Resolve the sites of many devices with one state backend read.
+
+    Returns:
+        dict: Device ID mapped to its site name, unmapped devices are left out.
+    """
+    device_site_map = get_state_backend().get_many(DEVICE_SITE, list(device_ids))
+    return {
+        device_id: device_info["site_name"]
+        for device_id, device_info in device_site_map.items()
+        if device_info and device_info.get("site_name")
+    }
+
 def validate_and_update_device_site_map(doc, event=None):
     """
     Validate device ID uniqueness across sites and update or maintain the device-site mapping.
@@ -102,21 +104,18 @@ def validate_and_update_device_site_map(doc, event=None):
         event (str): The event type (on_update, on_trash).
     """
     try:
-        logging.debug(f"Validating device ID {doc.name} for event {event}")
-        device_site_map = load_device_site_map()
+        logging.debug("Validating device ID %s for event %s", doc.name, event)
+        backend = get_state_backend()
 
         if event == "on_update":
-            device_site_map[doc.name] = {
+            backend.set(DEVICE_SITE, doc.name, {
                 "site_name": frappe.local.site,
                 "disabled": doc.disabled or 0,
                 "has_pending_command": doc.has_pending_command or 0
-            }
+            })
 
         elif event == "on_trash":
-            if doc.name in device_site_map:
-                device_site_map.pop(doc.name, None)
-
-        save_device_site_map(device_site_map)
+            backend.delete(DEVICE_SITE, doc.name)
 
     except Exception as e:
         logging.error(f"Error validating/updating device-site map: {str(e)}")
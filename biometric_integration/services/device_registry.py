@@ -0,0 +1,131 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import frappe
+from frappe.utils import get_sites
+from biometric_integration.services.device_mapping import load_device_site_map, save_device_site_map
+
+APP_NAME = "biometric_integration"
+# Sites scanned at the same time, each holds one database connection while it is scanned
+DEFAULT_SCAN_WORKERS = 8
+
+def scan_site(site_name, sites_path):
+    """
+    Read the Biometric Devices of one site in its own Frappe context, meant to run in a worker thread.
+
+    Returns:
+        dict: 'devices' with the site's device rows, None when the app is not installed,
+            and 'error' if the site could not be read.
+    """
+    try:
+        frappe.init(site=site_name, sites_path=sites_path)
+        frappe.connect()
+        if APP_NAME not in frappe.get_installed_apps():
+            return {"devices": None, "error": None}
+        devices = frappe.get_all(
+            "Biometric Device",
+            fields=["name", "disabled", "has_pending_command", "modified"],
+        )
+        return {"devices": devices, "error": None}
+    except Exception as e:
+        logging.error("Error scanning site %s for biometric devices: %s", site_name, e)
+        return {"devices": None, "error": str(e)}
+    finally:
+        frappe.destroy()
+
+def scan_sites(sites, sites_path, workers=DEFAULT_SCAN_WORKERS):
+    """Scan `sites` concurrently, returns site name mapped to its `scan_site` result."""
+    if not sites:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sites))), thread_name_prefix="biometric-registry") as executor:
+        futures = {site_name: executor.submit(scan_site, site_name, sites_path) for site_name in sites}
+        return {site_name: future.result() for site_name, future in futures.items()}
+
+def build_device_site_map(scans, current_map):
+    """
+    Build the device-site map from site scans.
+
+    A device ID claimed by several sites keeps the site it is mapped to now if that site still has it,
+    otherwise it goes to the site whose device record was modified last.
+
+    Returns:
+        tuple: The new map and a dict of conflicting device IDs mapped to their claiming sites and the chosen one.
+    """
+    claims = {}
+    for site_name, scan in scans.items():
+        for device in scan["devices"] or []:
+            claims.setdefault(device.name, []).append((site_name, device))
+
+    device_site_map = {}
+    conflicts = {}
+    for device_id, site_claims in claims.items():
+        current_site = (current_map.get(device_id) or {}).get("site_name")
+        site_name, device = next(
+            (claim for claim in site_claims if claim[0] == current_site),
+            max(site_claims, key=lambda claim: claim[1].modified),
+        )
+        if len(site_claims) > 1:
+            conflicts[device_id] = {"sites": sorted(claim[0] for claim in site_claims), "mapped_to": site_name}
+        device_site_map[device_id] = {
+            "site_name": site_name,
+            "disabled": device.disabled or 0,
+            "has_pending_command": device.has_pending_command or 0,
+        }
+    return device_site_map, conflicts
+
+def diff_device_site_maps(current_map, device_site_map):
+    """Device IDs added, removed and changed going from `current_map` to `device_site_map`."""
+    return {
+        "added": sorted(set(device_site_map) - set(current_map)),
+        "removed": sorted(set(current_map) - set(device_site_map)),
+        "changed": sorted(
+            device_id for device_id in set(current_map) & set(device_site_map)
+            if current_map[device_id] != device_site_map[device_id]
+        ),
+    }
+
+def rebuild_device_registry(sites=None, workers=DEFAULT_SCAN_WORKERS, dry_run=False):
+    """
+    Rebuild the bench-wide device-site map from the Biometric Devices of every site and swap it in at once.
+
+    The map is otherwise only kept up to date by the Biometric Device hooks, so this repairs it after
+    a restore or a lost write. Sites that fail to scan abort the rebuild, since their devices would be dropped.
+
+    Args:
+        sites (list): Sites to scan, defaults to every site of the bench.
+        workers (int): Sites scanned at the same time.
+        dry_run (bool): Only report how the map differs from the sites.
+
+    Returns:
+        dict: Scan statistics, conflicts and the differences from the current map.
+    """
+    sites_path = getattr(frappe.local, "sites_path", None) or "."
+    sites = list(sites or get_sites(sites_path))
+
+    started = time.monotonic()
+    scans = scan_sites(sites, sites_path, workers=workers)
+    current_map = load_device_site_map()
+    device_site_map, conflicts = build_device_site_map(scans, current_map)
+
+    failed = {site_name: scan["error"] for site_name, scan in scans.items() if scan["error"]}
+    stats = {
+        "sites": len(sites),
+        "sites_with_app": sum(1 for scan in scans.values() if scan["devices"] is not None),
+        "failed_sites": failed,
+        "devices": len(device_site_map),
+        "conflicts": conflicts,
+        "diff": diff_device_site_maps(current_map, device_site_map),
+        "seconds": round(time.monotonic() - started, 2),
+        "saved": False,
+    }
+
+    if dry_run or failed:
+        return stats
+
+    save_device_site_map(device_site_map)
+    stats["saved"] = True
+    logging.info(
+        f"Rebuilt device-site map with {len(device_site_map)} devices from {len(sites)} sites, "
+        f"{len(conflicts)} conflicts"
+    )
+    return stats
@@ -0,0 +1,123 @@
+import logging
+import threading
+from datetime import datetime
+import frappe
+from biometric_integration.services.device_mapping import get_sites_for_devices
+from biometric_integration.utils.site_session import init_site, destroy_site
+
+# Seconds between writes of the last-seen table to Biometric Device
+FLUSH_INTERVAL = 60
+
+class LastSeenTable:
+    """When each device last reached the listener, kept in memory and written to the sites in batches."""
+
+    def __init__(self):
+        self._entries = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def touch(self, dev_id, remote_addr=None, brand=None):
+        if not dev_id:
+            return
+        with self._lock:
+            entry = self._entries.get(dev_id)
+            if entry is None:
+                entry = self._entries[dev_id] = {"requests": 0}
+            entry["last_seen"] = datetime.now()
+            entry["remote_addr"] = remote_addr
+            entry["brand"] = brand
+            entry["requests"] += 1
+            self._dirty.add(dev_id)
+
+    def take_dirty(self):
+        """Return the devices seen since the last flush with their last-seen time, and reset the dirty set."""
+        with self._lock:
+            dirty = {dev_id: self._entries[dev_id]["last_seen"] for dev_id in self._dirty}
+            self._dirty.clear()
+            return dirty
+
+    def mark_dirty(self, dev_ids):
+        with self._lock:
+            self._dirty.update(dev_id for dev_id in dev_ids if dev_id in self._entries)
+
+    def snapshot(self):
+        with self._lock:
+            return {dev_id: dict(entry) for dev_id, entry in self._entries.items()}
+
+    def restore(self, entries):
+        """Load entries saved by a previous listener process, devices seen since it started are kept."""
+        with self._lock:
+            for dev_id, entry in entries.items():
+                self._entries.setdefault(dev_id, dict(entry))
+
+last_seen_table = LastSeenTable()
+
+def flush_last_seen():
+    """
+    Write the last-seen time of every device seen since the previous flush to its site,
+    with one UPDATE per site that bypasses document hooks.
+    """
+    dirty = last_seen_table.take_dirty()
+    if not dirty:
+        return
+
+    devices_by_site = {}
+    sites = get_sites_for_devices(dirty)
+    for dev_id, last_seen in dirty.items():
+        if dev_id in sites:
+            devices_by_site.setdefault(sites[dev_id], {})[dev_id] = last_seen
+
+    for site_name, devices in devices_by_site.items():
+        try:
+            init_site(site_name=site_name)
+            cases = " ".join(["WHEN %s THEN %s"] * len(devices))
+            placeholders = ", ".join(["%s"] * len(devices))
+            values = [value for item in devices.items() for value in item] + list(devices)
+            frappe.db.sql(
+                f"""UPDATE `tabBiometric Device`
+                SET last_synced_time = CASE name {cases} END
+                WHERE name IN ({placeholders})""",
+                values,
+            )
+            frappe.db.commit()
+        except Exception as e:
+            logging.error("Error flushing last-seen times for site %s: %s", site_name, e, exc_info=True)
+            # Retry these devices on the next flush
+            last_seen_table.mark_dirty(devices)
+        finally:
+            destroy_site()
+
+def get_device_status():
+    """
+    Status of every device seen since the listener started, for the local status endpoint.
+
+    Returns:
+        dict: Device ID mapped to its last-seen time, seconds since then, remote address, brand and request count.
+    """
+    now = datetime.now()
+    status = last_seen_table.snapshot()
+    for entry in status.values():
+        entry["seconds_since_seen"] = round((now - entry["last_seen"]).total_seconds(), 1)
+    return status
+
+_flusher_stop = threading.Event()
+
+def start_flusher(interval=FLUSH_INTERVAL):
+    """Start the background thread that flushes the last-seen table every `interval` seconds."""
+    _flusher_stop.clear()
+
+    def run():
+        while not _flusher_stop.wait(interval):
+            try:
+                flush_last_seen()
+            except Exception as e:
+                logging.error("Error in last-seen flusher: %s", e, exc_info=True)
+
+    thread = threading.Thread(target=run, name="biometric-last-seen", daemon=True)
+    thread.start()
+    return thread
+
+def stop_flusher():
+    """Stop the flusher thread and write what is still pending."""
+    _flusher_stop.set()
+    flush_last_seen()
@@ -1,14 +1,31 @@
 from biometric_integration.services.create_checkin import create_employee_checkin
+from biometric_integration.services.punch_records import (
+    IO_MODE_IN,
+    build_punches,
+    normalize_log_types,
+    parse_compact_timestamps,
+    parse_user_ids,
+)
 from biometric_integration.utils.site_session import init_site, destroy_site
 from biometric_integration.services.device_mapping import get_site_for_device
 from biometric_integration.services.command_processor import process_device_command, handle_device_response
-from datetime import datetime
+from biometric_integration.services.enroll_templates import save_enroll_templates
 import logging
 import json
 import re
 import base64
 import os
 import frappe
+from biometric_integration.services.request_body import MemoryBudgetExceeded, memory_budget
+from biometric_integration.services.ebkn_transfers import (
+    clear_data,
+    get_last_block_no,
+    get_transfer_size,
+    read_full_data,
+    set_last_block_no,
+    start_new_sequence,
+    store_block,
+)
 
 def parse_device_data(raw_data: bytes) -> dict:
     text = raw_data.decode('utf-8', errors='replace')
@@ -93,96 +110,6 @@ def parse_device_data(raw_data: bytes) -> dict:
 
     return data
 
-def get_biometric_assets_dir():
-    # Get bench path (e.g. /home/zima/frappe-bench)
-    bench_path = frappe.utils.get_bench_path()
-    # Construct the path without using get_site_path, which requires site context
-    assets_dir = os.path.join(bench_path, "sites", "assets", "biometric_assets")
-    os.makedirs(assets_dir, exist_ok=True)
-    return assets_dir
-
-def get_partial_data_dir():
-    assets_dir = get_biometric_assets_dir()
-    partial_dir = os.path.join(assets_dir, "partial_data")
-    os.makedirs(partial_dir, exist_ok=True)
-    return partial_dir
-
-def get_block_sequence_map_path():
-    assets_dir = get_biometric_assets_dir()
-    return os.path.join(assets_dir, "block_sequence_map.json")
-
-def load_block_sequence_map():
-    file_path = get_block_sequence_map_path()
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r") as f:
-                return json.load(f)
-        except Exception as e:
-            logging.error(f"Error loading block sequence map: {str(e)}")
-            return {}
-    else:
-        return {}
-
-def save_block_sequence_map(seq_map):
-    file_path = get_block_sequence_map_path()
-    try:
-        with open(file_path, "w") as f:
-            json.dump(seq_map, f, indent=4)
-    except Exception as e:
-        logging.error(f"Error saving block sequence map: {str(e)}")
-
-def get_sequence_key(dev_id, request_code):
-    return f"{dev_id}_{request_code}"
-
-def get_last_block_no(dev_id, request_code):
-    seq_map = load_block_sequence_map()
-    key = get_sequence_key(dev_id, request_code)
-    val = seq_map.get(key, None)
-    return val
-
-def set_last_block_no(dev_id, request_code, blk_no):
-    seq_map = load_block_sequence_map()
-    key = get_sequence_key(dev_id, request_code)
-    seq_map[key] = blk_no
-    save_block_sequence_map(seq_map)
-
-def clear_sequence(dev_id, request_code):
-    seq_map = load_block_sequence_map()
-    key = get_sequence_key(dev_id, request_code)
-    if key in seq_map:
-        del seq_map[key]
-    save_block_sequence_map(seq_map)
-
-def get_partial_file_path(dev_id, request_code):
-    filename = f"{dev_id}_{request_code}.bin"
-    return os.path.join(get_partial_data_dir(), filename)
-
-def start_new_sequence(dev_id, request_code):
-    # If file exists, delete it to start fresh
-    file_path = get_partial_file_path(dev_id, request_code)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    # Reset block tracking in JSON map
-    clear_sequence(dev_id, request_code)
-
-def store_block(dev_id, request_code, raw_data):
-    file_path = get_partial_file_path(dev_id, request_code)
-    with open(file_path, 'ab') as f:
-        f.write(raw_data)
-
-def read_full_data(dev_id, request_code):
-    file_path = get_partial_file_path(dev_id, request_code)
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as f:
-            return f.read()
-    return None
-
-def clear_data(dev_id, request_code):
-    file_path = get_partial_file_path(dev_id, request_code)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-    clear_sequence(dev_id, request_code)
-
 def reply_response_code(response_code="OK"):
     response_headers = {
         "response_code": response_code
@@ -190,7 +117,29 @@ def reply_response_code(response_code="OK"):
     # Body empty, return 200 with headers
     return "", 200, response_headers
 
+def reply_command(command_data):
+    """Send a command, or a block of one, to the device in the response headers and body."""
+    response_headers = {
+        "response_code": "OK",
+        "trans_id": command_data.get("trans_id"),
+        "cmd_code": command_data.get("cmd_code"),
+    }
+    if command_data.get("blk_no") is not None:
+        response_headers["blk_no"] = command_data.get("blk_no")
+    return command_data.get("body") or "", 200, response_headers
+
 def handle_ebkn(request, raw_data, headers):
+    """
+    Handle an EBKN (FKWeb) request, reassembling multi-block transfers before routing by request_code.
+
+    Args:
+        request (BaseHTTPRequestHandler): The request.
+        raw_data (RequestBody): The request body, streamed into the partial transfer file for blocks.
+        headers (dict): The HTTP headers with request_code, dev_id and blk_no.
+
+    Returns:
+        tuple: Response body, HTTP status code, and headers.
+    """
     try:
         request_code = headers.get("request_code")
         dev_id = headers.get("dev_id")
@@ -200,7 +149,7 @@ def handle_ebkn(request, raw_data, headers):
             logging.error("Missing request_code or dev_id.")
             return reply_response_code("ERROR")
 
-        logging.info(f"Request Code: {request_code}, Device ID: {dev_id}")
+        logging.info("Request Code: %s, Device ID: %s", request_code, dev_id)
 
         # blk_no might be optional
         if blk_no is not None:
@@ -214,9 +163,10 @@ def handle_ebkn(request, raw_data, headers):
         if blk_no == 1:
             # Start new sequence
             start_new_sequence(dev_id, request_code)
-            store_block(dev_id, request_code, raw_data)
+            if not store_block(dev_id, request_code, raw_data):
+                return reply_response_code("ERROR")
             set_last_block_no(dev_id, request_code, 1)
-            logging.info(f"Received First Block, content length: {headers.get('Content-Length')}")
+            logging.info("Received First Block, content length: %s", headers.get('Content-Length'))
             return reply_response_code()
 
         elif blk_no > 1:
@@ -228,10 +178,11 @@ def handle_ebkn(request, raw_data, headers):
                 return '{"error": "Unexpected block sequence"}', 400, {}
 
             if blk_no != last_blk_no + 1:
-                logging.error(f"Block sequence mismatch. Expected {last_blk_no+1}, got {blk_no}.")
+                logging.error("Block sequence mismatch. Expected %s, got %s.", last_blk_no + 1, blk_no)
                 return '{"error": "Block sequence mismatch"}', 400, {}
 
-            store_block(dev_id, request_code, raw_data)
+            if not store_block(dev_id, request_code, raw_data):
+                return reply_response_code("ERROR")
             set_last_block_no(dev_id, request_code, blk_no)
             return reply_response_code()
 
@@ -241,51 +192,63 @@ def handle_ebkn(request, raw_data, headers):
             # Final block or single-block scenario
             if last_blk_no is None:
                 # Single-block scenario
-                full_data = raw_data
+                full_data = raw_data.read()
             else:
                 if last_blk_no < 1:
                     logging.error("Final block received without initial blocks.")
                     return reply_response_code("ERROR")
 
-                store_block(dev_id, request_code, raw_data)
-                set_last_block_no(dev_id, request_code, 0)
-                full_data = read_full_data(dev_id, request_code)
-                if not full_data:
-                    logging.error("Could not read full data after final block.")
-                    return reply_response_code("ERROR")
-
-            # Parse full data
-            try:
-                parsed_data = parse_device_data(full_data)
-            except ValueError as ve:
-                msg = str(ve)
-                logging.error(f"Parsing error: {msg}")
-                #clear_data(dev_id, request_code)
-                return reply_response_code("ERROR")
+                # Charged before the final block is stored, so a shed request can be resent as it is
+                with memory_budget.hold(get_transfer_size(dev_id, request_code) + len(raw_data)):
+                    if not store_block(dev_id, request_code, raw_data):
+                        return reply_response_code("ERROR")
+                    set_last_block_no(dev_id, request_code, 0)
+                    full_data = read_full_data(dev_id, request_code)
+                    if not full_data:
+                        logging.error("Could not read full data after final block.")
+                        return reply_response_code("ERROR")
+                    return handle_transfer(dev_id, request_code, full_data, headers)
 
-            # Success, clear partial data
-            #clear_data(dev_id, request_code)
-
-            # Route to request-specific handlers
-            if request_code == "realtime_glog":
-                return handle_realtime_glog(parsed_data, headers)
-            elif request_code == "realtime_enroll_data":
-                return handle_realtime_enroll_data(full_data, parsed_data, headers)
-            elif request_code == "receive_cmd":
-                return handle_receive_cmd(parsed_data, headers)
-            elif request_code == "send_cmd_result":
-                return handle_send_cmd_result(parsed_data, headers)
-            else:
-                logging.warning(f"Unsupported request_code: {request_code}")
-                return reply_response_code("ERROR")
+            return handle_transfer(dev_id, request_code, full_data, headers)
 
         else:
             # Invalid blk_no
-            logging.error(f"Invalid blk_no: {blk_no}")
+            logging.error("Invalid blk_no: %s", blk_no)
             return reply_response_code("ERROR")
 
+    except MemoryBudgetExceeded:
+        # The listener sheds the request, the device resends it later
+        raise
+
     except Exception as e:
-        logging.error(f"Error in handle_ebkn: {str(e)}", exc_info=True)
+        logging.error("Error in handle_ebkn: %s", e, exc_info=True)
+        return reply_response_code("ERROR")
+
+def handle_transfer(dev_id, request_code, full_data, headers):
+    """Parse a complete transfer and route it by request_code."""
+    # Parse full data
+    try:
+        parsed_data = parse_device_data(full_data)
+    except ValueError as ve:
+        msg = str(ve)
+        logging.error("Parsing error: %s", msg)
+        clear_data(dev_id, request_code)
+        return reply_response_code("ERROR")
+
+    # Success, clear partial data
+    clear_data(dev_id, request_code)
+
+    # Route to request-specific handlers
+    if request_code == "realtime_glog":
+        return handle_realtime_glog(parsed_data, headers)
+    elif request_code == "realtime_enroll_data":
+        return handle_realtime_enroll_data(full_data, parsed_data, headers)
+    elif request_code == "receive_cmd":
+        return handle_receive_cmd(parsed_data, headers)
+    elif request_code == "send_cmd_result":
+        return handle_send_cmd_result(parsed_data, headers)
+    else:
+        logging.warning("Unsupported request_code: %s", request_code)
         return reply_response_code("ERROR")
 
 def handle_receive_cmd(data, headers):
@@ -299,51 +262,35 @@ def handle_receive_cmd(data, headers):
         command_data = process_device_command(headers.get("dev_id"))
         destroy_site()
         if command_data:
-            response_headers = {
-                "response_code": "OK",
-                #"blk_no": command_data.get("blk_no") or 0,
-                "trans_id" : command_data.get("trans_id"),
-                "cmd_code" : command_data.get("cmd_code")
-                }
-            body = command_data.get("body")
-            
-            return body, 200, response_headers
+            return reply_command(command_data)
 
         return reply_response_code("OK")
 
     except Exception as e:
-        logging.error(f"Error in handle_receive_cmd: {str(e)}", exc_info=True)
+        logging.error("Error in handle_receive_cmd: %s", e, exc_info=True)
         return reply_response_code("ERROR")
 
 def handle_send_cmd_result(data, headers):
     try:
-        logging.info(f"Device sent {headers.get('cmd_return_code')} status for transaction {headers.get('trans_id')}")
+        logging.info("Device sent %s status for transaction %s", headers.get("cmd_return_code"), headers.get("trans_id"))
         init_site(device_id=headers.get("dev_id"))
         response = handle_device_response(
             device_id=headers.get("dev_id"),
             trans_id=headers.get("trans_id"),
-            cmd_return_code=headers.get("cmd_return_code")
+            cmd_return_code=headers.get("cmd_return_code"),
+            result_data=data,
         )
         destroy_site()
         if response:
-            if response.get("response_code") == "ERROR":
+            if response.get("cmd_code"):
+                # The next chunk, or the next queued command chained into this reply
+                return reply_command(response)
+            elif response.get("response_code") == "ERROR":
                 return reply_response_code("ERROR")
-            elif response.get("response_code") == "OK":
-                return reply_response_code("OK")
-            elif response.get("cmd_code") :
-                response_headers = {
-                    "response_code": "OK",
-                    "blk_no": command_data.get("blk_no"),
-                    "trans_id" : command_data.get("trans_id"),
-                    "cmd_code" : command_data.get("cmd_code")
-                    }
-                body = command_data.get("body")
-                
-                return body, 200, response_headers
         return reply_response_code("OK")
         
     except Exception as e:
-        logging.error(f"Error in handle_send_cmd_result: {str(e)}", exc_info=True)
+        logging.error("Error in handle_send_cmd_result: %s", e, exc_info=True)
         return reply_response_code("ERROR")
 
 def handle_realtime_glog(data, headers):
@@ -357,31 +304,34 @@ def handle_realtime_glog(data, headers):
             logging.error("Missing required fields in realtime_glog")
             return reply_response_code("ERROR")
 
-        try:
-            employee_field_value = int(user_id)
-        except ValueError:
-            logging.error(f"Invalid user_id format: {user_id}")
+        punches, rejected = build_punches(
+            parse_user_ids([user_id]), parse_compact_timestamps([io_time]), normalize_log_types([io_mode], IO_MODE_IN)
+        )
+        if rejected:
+            logging.error("Invalid user_id or io_time format: %s, %s", user_id, io_time)
             return reply_response_code("ERROR")
 
-        timestamp = datetime.strptime(io_time, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
-        log_type = "IN" if io_mode == 1 else "OUT"
+        # The parsed datetime goes straight to the check-in, without a round trip through a string
+        punch = punches[0]
+        employee_field_value = punch.employee_field_value
+        timestamp = punch.timestamp
 
         is_success = create_employee_checkin(
             employee_field_value=employee_field_value,
             timestamp=timestamp,
             device_id=str(device_id),
-            log_type=log_type,
+            log_type=punch.log_type,
         )
 
         if is_success:
-            logging.info(f"Realtime log processed for user {employee_field_value} at {timestamp}")
+            logging.info("Realtime log processed for user %s at %s", employee_field_value, timestamp)
             return reply_response_code("OK")
         else:
-            logging.error(f"Failed to process realtime log for user {employee_field_value}")
+            logging.error("Failed to process realtime log for user %s", employee_field_value)
             return reply_response_code("ERROR")
 
     except Exception as e:
-        logging.error(f"Error handling realtime_glog: {str(e)}", exc_info=True)
+        logging.error("Error handling realtime_glog: %s", e, exc_info=True)
         return reply_response_code("ERROR")
 
 
@@ -421,11 +371,9 @@ def handle_realtime_enroll_data(raw_data, parsed_data, headers):
 
         logging.info(f"Raw enroll data uploaded as file {bin_file_name}")
 
-        # Attach the file URLs to the Biometric Device User document
-        doc = frappe.get_doc("Biometric Device User", user_id)
-        doc.ebkn_enroll_data = bin_file_doc.file_url
-        doc.ebkn_enroll_data_json = frappe.as_json(parsed_data)
-        doc.save()
+        # Attach the file URL to the Biometric Device User, the templates go to their own document
+        frappe.db.set_value("Biometric Device User", user_id, "ebkn_enroll_data", bin_file_doc.file_url)
+        save_enroll_templates(user_id, parsed_data, brand="EBKN")
         frappe.db.commit()
 
         destroy_site()
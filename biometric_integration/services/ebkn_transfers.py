@@ -0,0 +1,59 @@
+import logging
+import time
+from biometric_integration.services.state_backend import BLOCK_SEQUENCE, PARTIAL_DATA, get_state_backend
+
+# Largest multi-block transfer reassembled from partial data
+MAX_TRANSFER_SIZE = 16 * 1024 * 1024
+
+def get_sequence_key(dev_id, request_code):
+    return f"{dev_id}_{request_code}"
+
+def get_last_block_no(dev_id, request_code):
+    val = get_state_backend().get(BLOCK_SEQUENCE, get_sequence_key(dev_id, request_code))
+    if isinstance(val, dict):
+        return val.get("blk_no")
+    return val
+
+def set_last_block_no(dev_id, request_code, blk_no):
+    # The update time lets the assets sweeper expire transfers a device never finished
+    get_state_backend().set(BLOCK_SEQUENCE, get_sequence_key(dev_id, request_code), {"blk_no": blk_no, "updated": time.time()})
+
+def clear_sequence(dev_id, request_code):
+    get_state_backend().delete(BLOCK_SEQUENCE, get_sequence_key(dev_id, request_code))
+
+def start_new_sequence(dev_id, request_code):
+    # Drop what a previous transfer left, to start fresh
+    get_state_backend().delete_blob(PARTIAL_DATA, get_sequence_key(dev_id, request_code))
+    # Reset block tracking
+    clear_sequence(dev_id, request_code)
+
+def get_transfer_size(dev_id, request_code):
+    return get_state_backend().get_blob_size(PARTIAL_DATA, get_sequence_key(dev_id, request_code))
+
+def store_block(dev_id, request_code, body):
+    """
+    Append a block to the device's partial transfer, streaming it from the request.
+
+    Args:
+        dev_id (str): The device ID.
+        request_code (str): The EBKN request code of the transfer.
+        body (RequestBody): The block's request body.
+
+    Returns:
+        bool: False if the block would grow the transfer beyond MAX_TRANSFER_SIZE.
+    """
+    backend = get_state_backend()
+    key = get_sequence_key(dev_id, request_code)
+    if get_transfer_size(dev_id, request_code) + len(body) > MAX_TRANSFER_SIZE:
+        logging.error("Transfer %s exceeds %s bytes.", key, MAX_TRANSFER_SIZE)
+        return False
+
+    backend.append_blob(PARTIAL_DATA, key, body.iter_chunks())
+    return True
+
+def read_full_data(dev_id, request_code):
+    return get_state_backend().read_blob(PARTIAL_DATA, get_sequence_key(dev_id, request_code))
+
+def clear_data(dev_id, request_code):
+    get_state_backend().delete_blob(PARTIAL_DATA, get_sequence_key(dev_id, request_code))
+    clear_sequence(dev_id, request_code)
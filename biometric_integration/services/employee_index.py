@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+import frappe
+from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import (
+    get_employee_lookup_field,
+    get_erp_employee_ids,
+    get_settings_version,
+)
+
+# Seconds a site's index is used before it is rebuilt, so changed Device Employee IDs are picked up
+EMPLOYEE_INDEX_TTL = 300
+
+class EmployeeIndex:
+    """Device Employee ID to ERP Employee of one site, loaded with a single query."""
+
+    def __init__(self, site_name, settings_version, loaded_at=None):
+        self.site_name = site_name
+        self.settings_version = settings_version
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        self.employees = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        lookup_field = get_employee_lookup_field()
+        employees = frappe.get_all(
+            "Employee",
+            filters={lookup_field: ["is", "set"]},
+            fields=["name", "employee_name", f"{lookup_field} as device_employee_id"],
+        )
+        self.employees = {
+            str(employee.device_employee_id): {"name": employee.name, "employee_name": employee.employee_name}
+            for employee in employees
+        }
+        logging.info("Loaded employee index of site %s with %s employees", self.site_name, len(self.employees))
+
+    def is_stale(self, settings_version, min_remaining=0):
+        return (
+            settings_version != self.settings_version
+            or time.monotonic() - self.loaded_at > EMPLOYEE_INDEX_TTL - min_remaining
+        )
+
+    def resolve(self, device_employee_ids):
+        device_employee_ids = {str(device_employee_id) for device_employee_id in device_employee_ids if device_employee_id}
+        resolved = {}
+        missing = []
+        for device_employee_id in device_employee_ids:
+            employee = self.employees.get(device_employee_id)
+            if employee:
+                resolved[device_employee_id] = employee
+            else:
+                missing.append(device_employee_id)
+
+        if missing:
+            # Employees created since the index was loaded
+            found = get_erp_employee_ids(missing)
+            with self._lock:
+                self.employees.update(found)
+            resolved.update(found)
+        return resolved
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_employee_index(min_remaining=0):
+    """
+    The employee index of the current site, rebuilt when it expired or the settings changed.
+
+    Args:
+        min_remaining (float): Also rebuild it if it would expire within this many seconds.
+    """
+    site_name = frappe.local.site
+    settings_version = get_settings_version()
+    index = _indexes.get(site_name)
+    if index is None or index.is_stale(settings_version, min_remaining):
+        with _indexes_lock:
+            index = _indexes.get(site_name)
+            if index is None or index.is_stale(settings_version, min_remaining):
+                index = EmployeeIndex(site_name, settings_version)
+                index.load()
+                _indexes[site_name] = index
+    return index
+
+def export_indexes():
+    """The loaded indexes with their age in seconds, for the listener's restart snapshot."""
+    now = time.monotonic()
+    return {
+        site_name: {
+            "settings_version": index.settings_version,
+            "age": now - index.loaded_at,
+            "employees": dict(index.employees),
+        }
+        for site_name, index in list(_indexes.items())
+    }
+
+def restore_indexes(indexes, elapsed=0):
+    """
+    Load indexes exported by a previous listener process.
+
+    They keep aging from when they were first loaded, and one whose settings changed since is rebuilt on first use.
+
+    Args:
+        indexes (dict): Output of `export_indexes`.
+        elapsed (float): Seconds between the export and now.
+    """
+    now = time.monotonic()
+    with _indexes_lock:
+        for site_name, data in indexes.items():
+            age = data["age"] + elapsed
+            if site_name in _indexes or age > EMPLOYEE_INDEX_TTL:
+                continue
+            index = EmployeeIndex(site_name, data["settings_version"], loaded_at=now - age)
+            index.employees = data["employees"]
+            _indexes[site_name] = index
+
+def resolve_employees(device_employee_ids):
+    """
+    Resolve Device Employee IDs to ERP Employees through the site's cached index.
+
+    Args:
+        device_employee_ids (iterable): The Device Employee IDs.
+
+    Returns:
+        dict: Device Employee ID (as str) mapped to a dict with the ERP Employee 'name' and 'employee_name'.
+            IDs without a matching Employee are left out.
+    """
+    return get_employee_index().resolve(device_employee_ids)
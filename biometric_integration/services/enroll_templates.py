@@ -0,0 +1,69 @@
+import hashlib
+import json
+import frappe
+from frappe.utils import now_datetime
+
+def get_template_count(enroll_data):
+    """Number of templates (fingerprints, face, card, password) in a parsed enroll payload."""
+    enroll_data_array = enroll_data.get("enroll_data_array") if isinstance(enroll_data, dict) else None
+    return len(enroll_data_array) if isinstance(enroll_data_array, list) else 0
+
+def get_template_hash(enroll_data_json):
+    """
+    MD5 of the stored enroll JSON, the same value MD5() gave on the former user column,
+    so users already synced to devices stay up to date after the move.
+    """
+    if not enroll_data_json:
+        return ""
+    return hashlib.md5(enroll_data_json.encode("utf-8")).hexdigest()
+
+def save_enroll_templates(device_user, enroll_data, brand="EBKN", enroll_data_json=None):
+    """
+    Store a user's enroll templates in Biometric Device User Template and their summary on the user.
+
+    Args:
+        device_user (str): The Biometric Device User.
+        enroll_data (dict): The parsed enroll payload.
+        brand (str): The brand the templates were enrolled on.
+        enroll_data_json (str): The payload already serialized, if it is at hand.
+
+    Returns:
+        dict: template_count and template_hash of the stored templates.
+    """
+    enroll_data_json = enroll_data_json or frappe.as_json(enroll_data)
+    summary = {
+        "template_count": get_template_count(enroll_data),
+        "template_hash": get_template_hash(enroll_data_json),
+    }
+
+    if frappe.db.exists("Biometric Device User Template", device_user):
+        frappe.db.set_value(
+            "Biometric Device User Template",
+            device_user,
+            dict(summary, brand=brand, enroll_data_json=enroll_data_json),
+        )
+    else:
+        frappe.get_doc(dict(
+            summary,
+            doctype="Biometric Device User Template",
+            biometric_device_user=device_user,
+            brand=brand,
+            enroll_data_json=enroll_data_json,
+        )).insert(ignore_permissions=True)
+
+    frappe.db.set_value("Biometric Device User", device_user, {
+        "enroll_template_count": summary["template_count"],
+        "enroll_template_hash": summary["template_hash"],
+        "enroll_data_updated_on": now_datetime(),
+    })
+    return summary
+
+def get_enroll_templates(device_user):
+    """
+    Load the parsed enroll payload of a user, only when the templates themselves are needed.
+
+    Returns:
+        dict: The enroll payload, or None if the user has no templates.
+    """
+    enroll_data_json = frappe.db.get_value("Biometric Device User Template", device_user, "enroll_data_json")
+    return json.loads(enroll_data_json) if enroll_data_json else None
@@ -1,11 +1,31 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib
 import logging
+import signal
 import socket
+import threading
 import os
+import time
 from datetime import datetime
 import frappe
-from biometric_integration.services.ebkn_processor import handle_ebkn
+from biometric_integration.services.protocol_registry import get_protocol
+from biometric_integration.services.admission import admission_controller, SHED_PROTOCOL_BUSY, SHED_MEMORY, SHED_SITE_UNAVAILABLE
+from biometric_integration.services.site_executor import site_executor, SiteUnavailable
+from biometric_integration.services.listener_state import draining, drain, load_snapshot, save_snapshot
+from biometric_integration.services.device_mapping import get_site_for_device
+from biometric_integration.services.request_body import RequestBody, MemoryBudgetExceeded, memory_budget
+from biometric_integration.services.raw_archive import open_raw_data_file
+from biometric_integration.services.profiler import (
+    listener_profiler,
+    profile_handler,
+    install_signal_handler,
+    start_profile_from_request,
+    stop_profile_from_request,
+)
+from biometric_integration.utils.listener_logging import setup_listener_logging, log_request as write_request_record
 import shlex
+import json
+from urllib.parse import urlsplit, parse_qs
 
 # Determine dynamic paths
 bench_path = frappe.utils.get_bench_path()
@@ -16,51 +36,184 @@ log_file_path = os.path.join(bench_path, "logs", "biometric_listener.log")
 # Ensure logs directory exists
 os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
 
-# Logging setup
-logging.basicConfig(
-    filename=log_file_path,
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)s: %(message)s'
-)
-
-def get_raw_data_dir():
-    raw_data_dir = os.path.join(bench_path, "sites", "assets", "biometric_assets", "raw_data_logs")
-    os.makedirs(raw_data_dir, exist_ok=True)
-    return raw_data_dir
+# Seconds a request waits for a free slot of a protocol with limited concurrency before it is shed
+PROTOCOL_SLOT_TIMEOUT = 1
+# Seconds a device is asked to wait before retrying a shed request
+RETRY_AFTER = 5
+# Keep a copy of every request body under raw_data_logs
+SAVE_RAW_DATA = True
+# Seconds an idle persistent connection stays open waiting for the next request
+KEEP_ALIVE_TIMEOUT = 15
+# Requests served on one connection before it is closed, so connections get rebalanced
+MAX_REQUESTS_PER_CONNECTION = 100
 
 class BiometricRequestHandler(BaseHTTPRequestHandler):
     """Middleware to route requests."""
 
+    # Persistent connections, devices poll and send multi-block transfers over one socket
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        self.requests_on_connection = 0
+
+    def handle_one_request(self):
+        self.requests_on_connection += 1
+        self.body_consumed = False
+        self.headers_sent = False
+        self.response_status = None
+        super().handle_one_request()
+
+    def log_request(self, code="-", size="-"):
+        # Called by send_response, the status goes into the request's structured record instead
+        self.response_status = code
+
+    def log_message(self, format, *args):
+        logging.debug("%s - " + format, self.address_string(), *args)
+
+    def end_headers(self):
+        if not self.close_connection:
+            if self.requests_on_connection >= MAX_REQUESTS_PER_CONNECTION or not self.body_consumed or draining.is_set():
+                # An unread body would be parsed as the next request, drop the connection instead.
+                # While shutting down, devices reconnect to the next listener process.
+                self.send_header("Connection", "close")
+            elif self.request_version == "HTTP/1.0":
+                self.send_header("Connection", "keep-alive")
+        self.headers_sent = True
+        super().end_headers()
+
+    def get_normalized_path(self):
+        raw_path = self.path.split("?", 1)[0]
+        normalized_path = raw_path.split("://")[-1].split("/", 1)[-1]
+        return f"/{normalized_path}"
+
+    def do_GET(self):
+        self.route_request()
+
     def do_POST(self):
+        self.route_request()
+
+    def route_request(self):
+        started = time.monotonic()
+        self.request_dev_id = None
+        self.request_brand = None
         try:
-            raw_path = self.path
-            normalized_path = raw_path.split("://")[-1].split("/", 1)[-1]
-            normalized_path = f"/{normalized_path}"
-
-            if normalized_path == "/ebkn":
-                dev_id = self.headers.get("dev_id")
-                if not dev_id:
-                    # Missing device id: respond 400
-                    self.simple_response(400)
-                    return
-                    
-                self.pass_to_handler(handle_ebkn)
+            self.route_protocol_request()
+        finally:
+            write_request_record(
+                method=self.command,
+                path=self.path,
+                dev_id=self.request_dev_id,
+                brand=self.request_brand,
+                request_code=self.headers.get("request_code"),
+                content_length=self.headers.get("Content-Length"),
+                status=self.response_status,
+                latency_ms=round((time.monotonic() - started) * 1000, 1),
+            )
 
-            else:
+    def route_protocol_request(self):
+        try:
+            self.body_consumed = not int(self.headers.get("Content-Length") or 0)
+            normalized_path = self.get_normalized_path()
+            if self.command == "GET" and normalized_path in ADMIN_ROUTES:
+                self.admin_response(resolve_admin_route(ADMIN_ROUTES[normalized_path]))
+                return
+            if self.command == "POST" and normalized_path in ADMIN_ACTIONS:
+                query = parse_qs(urlsplit(self.path).query)
+                self.admin_response(lambda: ADMIN_ACTIONS[normalized_path](query))
+                return
+
+            protocol = get_protocol(self.command, normalized_path)
+            if not protocol:
                 # Unsupported path
                 self.simple_response(400)
+                return
+
+            if any(not self.headers.get(header) for header in protocol.required_headers):
+                # Missing device id: respond 400
+                self.simple_response(400)
+                return
+
+            dev_id = protocol.get_device_id(self)
+            self.request_dev_id = dev_id
+            self.request_brand = protocol.brand
+            from biometric_integration.services.device_status import last_seen_table
+
+            last_seen_table.touch(dev_id, self.client_address[0], protocol.brand)
+
+            site_pool = self.get_site_pool(dev_id)
+            site_name = site_pool.site_name if site_pool else None
+            if admission_controller.admit(dev_id, site_name):
+                self.busy_response(protocol)
+                return
+
+            try:
+                if site_pool and not site_pool.can_accept():
+                    # Its site is saturated or failing, don't let it hold a thread the other sites need
+                    admission_controller.record_shed(SHED_SITE_UNAVAILABLE, dev_id)
+                    self.busy_response(protocol)
+                    return
+
+                with protocol.slot(timeout=PROTOCOL_SLOT_TIMEOUT) as acquired:
+                    if not acquired:
+                        admission_controller.record_shed(SHED_PROTOCOL_BUSY, dev_id)
+                        self.busy_response(protocol)
+                        return
+                    self.pass_to_handler(protocol, site_pool)
+            finally:
+                admission_controller.release(site_name)
 
         except Exception as e:
-            logging.error(f"Error processing request: {str(e)}", exc_info=True)
+            logging.error("Error processing request: %s", e, exc_info=True)
+            if self.headers_sent:
+                self.close_connection = True
+                return
             self.simple_response(400)
 
-    def pass_to_handler(self, handler):
+    def get_site_pool(self, dev_id):
+        """The worker pool of the site the device belongs to, None if the device is not mapped."""
+        device_info = get_site_for_device(dev_id) if dev_id else None
+        if not device_info or not device_info.get("site_name"):
+            return None
+        return site_executor.get_pool(device_info["site_name"])
+
+    def pass_to_handler(self, protocol, site_pool=None):
+        body = None
+        raw_file = None
         try:
             content_length = int(self.headers.get('Content-Length', 0))
-            raw_data = self.rfile.read(content_length)
+            if content_length > protocol.max_body_size:
+                logging.error("Rejected %s byte body, limit is %s", content_length, protocol.max_body_size)
+                self.simple_response(413)
+                return
+
+            if SAVE_RAW_DATA:
+                raw_file = open_raw_data_file(self.headers.get("request_code"), protocol.get_device_id(self), {
+                    "method": self.command,
+                    "path": self.path,
+                    "headers": dict(self.headers.items()),
+                    "content_length": content_length,
+                })
+
+            # The body stays on the socket until the handler reads or streams it
+            body = RequestBody(self.rfile, content_length, tee=raw_file)
+            raw_data = body if protocol.streaming_body else body.read()
 
-            # Call handler
-            response_body, status, response_headers = handler(self, raw_data, self.headers)
+            # Call handler, on the site's own workers when the device is mapped to one
+            handler = protocol.get_handler()
+            if listener_profiler.active:
+                handler = profile_handler(handler, f"{protocol.brand} {self.headers.get('request_code') or self.get_normalized_path()}")
+            if site_pool:
+                response_body, status, response_headers = site_pool.run(
+                    handler, self, raw_data, self.headers, is_failure=protocol.is_failed_response
+                )
+            else:
+                response_body, status, response_headers = handler(self, raw_data, self.headers)
+
+            # Drain what the handler left unread so the connection can be reused
+            body.discard()
+            self.body_consumed = True
 
             # Check if response_body is already bytes
             if isinstance(response_body, bytes):
@@ -73,66 +226,135 @@ class BiometricRequestHandler(BaseHTTPRequestHandler):
             for header, value in response_headers.items():
                 self.send_header(header, value)
             self.send_header("Content-Length", str(len(response_body_bytes)))
-            logging.info(f"Sending response content-length: {len(response_body_bytes)}")
-            self.send_header("Content-Type", "application/octet-stream")
+            if "Content-Type" not in response_headers:
+                self.send_header("Content-Type", "application/octet-stream")
             self.end_headers()
 
-            # Save raw data if needed
-            try:
-                if True:  # Set to False to disable saving raw data
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"raw_data_{timestamp}.bin"  # More descriptive filename
-                    save_path = os.path.join("/home/zima/frappe-bench/sites/assets/biometric_assets", filename)
-
-                    with open(save_path, "wb") as f:  # Open in binary write mode
-                        f.write(raw_data)  # Write raw binary data directly
-
-            except Exception as file_error:
-                logging.error(f"Error saving raw data: {str(file_error)}", exc_info=True)
-
             # Write the response back to the client
             self.wfile.write(response_body_bytes)
             self.wfile.flush()
 
+        except MemoryBudgetExceeded as e:
+            logging.warning("Shedding request: %s", e)
+            admission_controller.record_shed(SHED_MEMORY, protocol.get_device_id(self))
+            self.busy_response(protocol)
+
+        except SiteUnavailable as e:
+            logging.warning("Shedding request: %s", e)
+            admission_controller.record_shed(SHED_SITE_UNAVAILABLE, protocol.get_device_id(self))
+            # The site's worker may still be reading the body
+            self.close_connection = True
+            self.busy_response(protocol)
+
         except Exception as e:
-            logging.error(f"Error in handler: {str(e)}", exc_info=True)
+            logging.error("Error in handler: %s", e, exc_info=True)
+            if self.headers_sent:
+                # The response is half written, the connection can't be reused
+                self.close_connection = True
+                return
             # On any handler error: respond 400
             self.simple_response(400)
 
+        finally:
+            if body:
+                body.close()
+            if raw_file:
+                raw_file.close()
+
+    def busy_response(self, protocol):
+        """Shed the request without reading its body, the device retries after RETRY_AFTER seconds."""
+        body, status, headers = protocol.busy_response
+        body_bytes = body.encode("utf-8")
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header("Retry-After", str(RETRY_AFTER))
+        self.send_header("Content-Length", str(len(body_bytes)))
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+    def admin_response(self, get_status):
+        """Send a JSON status document, only to clients on the same host."""
+        if self.client_address[0] not in ("127.0.0.1", "::1"):
+            self.simple_response(403)
+            return
+
+        body = json.dumps(get_status(), default=str).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def simple_response(self, status_code=400):
         """Send a simple minimal response with given status."""
         self.send_response(status_code)
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
-class CustomHTTPServer(HTTPServer):
+# Local status endpoints, path mapped to a function returning a JSON-serializable dict,
+# or its dotted path when its module is only imported on the first request for it
+ADMIN_ROUTES = {
+    "/status/admission": admission_controller.get_stats,
+    "/status/memory": memory_budget.get_stats,
+    "/status/devices": "biometric_integration.services.device_status.get_device_status",
+    "/status/sites": site_executor.get_stats,
+    "/status/profile": listener_profiler.get_status,
+    "/status/peaks": "biometric_integration.services.prewarm.get_prewarm_status",
+}
+
+def resolve_admin_route(route):
+    if isinstance(route, str):
+        module_path, attr = route.rsplit(".", 1)
+        return getattr(importlib.import_module(module_path), attr)
+    return route
+
+# Local admin actions, taking POST, path mapped to a function of the parsed query string
+ADMIN_ACTIONS = {
+    "/profile/start": start_profile_from_request,
+    "/profile/stop": stop_profile_from_request,
+}
+
+class CustomHTTPServer(ThreadingHTTPServer):
     def server_bind(self):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         super().server_bind()
 
-def start_listener(port=8998):
+def start_listener(port=8998, log_level="INFO"):
+    # Imported here, the background jobs are only needed by a running listener
+    from biometric_integration.services.assets_gc import start_sweeper, stop_sweeper
+    from biometric_integration.services.device_status import start_flusher, stop_flusher
+    from biometric_integration.services.prewarm import start_prewarmer, stop_prewarmer
+
+    log_writer = setup_listener_logging(log_file_path, log_level)
+    load_snapshot()
     server_address = ('', port)
     httpd = CustomHTTPServer(server_address, BiometricRequestHandler)
-    logging.info(f"Starting server on port {port}")
+    logging.info("Starting server on port %s", port)
+    # kill -USR2 <pid> profiles the running listener, results go next to its log
+    listener_profiler.output_dir = os.path.dirname(log_file_path)
+    install_signal_handler()
+    # The process manager stops the listener with SIGTERM, serve_forever can only be stopped from another thread
+    signal.signal(signal.SIGTERM, lambda *args: threading.Thread(target=httpd.shutdown, daemon=True).start())
+    start_flusher()
+    start_sweeper()
+    start_prewarmer()
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        logging.info("Shutting down server gracefully...")
-        httpd.shutdown()
-        logging.info("Server stopped.")
+        pass
 
-def save_raw_data(raw_data, request_code, device_id):
+    logging.info("Shutting down server gracefully...")
+    # Stop accepting connections, then let the accepted requests finish
+    httpd.server_close()
+    # Before drain, which shuts down the site workers a warm-up may be waiting on
+    stop_prewarmer()
+    drain()
+    stop_flusher()
+    stop_sweeper()
     try:
-        save_dir = get_raw_data_dir()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        request_code = request_code or "unknown"
-        device_id = device_id or "unknown"
-
-        filename = f"{timestamp}_{request_code}_{device_id}.bin"
-        file_path = os.path.join(save_dir, filename)
-        with open(file_path, "wb") as file:
-            file.write(raw_data)
-
-        logging.info(f"Raw data saved to {file_path}")
-
+        save_snapshot()
     except Exception as e:
-        logging.error(f"Failed to save raw data: {str(e)}")
+        logging.error("Error saving listener snapshot: %s", e, exc_info=True)
+    logging.info("Server stopped.")
+    log_writer.stop()
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from biometric_integration.services.admission import admission_controller
+from biometric_integration.services.device_mapping import get_biometric_assets_dir
+from biometric_integration.services.site_executor import site_executor
+
+# Seconds in-flight requests get to finish after the listener stops accepting,
+# keep the process manager's stop timeout above this
+DRAIN_TIMEOUT = 20
+# A snapshot older than this is ignored at startup, the state it holds would be rebuilt anyway
+SNAPSHOT_MAX_AGE = 15 * 60
+SNAPSHOT_VERSION = 1
+
+# Set while the listener shuts down, persistent connections are closed after their current response
+draining = threading.Event()
+
+def get_snapshot_path():
+    return os.path.join(get_biometric_assets_dir(), "listener_snapshot.json")
+
+def wait_for_requests(timeout):
+    """Wait until no device request is being handled, returns False if some still were after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while admission_controller.in_flight > 0:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def drain(timeout=DRAIN_TIMEOUT):
+    """
+    Let the requests already accepted finish, then stop the site workers.
+
+    The listening socket must already be closed so no new connections arrive.
+    """
+    draining.set()
+    if not wait_for_requests(timeout):
+        logging.warning("%s requests still running after %ss, stopping anyway", admission_controller.in_flight, timeout)
+    site_executor.shutdown(wait=True)
+
+def save_snapshot():
+    """
+    Write the listener's warm in-memory state to biometric_assets, so the next process starts with it.
+
+    Partial EBKN transfers and block sequences are already kept by the state backend and survive restarts.
+    """
+    from biometric_integration.services.device_status import last_seen_table
+    from biometric_integration.services.employee_index import export_indexes
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "saved": time.time(),
+        "last_seen": last_seen_table.snapshot(),
+        "employee_indexes": export_indexes(),
+    }
+    file_path = get_snapshot_path()
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f, default=lambda value: value.isoformat())
+    os.replace(tmp_path, file_path)
+    logging.info(
+        f"Saved listener snapshot with {len(snapshot['last_seen'])} devices "
+        f"and {len(snapshot['employee_indexes'])} employee indexes"
+    )
+
+def load_snapshot(max_age=SNAPSHOT_MAX_AGE):
+    """
+    Restore the state saved by the previous listener process, once, and only if it is recent.
+
+    Returns:
+        bool: True if a snapshot was loaded.
+    """
+    file_path = get_snapshot_path()
+    if not os.path.exists(file_path):
+        return False
+
+    try:
+        with open(file_path, "r") as f:
+            snapshot = json.load(f)
+    except Exception as e:
+        logging.error("Error loading listener snapshot: %s", e)
+        return False
+    finally:
+        # A snapshot is only good for the restart it was written for
+        os.remove(file_path)
+
+    elapsed = time.time() - snapshot.get("saved", 0)
+    if snapshot.get("version") != SNAPSHOT_VERSION or not 0 <= elapsed <= max_age:
+        logging.info("Ignoring listener snapshot saved %.0fs ago", elapsed)
+        return False
+
+    from biometric_integration.services.device_status import last_seen_table
+    from biometric_integration.services.employee_index import restore_indexes
+
+    last_seen = {}
+    for dev_id, entry in snapshot.get("last_seen", {}).items():
+        entry["last_seen"] = datetime.fromisoformat(entry["last_seen"])
+        last_seen[dev_id] = entry
+    last_seen_table.restore(last_seen)
+    restore_indexes(snapshot.get("employee_indexes", {}), elapsed=elapsed)
+
+    logging.info("Loaded listener snapshot saved %.0fs ago with %s devices", elapsed, len(last_seen))
+    return True
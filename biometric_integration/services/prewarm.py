@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import frappe
+from biometric_integration.services.device_mapping import get_biometric_assets_dir
+from biometric_integration.services.site_executor import SITE_TASK_TIMEOUT, site_executor
+
+# Minutes of the day per histogram bucket
+BUCKET_MINUTES = 5
+BUCKETS_PER_DAY = 24 * 60 // BUCKET_MINUTES
+# Each day's counts weigh this much less the next day, so the histogram follows roster changes within a week
+DAILY_DECAY = 0.7
+# A bucket is a peak when it holds this many times the site's average and at least MIN_PEAK_PUNCHES
+PEAK_FACTOR = 3
+MIN_PEAK_PUNCHES = 20
+# Seconds before a peak bucket that its site is warmed
+PREWARM_LEAD = 5 * 60
+PREWARM_INTERVAL = 60
+# Hours of check-ins read to warm the database pages the duplicate check uses
+DUPLICATE_WINDOW_HOURS = 1
+
+class PunchHistogram:
+    """Punches received per site and time of day, decayed daily, to tell when each site's peaks are."""
+
+    def __init__(self):
+        self.day = datetime.now().date()
+        self.sites = {}
+        self.changed = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_bucket(moment):
+        return (moment.hour * 60 + moment.minute) // BUCKET_MINUTES
+
+    def record(self, site_name, count=1, moment=None):
+        moment = moment or datetime.now()
+        with self._lock:
+            self.roll_over(moment.date())
+            buckets = self.sites.get(site_name)
+            if buckets is None:
+                buckets = self.sites[site_name] = [0.0] * BUCKETS_PER_DAY
+            buckets[self.get_bucket(moment)] += count
+            self.changed = True
+
+    def roll_over(self, today):
+        if today == self.day:
+            return
+        factor = DAILY_DECAY ** max((today - self.day).days, 1)
+        for buckets in self.sites.values():
+            for bucket, count in enumerate(buckets):
+                buckets[bucket] = count * factor
+        self.day = today
+        self.changed = True
+
+    def get_peaks(self, site_name):
+        """Buckets of the site's usual peaks."""
+        buckets = self.sites.get(site_name)
+        if not buckets:
+            return set()
+        threshold = max(MIN_PEAK_PUNCHES, PEAK_FACTOR * sum(buckets) / BUCKETS_PER_DAY)
+        return {bucket for bucket, count in enumerate(buckets) if count >= threshold}
+
+    def get_sites_near_peak(self, moment=None, lead=PREWARM_LEAD):
+        """Sites with a peak starting within `lead` seconds of `moment` or under way."""
+        moment = moment or datetime.now()
+        upcoming = {
+            self.get_bucket(moment + timedelta(seconds=offset))
+            for offset in range(-BUCKET_MINUTES * 60, int(lead) + 1, BUCKET_MINUTES * 60)
+        }
+        with self._lock:
+            self.roll_over(moment.date())
+            return [site_name for site_name in self.sites if self.get_peaks(site_name) & upcoming]
+
+    def to_dict(self):
+        with self._lock:
+            self.changed = False
+            return {"day": self.day.isoformat(), "sites": {site_name: list(buckets) for site_name, buckets in self.sites.items()}}
+
+    def load(self, data):
+        with self._lock:
+            self.day = datetime.strptime(data["day"], "%Y-%m-%d").date()
+            self.sites = {
+                site_name: buckets for site_name, buckets in data.get("sites", {}).items()
+                if len(buckets) == BUCKETS_PER_DAY
+            }
+            self.roll_over(datetime.now().date())
+
+punch_histogram = PunchHistogram()
+
+def get_histogram_path():
+    return os.path.join(get_biometric_assets_dir(), "punch_histogram.json")
+
+def load_histogram():
+    file_path = get_histogram_path()
+    if not os.path.exists(file_path):
+        return
+    try:
+        with open(file_path, "r") as f:
+            punch_histogram.load(json.load(f))
+    except Exception as e:
+        logging.error("Error loading punch histogram: %s", e)
+
+def save_histogram():
+    if not punch_histogram.changed:
+        return
+    file_path = get_histogram_path()
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(punch_histogram.to_dict(), f)
+    os.replace(tmp_path, file_path)
+
+def record_punches(count):
+    """Count punches received by the current site, called where check-ins are inserted."""
+    punch_histogram.record(frappe.local.site, count)
+
+def warm_site(site_name, full):
+    """
+    Load what the first punches of a peak would otherwise wait for, on one of the site's own workers.
+
+    Args:
+        site_name (str): The site to warm.
+        full (bool): Also read the recent check-ins, done once per peak.
+    """
+    # Imported on the first warm-up, a listener that never warms a site doesn't load them
+    from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import get_settings
+    from biometric_integration.services.employee_index import get_employee_index
+    from biometric_integration.utils.site_session import init_site, destroy_site
+
+    try:
+        init_site(site_name=site_name)
+        get_settings()
+        # Rebuilt now if it would expire before the next round, not by a request during the peak
+        get_employee_index(min_remaining=PREWARM_INTERVAL * 2)
+        if full:
+            frappe.get_all(
+                "Employee Checkin",
+                filters={"time": [">=", frappe.utils.add_to_date(frappe.utils.now_datetime(), hours=-DUPLICATE_WINDOW_HOURS)]},
+                pluck="employee",
+            )
+    finally:
+        destroy_site()
+
+def prewarm_sites(last_warmed):
+    """
+    Warm every site near one of its peaks.
+
+    Args:
+        last_warmed (dict): Site name mapped to when it was last fully warmed, updated in place.
+    """
+    now = time.monotonic()
+    for site_name in punch_histogram.get_sites_near_peak():
+        full = now - last_warmed.get(site_name, 0) > PREWARM_LEAD * 2
+        try:
+            site_executor.get_pool(site_name).run(warm_site, site_name, full)
+            if full:
+                last_warmed[site_name] = now
+                logging.info("Pre-warmed site %s for its punch peak", site_name)
+        except Exception as e:
+            logging.warning("Could not pre-warm site %s: %s", site_name, e)
+
+def get_prewarm_status():
+    """Peak times learned for each site, for the local status endpoint."""
+    status = {}
+    with punch_histogram._lock:
+        for site_name in punch_histogram.sites:
+            status[site_name] = [
+                f"{bucket * BUCKET_MINUTES // 60:02d}:{bucket * BUCKET_MINUTES % 60:02d}"
+                for bucket in sorted(punch_histogram.get_peaks(site_name))
+            ]
+    return status
+
+_prewarmer_stop = threading.Event()
+_prewarmer = {"thread": None}
+
+def start_prewarmer(interval=PREWARM_INTERVAL):
+    """Start the background thread that warms sites ahead of their punch peaks and saves the histogram."""
+    _prewarmer_stop.clear()
+    load_histogram()
+
+    def run():
+        last_warmed = {}
+        while not _prewarmer_stop.wait(interval):
+            try:
+                prewarm_sites(last_warmed)
+                save_histogram()
+            except Exception as e:
+                logging.error("Error in prewarmer: %s", e, exc_info=True)
+        # Saved by this thread only, so two writes never share the temporary file
+        try:
+            save_histogram()
+        except Exception as e:
+            logging.error("Error saving punch histogram: %s", e, exc_info=True)
+
+    thread = _prewarmer["thread"] = threading.Thread(target=run, name="biometric-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def stop_prewarmer(timeout=SITE_TASK_TIMEOUT + 5):
+    """
+    Stop the prewarmer thread and wait for it to save the histogram.
+
+    Call it while the site executor still runs, a warm-up under way needs it to finish.
+    """
+    _prewarmer_stop.set()
+    thread = _prewarmer["thread"]
+    if thread:
+        thread.join(timeout)
+        _prewarmer["thread"] = None
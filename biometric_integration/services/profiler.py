@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# Seconds sampled when no duration is given, and the most a single profile may run
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 600
+# Seconds between stack samples, 100 samples per second keeps the overhead around a percent
+SAMPLE_INTERVAL = 0.01
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every listener thread for a while and aggregates them, together with the
+    wall and CPU time of each protocol handler call, without tracing every function call.
+
+    Results are written to `output_dir` as collapsed stacks (one "frame;frame;frame count" line per stack,
+    the input of flamegraph.pl and speedscope) and a JSON breakdown per handler.
+    """
+
+    def __init__(self, output_dir, interval=SAMPLE_INTERVAL):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.active = False
+        self.started_at = None
+        self.ends_at = None
+        self.last_output = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stacks = Counter()
+        self._handlers = {}
+        self._labels = {}
+        self._samples = 0
+        self._sampling_time = 0.0
+
+    def start(self, seconds=DEFAULT_PROFILE_SECONDS):
+        """Start sampling for `seconds`, does nothing if a profile is already running."""
+        seconds = min(max(float(seconds), 1), MAX_PROFILE_SECONDS)
+        with self._lock:
+            if self.active:
+                return self.get_status()
+            self.active = True
+            self._stop.clear()
+            self._stacks = Counter()
+            self._handlers = {}
+            self._samples = 0
+            self._sampling_time = 0.0
+            self.started_at = time.time()
+            self.ends_at = self.started_at + seconds
+
+        threading.Thread(target=self.run, args=(seconds,), name="biometric-profiler", daemon=True).start()
+        logging.info("Profiling the listener for %gs", seconds)
+        return self.get_status()
+
+    def stop(self):
+        """End the running profile early, its results are still written."""
+        self._stop.set()
+
+    def run(self, seconds):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                sample_started = time.perf_counter()
+                self.sample(own_id)
+                self._sampling_time += time.perf_counter() - sample_started
+                self._stop.wait(self.interval)
+        except Exception as e:
+            logging.error("Error while profiling the listener: %s", e, exc_info=True)
+        try:
+            self.last_output = self.write_results()
+            logging.info("Listener profile written to %s", self.last_output['stacks'])
+        except Exception as e:
+            logging.error("Error writing the listener profile: %s", e, exc_info=True)
+        finally:
+            with self._lock:
+                self.active = False
+
+    def get_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def sample(self, own_id):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self.get_label(frame.f_code))
+                frame = frame.f_back
+            # Threads of one pool share a root frame, e.g. "site-a.local_3" and "site-a.local_7"
+            root = re.sub(r"[_-]?\d+$", "", thread_names.get(thread_id, "unknown"))
+            labels.append(root)
+            self._stacks[";".join(reversed(labels))] += 1
+        self._samples += 1
+
+    def record_handler(self, name, wall, cpu):
+        with self._lock:
+            stats = self._handlers.get(name)
+            if stats is None:
+                stats = self._handlers[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0}
+            stats["calls"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+            stats["max_wall"] = max(stats["max_wall"], wall)
+
+    def write_results(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(
+            self.output_dir, f"biometric_listener.profile-{datetime.fromtimestamp(self.started_at):%Y%m%d-%H%M%S}"
+        )
+
+        stacks_path = f"{base_path}.folded"
+        with open(stacks_path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with self._lock:
+            handlers = {
+                name: {
+                    "calls": stats["calls"],
+                    "wall_seconds": round(stats["wall"], 4),
+                    "cpu_seconds": round(stats["cpu"], 4),
+                    "mean_wall_ms": round(stats["wall"] / stats["calls"] * 1000, 2),
+                    "max_wall_ms": round(stats["max_wall"] * 1000, 2),
+                    # Wall time not spent on CPU, i.e. waiting on the database, disk or locks
+                    "wait_ratio": round(1 - stats["cpu"] / stats["wall"], 3) if stats["wall"] else 0,
+                }
+                for name, stats in sorted(self._handlers.items(), key=lambda item: -item[1]["wall"])
+            }
+        elapsed = time.time() - self.started_at
+        summary = {
+            "started": datetime.fromtimestamp(self.started_at).isoformat(),
+            "seconds": round(elapsed, 2),
+            "samples": self._samples,
+            "sampling_overhead": round(self._sampling_time / elapsed, 4) if elapsed else 0,
+            "handlers": handlers,
+        }
+        handlers_path = f"{base_path}.json"
+        with open(handlers_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+        return {"stacks": stacks_path, "handlers": handlers_path}
+
+    def get_status(self):
+        return {
+            "active": self.active,
+            "started": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "ends_at": datetime.fromtimestamp(self.ends_at).isoformat() if self.active else None,
+            "samples": self._samples,
+            "last_output": self.last_output,
+        }
+
+def profile_handler(handler, name):
+    """
+    Wrap a protocol handler so each call's wall and CPU time is added to the running profile.
+
+    The times are taken in the thread that runs the handler, which may be one of the site's workers.
+    """
+    def profiled(*args, **kwargs):
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            listener_profiler.record_handler(name, time.perf_counter() - wall_started, time.thread_time() - cpu_started)
+    return profiled
+
+def install_signal_handler(signum=None):
+    """
+    Start a profile of DEFAULT_PROFILE_SECONDS when the listener process receives `signum`, SIGUSR2 by default.
+
+    Must be called from the main thread.
+    """
+    import signal
+
+    signum = signum or getattr(signal, "SIGUSR2", None)
+    if signum is None:
+        return
+    signal.signal(signum, lambda *args: listener_profiler.start())
+
+def start_profile_from_request(query):
+    """Admin action starting a profile, `?seconds=N` sets its duration."""
+    seconds = (query.get("seconds") or [DEFAULT_PROFILE_SECONDS])[0]
+    try:
+        return listener_profiler.start(float(seconds))
+    except ValueError:
+        return {"error": f"Invalid seconds {seconds}"}
+
+def stop_profile_from_request(query):
+    """Admin action ending the running profile early."""
+    listener_profiler.stop()
+    return listener_profiler.get_status()
+
+# Results go next to biometric_listener.log, set by the listener at startup
+listener_profiler = SamplingProfiler(output_dir=".")
@@ -0,0 +1,164 @@
+import importlib
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+from biometric_integration.services.request_body import MAX_REQUEST_BODY
+
+class ProtocolHandler:
+    """
+    A brand push protocol served by the listener.
+
+    The handler is given as a dotted path and its module is imported on the first request
+    that reaches it, so a listener serving one brand never loads the others.
+
+    Args:
+        brand (str): Device brand, as in Biometric Device.brand.
+        routes (dict): HTTP method mapped to the list of paths the protocol serves.
+        handler (str): Dotted path of `handler(request, raw_data, headers) -> (body, status, headers)`.
+        required_headers (list): Headers a request must carry, otherwise it is answered with 400.
+        max_concurrency (int): Maximum requests handled at the same time, None for no limit.
+        device_id_header (str): Header carrying the device ID.
+        device_id_param (str): Query string parameter carrying the device ID.
+        busy_response (tuple): (body, status, headers) sent when a request is shed, it must make the device retry later.
+        streaming_body (bool): Pass the handler a RequestBody to stream instead of the body bytes.
+        max_body_size (int): Largest Content-Length accepted, bigger requests are rejected before reading.
+        error_response (callable): Tells from a handler's (body, status, headers) whether it answered with
+            the protocol's error reply. Such replies and 5xx statuses count as failures of the device's site.
+    """
+
+    def __init__(self, brand, routes, handler, required_headers=None, max_concurrency=None,
+                 device_id_header=None, device_id_param=None, busy_response=("", 503, {}),
+                 streaming_body=False, max_body_size=MAX_REQUEST_BODY, error_response=None):
+        self.brand = brand
+        self.routes = routes
+        self.handler_path = handler
+        self.required_headers = required_headers or []
+        self.max_concurrency = max_concurrency
+        self.device_id_header = device_id_header
+        self.device_id_param = device_id_param
+        self.busy_response = busy_response
+        self.streaming_body = streaming_body
+        self.max_body_size = max_body_size
+        self.error_response = error_response
+        self._handler = None
+        self._load_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def get_handler(self):
+        if self._handler is None:
+            with self._load_lock:
+                if self._handler is None:
+                    module_path, attr = self.handler_path.rsplit(".", 1)
+                    module = importlib.import_module(module_path)
+                    self._handler = getattr(module, attr)
+                    logging.info("Loaded %s protocol handler %s", self.brand, self.handler_path)
+        return self._handler
+
+    def get_device_id(self, request):
+        if self.device_id_header:
+            return request.headers.get(self.device_id_header)
+        if self.device_id_param:
+            values = parse_qs(urlsplit(request.path).query).get(self.device_id_param)
+            return values[0] if values else None
+        return None
+
+    def is_failed_response(self, response):
+        """Whether a handler's (body, status, headers) reports an error rather than an answer to the device."""
+        if response[1] >= 500:
+            return True
+        return bool(self.error_response and self.error_response(response))
+
+    @property
+    def is_loaded(self):
+        return self._handler is not None
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """
+        Hold one of the protocol's concurrency slots for the duration of a request.
+
+        Yields:
+            bool: False if no slot became free within `timeout` seconds.
+        """
+        if not self._slots:
+            yield True
+            return
+
+        acquired = self._slots.acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._slots.release()
+
+_protocols_by_route = {}
+_protocols_by_brand = {}
+
+def register_protocol(protocol):
+    """
+    Register a protocol for all of its routes. A later registration for the same route replaces the earlier one.
+
+    Args:
+        protocol (ProtocolHandler): The protocol to register.
+    """
+    for method, paths in protocol.routes.items():
+        for path in paths:
+            _protocols_by_route[(method.upper(), path)] = protocol
+    _protocols_by_brand[protocol.brand] = protocol
+
+def get_protocol(method, path):
+    """
+    Get the protocol serving a request.
+
+    Args:
+        method (str): HTTP method.
+        path (str): Normalized request path without query string.
+
+    Returns:
+        ProtocolHandler: The protocol, or None if no protocol serves the route.
+    """
+    return _protocols_by_route.get((method.upper(), path))
+
+def get_protocol_for_brand(brand):
+    return _protocols_by_brand.get(brand)
+
+def get_registered_protocols():
+    return list(_protocols_by_brand.values())
+
+def is_ebkn_error(response):
+    return response[2].get("response_code") == "ERROR"
+
+def is_adms_error(response):
+    return response[0] == "ERROR"
+
+register_protocol(ProtocolHandler(
+    brand="EBKN",
+    routes={"POST": ["/ebkn"]},
+    handler="biometric_integration.services.ebkn_processor.handle_ebkn",
+    required_headers=["dev_id"],
+    device_id_header="dev_id",
+    # A non-OK response_code makes the terminal keep the record and resend it later
+    busy_response=("", 200, {"response_code": "ERROR"}),
+    # Blocks are appended to the partial transfer file straight from the socket
+    streaming_body=True,
+    max_body_size=4 * 1024 * 1024,
+    error_response=is_ebkn_error,
+    # Not a per-device limit: a device waits for each block's reply before sending the next one,
+    # which is what keeps the blocks of its transfer in order
+    max_concurrency=None,
+))
+
+register_protocol(ProtocolHandler(
+    brand="ZKTeco",
+    routes={
+        "GET": ["/iclock/cdata", "/iclock/getrequest"],
+        "POST": ["/iclock/cdata", "/iclock/devicecmd"],
+    },
+    handler="biometric_integration.services.adms_processor.handle_adms",
+    device_id_param="SN",
+    busy_response=("ERROR", 503, {"Content-Type": "text/plain"}),
+    error_response=is_adms_error,
+    # ATTLOG uploads end in many check-in inserts, don't let a reconnect storm run one per device at once
+    max_concurrency=8,
+))
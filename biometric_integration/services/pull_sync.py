@@ -0,0 +1,277 @@
+import http.client
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import frappe
+from biometric_integration.services.create_checkin import insert_employee_checkins
+from biometric_integration.services.punch_records import (
+    IO_MODE_IN,
+    build_punches,
+    normalize_log_types,
+    parse_compact_timestamps,
+    parse_user_ids,
+)
+from biometric_integration.biometric_integration.doctype.biometric_integration_settings.biometric_integration_settings import get_settings
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_DEVICE_TIMEOUT = 20
+PAGE_SIZE = 500
+# The cron fires every 5 minutes, leave headroom so runs never overlap.
+SYNC_WINDOW = 240
+MAX_IDLE_CONNECTIONS_PER_DEVICE = 2
+
+_connection_pool = {}
+_connection_pool_lock = threading.Lock()
+
+def get_connection(host, port, timeout):
+    """
+    Take an idle keep-alive connection to the device from the pool, or open a new one.
+
+    Args:
+        host (str): Device IP or hostname.
+        port (int): Device port.
+        timeout (float): Socket timeout in seconds.
+
+    Returns:
+        http.client.HTTPConnection: A connection ready for the next request.
+    """
+    key = (host, int(port))
+    with _connection_pool_lock:
+        idle = _connection_pool.get(key)
+        conn = idle.pop() if idle else None
+
+    if conn is None:
+        conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    else:
+        conn.timeout = timeout
+        if conn.sock:
+            conn.sock.settimeout(timeout)
+    return conn
+
+def release_connection(conn, reusable=True):
+    """
+    Return a connection to the pool so the next page or the next run can reuse it.
+
+    Args:
+        conn (http.client.HTTPConnection): The connection to release.
+        reusable (bool): False if the connection is in an unknown state and must be closed.
+    """
+    if reusable and conn.sock:
+        key = (conn.host, conn.port)
+        with _connection_pool_lock:
+            idle = _connection_pool.setdefault(key, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS_PER_DEVICE:
+                idle.append(conn)
+                return
+    conn.close()
+
+def close_all_connections():
+    """Close every pooled connection."""
+    with _connection_pool_lock:
+        pooled = [conn for idle in _connection_pool.values() for conn in idle]
+        _connection_pool.clear()
+    for conn in pooled:
+        conn.close()
+
+def fetch_log_page(conn, after_id, limit):
+    """
+    Request one page of attendance logs newer than `after_id` from a device that serves them as JSON.
+
+    This is the reference fetcher for `PULL_FETCHERS`, it is not registered for any brand. The device answers `GET /logs?after=<id>&limit=<n>` with
+    `{"logs": [{"id", "user_id", "io_time", "io_mode"}, ...], "has_more": bool}`
+    where `io_time` uses the same `%Y%m%d%H%M%S` format as EBKN glogs.
+
+    Args:
+        conn (http.client.HTTPConnection): Connection to the device.
+        after_id (int): Last log ID already synced.
+        limit (int): Maximum number of logs to return.
+
+    Returns:
+        tuple: (list of log dicts, bool has_more)
+    """
+    conn.request("GET", f"/logs?after={after_id}&limit={limit}", headers={"Connection": "keep-alive"})
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise ConnectionError(f"Device answered with HTTP {response.status}")
+
+    payload = json.loads(body.decode("utf-8"))
+    return payload.get("logs") or [], bool(payload.get("has_more"))
+
+# Brand mapped to its fetcher, a callable (conn, after_id, limit) -> (logs, has_more).
+# Only brands listed here are polled, devices of any other brand are left alone.
+PULL_FETCHERS = {}
+
+def pull_device_logs(device, timeout, page_size=PAGE_SIZE, run_deadline=None):
+    """
+    Pull every log newer than the device's `last_synced_id`, page by page, over a pooled connection.
+
+    This runs in a worker thread and must not touch the Frappe site context.
+
+    Args:
+        device (dict): Device row with name, brand, device_ip, device_port and last_synced_id.
+        timeout (float): Total seconds this device may take.
+        page_size (int): Number of logs requested per page.
+        run_deadline (float): `time.monotonic()` value the whole run must finish by, if any.
+
+    Returns:
+        dict: Contains 'records', 'last_synced_id' and 'error' (None on success).
+    """
+    deadline = time.monotonic() + timeout
+    if run_deadline is not None:
+        deadline = min(deadline, run_deadline)
+    last_synced_id = device.get("last_synced_id") or 0
+    records = []
+    fetch_page = PULL_FETCHERS.get(device.get("brand"))
+    if fetch_page is None:
+        return {"records": records, "last_synced_id": last_synced_id, "error": f"No pull fetcher for brand {device.get('brand')}"}
+
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if run_deadline is not None and deadline == run_deadline:
+                    raise TimeoutError("Sync window exceeded")
+                raise TimeoutError(f"Device did not finish within {timeout} seconds")
+
+            conn = get_connection(device["device_ip"], device["device_port"], remaining)
+            try:
+                logs, has_more = fetch_page(conn, last_synced_id, page_size)
+            except Exception:
+                release_connection(conn, reusable=False)
+                raise
+            release_connection(conn)
+
+            page_start_id = last_synced_id
+            for log in logs:
+                log_id = int(log.get("id") or 0)
+                if log_id <= last_synced_id:
+                    continue
+                records.append(log)
+                last_synced_id = log_id
+
+            if not has_more or not logs:
+                break
+            if last_synced_id == page_start_id:
+                # The device sent a page with nothing new, asking again would return the same page forever
+                logging.warning("Device %s claims more logs but sent none after %s", device.get("name"), last_synced_id)
+                break
+
+        return {"records": records, "last_synced_id": last_synced_id, "error": None}
+
+    except Exception as e:
+        # Keep what was fetched so far, the next run resumes from there.
+        return {"records": records, "last_synced_id": last_synced_id, "error": str(e)}
+
+def pull_devices(devices, max_concurrency=DEFAULT_CONCURRENCY, device_timeout=DEFAULT_DEVICE_TIMEOUT, window=SYNC_WINDOW):
+    """
+    Pull logs from many devices at once.
+
+    Every socket operation is bounded by the time left for its device and for the whole run,
+    so all workers are done by the end of the window and no thread outlives the call.
+
+    Args:
+        devices (list): Device rows, see `pull_device_logs`.
+        max_concurrency (int): Maximum number of devices polled at the same time.
+        device_timeout (float): Seconds each device may take.
+        window (float): Seconds the whole run may take.
+
+    Returns:
+        dict: Device name mapped to its pull result.
+    """
+    results = {}
+    if not devices:
+        return results
+
+    run_deadline = time.monotonic() + window
+    workers = max(1, min(max_concurrency, len(devices)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="biometric-pull") as executor:
+        futures = {
+            executor.submit(pull_device_logs, device, device_timeout, run_deadline=run_deadline): device["name"]
+            for device in devices
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return results
+
+def get_pull_devices():
+    """
+    Get the enabled devices that are synced by polling instead of push.
+
+    Returns:
+        list: Device rows for `pull_devices`, only for brands that have a fetcher.
+    """
+    if not PULL_FETCHERS:
+        return []
+
+    return frappe.get_all(
+        "Biometric Device",
+        filters={
+            "disabled": 0,
+            "push_protocol_configured": 0,
+            "brand": ["in", list(PULL_FETCHERS)],
+            "device_ip": ["is", "set"],
+        },
+        fields=["name", "brand", "device_ip", "device_port", "last_synced_id"],
+    )
+
+def apply_pull_result(device_name, result):
+    """
+    Create check-ins for the pulled records and move the device's sync cursor forward.
+
+    Args:
+        device_name (str): The Biometric Device name.
+        result (dict): The device's pull result.
+    """
+    if result.get("error"):
+        logging.error("Pull sync for device %s stopped early: %s", device_name, result["error"])
+
+    logs = result.get("records", [])
+    # Normalized a column at a time, the whole page at once
+    records, rejected = build_punches(
+        parse_user_ids([log.get("user_id") for log in logs]),
+        parse_compact_timestamps([log.get("io_time") for log in logs]),
+        normalize_log_types([log.get("io_mode") for log in logs], IO_MODE_IN),
+    )
+    for position in rejected:
+        logging.error("Skipping malformed log %s from device %s", logs[position], device_name)
+
+    if not insert_employee_checkins(records, device_id=device_name, commit=False):
+        # Keep the cursor where it was so the next run pulls the same logs again
+        return
+
+    values = {"last_synced_time": frappe.utils.now_datetime()}
+    if result.get("last_synced_id") is not None:
+        values["last_synced_id"] = result["last_synced_id"]
+
+    # set_value skips the document hooks, so the device-site map is not rewritten per device
+    frappe.db.set_value("Biometric Device", device_name, values, update_modified=False)
+    frappe.db.commit()
+
+def sync_all_devices():
+    """
+    Scheduled job that pulls attendance logs from every device without push protocol on the current site.
+
+    Does nothing until a fetcher is registered in `PULL_FETCHERS` for at least one brand.
+    """
+    devices = get_pull_devices()
+    if not devices:
+        return
+
+    settings = get_settings()
+    max_concurrency = settings.get("pull_sync_concurrency") or DEFAULT_CONCURRENCY
+    device_timeout = settings.get("pull_sync_timeout") or DEFAULT_DEVICE_TIMEOUT
+
+    started = time.monotonic()
+    results = pull_devices(devices, max_concurrency=max_concurrency, device_timeout=device_timeout)
+    logging.info("Pulled %s devices in %.2fs", len(results), time.monotonic() - started)
+
+    for device_name, result in results.items():
+        try:
+            apply_pull_result(device_name, result)
+        except Exception as e:
+            frappe.db.rollback()
+            logging.error("Error applying pull result for device %s: %s", device_name, e, exc_info=True)
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+LOG_TYPE_IN = "IN"
+LOG_TYPE_OUT = "OUT"
+# io_mode of an IN punch in EBKN glogs and pull sync logs
+IO_MODE_IN = (1, "1")
+
+class Punch:
+    """One attendance log ready to be stored, slots keep large batches small and attribute access cheap."""
+
+    __slots__ = ("employee_field_value", "timestamp", "log_type")
+
+    def __init__(self, employee_field_value, timestamp, log_type):
+        self.employee_field_value = employee_field_value
+        self.timestamp = timestamp
+        self.log_type = log_type
+
+    def __repr__(self):
+        return f"Punch({self.employee_field_value!r}, {self.timestamp!r}, {self.log_type!r})"
+
+def parse_user_ids(values):
+    """Device user IDs as ints, None where a value is not a number."""
+    user_ids = []
+    for value in values:
+        try:
+            user_ids.append(int(value))
+        except (TypeError, ValueError):
+            user_ids.append(None)
+    return user_ids
+
+def parse_compact_timestamps(values):
+    """
+    Parse `YYYYMMDDHHMMSS` times, as sent by EBKN devices and pull sync, by slicing instead of strptime.
+
+    Returns:
+        list: A datetime per value, None where a value is not a valid time.
+    """
+    timestamps = []
+    for value in values:
+        value = str(value).strip() if value is not None else ""
+        if len(value) != 14 or not value.isdigit():
+            timestamps.append(None)
+            continue
+        try:
+            timestamps.append(datetime(
+                int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                int(value[8:10]), int(value[10:12]), int(value[12:14]),
+            ))
+        except ValueError:
+            timestamps.append(None)
+    return timestamps
+
+def parse_iso_timestamps(values):
+    """
+    Parse `YYYY-MM-DD HH:MM:SS` times, as sent in ADMS uploads, with the C parser of fromisoformat.
+
+    Returns:
+        list: A datetime per value, None where a value is not a valid time.
+    """
+    timestamps = []
+    for value in values:
+        value = value.strip() if value else ""
+        try:
+            # fromisoformat also takes a T separator and other forms strptime used to reject
+            timestamps.append(datetime.fromisoformat(value) if len(value) == 19 and value[10] == " " else None)
+        except ValueError:
+            timestamps.append(None)
+    return timestamps
+
+def normalize_log_types(modes, in_modes):
+    """IN for every mode in `in_modes`, OUT for the others."""
+    return [LOG_TYPE_IN if mode in in_modes else LOG_TYPE_OUT for mode in modes]
+
+def build_punches(user_ids, timestamps, log_types):
+    """
+    Assemble punches from parsed columns.
+
+    Returns:
+        tuple: The punches, and the positions of the rows left out because their user ID or time was invalid.
+    """
+    punches = []
+    rejected = []
+    for position, (user_id, timestamp, log_type) in enumerate(zip(user_ids, timestamps, log_types)):
+        if user_id is None or timestamp is None:
+            rejected.append(position)
+            continue
+        punches.append(Punch(user_id, timestamp, log_type))
+    return punches, rejected
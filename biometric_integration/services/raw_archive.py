@@ -0,0 +1,154 @@
+import os
+import json
+import logging
+from datetime import datetime
+import frappe
+
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S_%f"
+# Characters of a formatted timestamp, e.g. 20241220_083000_123456
+TIMESTAMP_LENGTH = len("YYYYmmdd_HHMMSS_ffffff")
+# Request codes of the EBKN requests earlier listeners archived without metadata
+EBKN_REQUEST_CODES = ["realtime_glog", "realtime_enroll_data", "receive_cmd", "send_cmd_result"]
+
+def get_raw_data_dir():
+    bench_path = frappe.utils.get_bench_path()
+    raw_data_dir = os.path.join(bench_path, "sites", "assets", "biometric_assets", "raw_data_logs")
+    os.makedirs(raw_data_dir, exist_ok=True)
+    return raw_data_dir
+
+def get_raw_data_file_path(request_code, device_id, received_at=None):
+    timestamp = (received_at or datetime.now()).strftime(TIMESTAMP_FORMAT)
+    request_code = request_code or "unknown"
+    device_id = device_id or "unknown"
+
+    filename = f"{timestamp}_{request_code}_{device_id}.bin"
+    return os.path.join(get_raw_data_dir(), filename)
+
+def get_meta_file_path(file_path):
+    return os.path.splitext(file_path)[0] + ".json"
+
+def open_raw_data_file(request_code, device_id, request_meta=None):
+    """
+    Open a raw data file that a streamed request body is copied into, or None if it can't be created.
+
+    Args:
+        request_code (str): The request code, if the protocol has one.
+        device_id (str): The device that sent the request.
+        request_meta (dict): Method, path, headers and Content-Length of the request, stored next to
+            the body so the request can be replayed.
+    """
+    try:
+        received_at = datetime.now()
+        file_path = get_raw_data_file_path(request_code, device_id, received_at)
+        if request_meta is not None:
+            meta = dict(request_meta, device_id=device_id, received_at=received_at.isoformat())
+            with open(get_meta_file_path(file_path), "w") as f:
+                json.dump(meta, f)
+        return open(file_path, "wb")
+    except Exception as e:
+        logging.error("Failed to open raw data file: %s", e)
+        return None
+
+def save_raw_data(raw_data, request_code, device_id):
+    try:
+        file_path = get_raw_data_file_path(request_code, device_id)
+        with open(file_path, "wb") as file:
+            file.write(raw_data)
+
+        logging.info("Raw data saved to %s", file_path)
+
+    except Exception as e:
+        logging.error("Failed to save raw data: %s", e)
+
+def get_meta_from_file_name(stem, body_path):
+    """
+    Metadata of a request archived without its JSON sidecar, read from the `{timestamp}_{request_code}_{device_id}`
+    file name that save_raw_data and earlier listeners wrote for EBKN requests.
+
+    Such files don't record their block number or whether they were cut off, so they replay as single blocks.
+
+    Returns:
+        dict: The request metadata, or None if the name doesn't follow the convention.
+    """
+    rest = stem[TIMESTAMP_LENGTH + 1:]
+    # Request codes and device IDs may both contain underscores, split after a known request code first
+    request_code = next((code for code in EBKN_REQUEST_CODES if rest.startswith(code + "_")), None)
+    if request_code:
+        device_id = rest[len(request_code) + 1:]
+    else:
+        request_code, _, device_id = rest.rpartition("_")
+    if not request_code or request_code == "unknown" or not device_id or device_id == "unknown":
+        return None
+    try:
+        received_at = datetime.strptime(stem[:TIMESTAMP_LENGTH], TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return {
+        "method": "POST",
+        "path": "/ebkn",
+        "headers": {"request_code": request_code, "dev_id": device_id},
+        "content_length": os.path.getsize(body_path),
+        "device_id": device_id,
+        "received_at": received_at.isoformat(),
+    }
+
+def iter_archived_requests(device_ids=None, since=None, until=None, request_codes=None):
+    """
+    Stream archived requests oldest first, skipping anything outside the filters before reading it.
+
+    Requests archived without their metadata are described from their file name, see get_meta_from_file_name.
+    Bodies shorter than their Content-Length were cut off while being received and are skipped.
+
+    Args:
+        device_ids (list): Only these devices, None for all.
+        since (datetime): Only requests received at or after this time.
+        until (datetime): Only requests received before this time.
+        request_codes (list): Only these request codes, None for all.
+
+    Yields:
+        dict: The request metadata with 'body_path' added.
+    """
+    raw_data_dir = get_raw_data_dir()
+    device_ids = {str(device_id) for device_id in device_ids} if device_ids else None
+    since_prefix = since.strftime(TIMESTAMP_FORMAT) if since else None
+    until_prefix = until.strftime(TIMESTAMP_FORMAT) if until else None
+
+    files = {}
+    for entry in os.scandir(raw_data_dir):
+        stem, extension = os.path.splitext(entry.name)
+        if extension in (".json", ".bin"):
+            files.setdefault(stem, set()).add(extension)
+
+    # The timestamp prefix sorts in arrival order
+    for stem in sorted(files):
+        prefix = stem[:TIMESTAMP_LENGTH]
+        if since_prefix and prefix < since_prefix:
+            continue
+        if until_prefix and prefix >= until_prefix:
+            break
+
+        meta_path = os.path.join(raw_data_dir, stem + ".json")
+        body_path = os.path.join(raw_data_dir, stem + ".bin")
+        if ".json" in files[stem]:
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except Exception as e:
+                logging.error("Skipping unreadable archive metadata %s.json: %s", stem, e)
+                continue
+        else:
+            meta = get_meta_from_file_name(stem, body_path)
+            if not meta:
+                continue
+
+        if device_ids and str(meta.get("device_id")) not in device_ids:
+            continue
+        headers = meta.get("headers") or {}
+        if request_codes and headers.get("request_code") not in request_codes:
+            continue
+        if not os.path.exists(body_path) or os.path.getsize(body_path) != int(meta.get("content_length") or 0):
+            logging.warning("Skipping incomplete archived request %s", stem)
+            continue
+
+        meta["body_path"] = body_path
+        yield meta
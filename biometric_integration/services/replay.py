@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from biometric_integration.services.protocol_registry import get_protocol
+from biometric_integration.services.raw_archive import iter_archived_requests
+from biometric_integration.services.request_body import RequestBody
+
+# Punches and enrollments are safe to replay, duplicate check-ins are detected on insert.
+# Command polls and results would re-drive the command queue and are opt-in.
+DEFAULT_REQUEST_CODES = ["realtime_glog", "realtime_enroll_data"]
+DEFAULT_LANES = 8
+# Requests read ahead per lane before the archive reader waits
+LANE_QUEUE_SIZE = 256
+
+def replay_request(meta):
+    """
+    Feed one archived request to the handler of its protocol, as the listener would have.
+
+    Args:
+        meta (dict): Archived request metadata with 'body_path'.
+
+    Returns:
+        bool: True if the handler answered with HTTP 200 and, where present, response_code OK.
+    """
+    path = urlsplit(meta["path"]).path
+    protocol = get_protocol(meta["method"], "/" + path.lstrip("/"))
+    if not protocol:
+        logging.error("No protocol serves archived request %s %s", meta['method'], meta['path'])
+        return False
+
+    with open(meta["body_path"], "rb") as f:
+        body = RequestBody(f, int(meta.get("content_length") or 0))
+        raw_data = body if protocol.streaming_body else body.read()
+        request = SimpleNamespace(command=meta["method"], path=meta["path"], headers=meta["headers"])
+        try:
+            _, status, response_headers = protocol.get_handler()(request, raw_data, meta["headers"])
+        finally:
+            body.close()
+
+    return status == 200 and response_headers.get("response_code", "OK") == "OK"
+
+def replay_archive(device_ids=None, since=None, until=None, request_codes=None, lanes=DEFAULT_LANES, dry_run=False):
+    """
+    Replay archived raw requests through the protocol handlers.
+
+    Requests of one device always go through the same lane in arrival order, so multi-block
+    transfers are reassembled correctly; different devices are replayed in parallel lanes.
+
+    Args:
+        device_ids (list): Only these devices, None for all.
+        since (datetime): Only requests received at or after this time.
+        until (datetime): Only requests received before this time.
+        request_codes (list): Only these request codes, defaults to DEFAULT_REQUEST_CODES.
+        lanes (int): Number of parallel lanes.
+        dry_run (bool): Only count what would be replayed.
+
+    Returns:
+        dict: Totals per request code, errors and throughput.
+    """
+    request_codes = request_codes or DEFAULT_REQUEST_CODES
+    stats = {"requests": 0, "succeeded": 0, "failed": 0, "by_request_code": {}, "devices": set()}
+    stats_lock = threading.Lock()
+    started = time.monotonic()
+
+    def record(meta, succeeded):
+        request_code = meta["headers"].get("request_code") or meta["path"]
+        with stats_lock:
+            stats["requests"] += 1
+            stats["succeeded" if succeeded else "failed"] += 1
+            stats["by_request_code"][request_code] = stats["by_request_code"].get(request_code, 0) + 1
+            stats["devices"].add(meta.get("device_id"))
+
+    archived = iter_archived_requests(device_ids=device_ids, since=since, until=until, request_codes=request_codes)
+
+    if dry_run:
+        for meta in archived:
+            record(meta, True)
+    else:
+        lane_queues = [queue.Queue(maxsize=LANE_QUEUE_SIZE) for _ in range(max(1, lanes))]
+
+        def run_lane(lane_queue):
+            while True:
+                meta = lane_queue.get()
+                if meta is None:
+                    return
+                try:
+                    succeeded = replay_request(meta)
+                except Exception as e:
+                    logging.error("Error replaying %s: %s", meta['body_path'], e, exc_info=True)
+                    succeeded = False
+                record(meta, succeeded)
+
+        workers = [threading.Thread(target=run_lane, args=(lane_queue,), daemon=True) for lane_queue in lane_queues]
+        for worker in workers:
+            worker.start()
+
+        lane_of_device = {}
+        for meta in archived:
+            device_id = meta.get("device_id")
+            if device_id not in lane_of_device:
+                lane_of_device[device_id] = len(lane_of_device) % len(lane_queues)
+            lane_queues[lane_of_device[device_id]].put(meta)
+
+        for lane_queue in lane_queues:
+            lane_queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    elapsed = time.monotonic() - started
+    stats["devices"] = len(stats["devices"])
+    stats["dry_run"] = dry_run
+    stats["seconds"] = round(elapsed, 3)
+    stats["requests_per_second"] = round(stats["requests"] / elapsed, 1) if elapsed else None
+    return stats
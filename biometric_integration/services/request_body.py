@@ -0,0 +1,144 @@
+import io
+import threading
+from contextlib import contextmanager
+
+CHUNK_SIZE = 64 * 1024
+# Largest body accepted for a single request unless the protocol declares its own limit
+MAX_REQUEST_BODY = 8 * 1024 * 1024
+# Memory all bodies held in memory at the same time may use
+GLOBAL_MEMORY_BUDGET = 64 * 1024 * 1024
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+class MemoryBudget:
+    """Bytes of request bodies the listener may hold in memory at the same time."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        with self._lock:
+            if self.in_use + size > self.limit:
+                self.rejected += 1
+                return False
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.in_use -= size
+
+    @contextmanager
+    def hold(self, size):
+        """
+        Charge `size` bytes to the budget while the block runs, for data held in memory that is not a request body.
+
+        Raises:
+            MemoryBudgetExceeded: If the budget can't hold `size` bytes right now.
+        """
+        if not self.reserve(size):
+            raise MemoryBudgetExceeded(f"No memory budget left for {size} bytes")
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def get_stats(self):
+        with self._lock:
+            return {"limit": self.limit, "in_use": self.in_use, "peak": self.peak, "rejected": self.rejected}
+
+memory_budget = MemoryBudget(GLOBAL_MEMORY_BUDGET)
+
+class RequestBody:
+    """
+    A request body that is still on the socket.
+
+    Handlers either stream it in chunks, e.g. straight into a partial-transfer file,
+    or materialize it with `read()`, which is charged to the global memory budget.
+    Every chunk taken from the socket is also written to `tee` when given.
+
+    Args:
+        rfile (file): Stream positioned at the start of the body.
+        length (int): Content-Length of the body.
+        tee (file): Optional binary file that receives a copy of the body.
+    """
+
+    def __init__(self, rfile, length, tee=None):
+        self.rfile = rfile
+        self.length = length
+        self.remaining = length
+        self.tee = tee
+        self._data = None
+        self._reserved = 0
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(io.BytesIO(data), len(data))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def consumed(self):
+        return self.remaining == 0
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        if self._data is not None:
+            for start in range(0, len(self._data), chunk_size):
+                yield self._data[start:start + chunk_size]
+            return
+
+        while self.remaining > 0:
+            chunk = self.rfile.read(min(chunk_size, self.remaining))
+            if not chunk:
+                raise ConnectionError(f"Connection closed with {self.remaining} of {self.length} body bytes unread")
+            self.remaining -= len(chunk)
+            if self.tee:
+                self.tee.write(chunk)
+            yield chunk
+
+    def read(self):
+        """
+        Return the whole body as bytes.
+
+        Raises:
+            MemoryBudgetExceeded: If the global memory budget can't hold the body right now.
+        """
+        if self._data is None:
+            if self.remaining != self.length:
+                raise RuntimeError("Request body was already streamed")
+            if not memory_budget.reserve(self.length):
+                raise MemoryBudgetExceeded(f"No memory budget left for a {self.length} byte body")
+            self._reserved = self.length
+            self._data = b"".join(self.iter_chunks())
+        return self._data
+
+    def copy_to(self, fileobj):
+        """
+        Stream the body into `fileobj` without holding it in memory.
+
+        Returns:
+            int: Bytes written.
+        """
+        written = 0
+        for chunk in self.iter_chunks():
+            fileobj.write(chunk)
+            written += len(chunk)
+        return written
+
+    def discard(self):
+        """Drain what the handler did not read, so the next request on the connection starts at the right byte."""
+        for _ in self.iter_chunks():
+            pass
+
+    def close(self):
+        if self._reserved:
+            memory_budget.release(self._reserved)
+            self._reserved = 0
+        self._data = None
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from biometric_integration.services.request_body import MemoryBudgetExceeded
+
+# Handler threads per site
+SITE_WORKERS = 4
+# Requests that may wait for a busy site before new ones are rejected
+SITE_QUEUE_SIZE = 16
+# Seconds a request waits for its site before the device is told to retry
+SITE_TASK_TIMEOUT = 20
+# A request slower than this counts as a failure of its site
+SLOW_TASK_THRESHOLD = 10
+# Consecutive failures that open a site's circuit, and seconds before one trial request is let through
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+LATENCY_SAMPLES = 512
+
+class SiteUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let one trial request through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning("Opening circuit after %s failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class SiteWorkerPool:
+    """A site's own handler threads and bounded queue, so a slow site only ever ties up its own budget."""
+
+    def __init__(self, site_name, workers=SITE_WORKERS, queue_size=SITE_QUEUE_SIZE):
+        self.site_name = site_name
+        self.limit = workers + queue_size
+        self.breaker = CircuitBreaker()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"site-{site_name}")
+        self._lock = threading.Lock()
+
+    def can_accept(self):
+        return self.pending < self.limit and self.breaker.state != CircuitBreaker.OPEN
+
+    def run(self, fn, *args, is_failure=None):
+        """
+        Run `fn(*args)` on one of the site's threads and wait for its result.
+
+        Args:
+            is_failure (callable): Tells from `fn`'s result whether the site failed to handle the request,
+                for handlers that answer errors instead of raising them.
+
+        Raises:
+            SiteUnavailable: If the site's circuit is open, its queue is full, or it did not answer in time.
+        """
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            raise SiteUnavailable(f"Circuit open for site {self.site_name}")
+
+        with self._lock:
+            if self.pending >= self.limit:
+                self.rejected += 1
+                raise SiteUnavailable(f"Queue full for site {self.site_name}")
+            self.pending += 1
+
+        started = time.monotonic()
+        future = self._executor.submit(fn, *args)
+        future.timed_out = False
+        future.add_done_callback(lambda done: self._on_done(done, started, is_failure))
+
+        try:
+            return future.result(timeout=SITE_TASK_TIMEOUT)
+        except FutureTimeoutError:
+            future.timed_out = True
+            with self._lock:
+                self.timed_out += 1
+            self.breaker.record_failure()
+            raise SiteUnavailable(f"Site {self.site_name} did not answer within {SITE_TASK_TIMEOUT} seconds")
+
+    def _on_done(self, future, started, is_failure=None):
+        duration = time.monotonic() - started
+        exception = future.exception()
+        # A request shed for lack of memory says nothing about the site
+        failed = exception is not None and not isinstance(exception, MemoryBudgetExceeded)
+        if exception is None and is_failure:
+            try:
+                failed = bool(is_failure(future.result()))
+            except Exception:
+                failed = True
+        with self._lock:
+            self.pending -= 1
+            self.latencies.append(duration)
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+        if future.timed_out:
+            return
+        if failed or duration > SLOW_TASK_THRESHOLD:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def get_stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                "pending": self.pending,
+                "limit": self.limit,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "circuit": self.breaker.state,
+            }
+        if latencies:
+            stats["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1),
+            }
+        return stats
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+class SiteExecutor:
+    """Worker pools partitioned by site name, created on a site's first request."""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, site_name):
+        pool = self._pools.get(site_name)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(site_name)
+                if pool is None:
+                    pool = self._pools[site_name] = SiteWorkerPool(site_name)
+        return pool
+
+    def get_stats(self):
+        return {site_name: pool.get_stats() for site_name, pool in list(self._pools.items())}
+
+    def shutdown(self, wait=True):
+        for pool in list(self._pools.values()):
+            pool.shutdown(wait=wait)
+
+site_executor = SiteExecutor()
@@ -0,0 +1,475 @@
+import abc
+import json
+import logging
+import os
+import threading
+import time
+import frappe
+import redis
+
+# Bench-wide setting in sites/common_site_config.json, e.g. "redis://10.0.0.5:6379/2", or true for the bench's redis_cache.
+# Without it every listener keeps its state in files under sites/assets/biometric_assets.
+STATE_BACKEND_CONFIG_KEY = "biometric_state_backend"
+
+DEVICE_SITE = "device_site"
+BLOCK_SEQUENCE = "block_sequence"
+PARTIAL_DATA = "partial_data"
+
+# Seconds an entry of these namespaces lives after its last write, abandoned transfers expire on their own
+NAMESPACE_TTLS = {
+    BLOCK_SEQUENCE: 15 * 60,
+    PARTIAL_DATA: 15 * 60,
+}
+# Seconds a node may answer reads of these namespaces from its local copy
+CACHE_TTLS = {
+    DEVICE_SITE: 5,
+}
+# Times update_fields retries when another node changed the entry between its read and its write
+MAX_UPDATE_RETRIES = 5
+# The file backend keeps the names the listener always used
+NAMESPACE_FILES = {
+    DEVICE_SITE: "device_site.json",
+    BLOCK_SEQUENCE: "block_sequence_map.json",
+}
+
+class StateBackend(abc.ABC):
+    """
+    Namespaced key-value state and append-only blobs shared by the listener processes.
+
+    Values are JSON-serializable. Blobs hold the bytes of multi-block transfers while they are reassembled.
+    """
+
+    @abc.abstractmethod
+    def get(self, namespace, key, cached=True):
+        pass
+
+    @abc.abstractmethod
+    def get_many(self, namespace, keys):
+        """Values of `keys` that exist, in one round trip."""
+
+    @abc.abstractmethod
+    def get_all(self, namespace):
+        pass
+
+    @abc.abstractmethod
+    def set(self, namespace, key, value):
+        pass
+
+    @abc.abstractmethod
+    def update_fields(self, namespace, key, values):
+        """
+        Set `values` in the dict stored at `key` in one atomic read-modify-write.
+
+        Returns:
+            bool: False if there is no entry at `key`.
+        """
+
+    @abc.abstractmethod
+    def delete(self, namespace, key):
+        pass
+
+    @abc.abstractmethod
+    def replace_all(self, namespace, mapping):
+        """
+        Swap the whole namespace for `mapping` at once, readers see either the old or the new state.
+
+        Raises:
+            ValueError: For namespaces in NAMESPACE_TTLS, whose entries expire one by one.
+        """
+
+    @staticmethod
+    def check_replaceable(namespace):
+        if namespace in NAMESPACE_TTLS:
+            raise ValueError(f"Namespace {namespace} expires per entry and can't be replaced at once")
+
+    @abc.abstractmethod
+    def expire_entries(self, namespace, ttl):
+        """Remove entries whose 'updated' time is older than `ttl` seconds, returns how many."""
+
+    @abc.abstractmethod
+    def append_blob(self, namespace, name, chunks):
+        """Append `chunks` to a blob, returns its new size."""
+
+    @abc.abstractmethod
+    def get_blob_size(self, namespace, name):
+        pass
+
+    @abc.abstractmethod
+    def read_blob(self, namespace, name):
+        pass
+
+    @abc.abstractmethod
+    def delete_blob(self, namespace, name):
+        pass
+
+    @abc.abstractmethod
+    def expire_blobs(self, namespace, ttl, keep=()):
+        """Remove blobs not written for `ttl` seconds, except those named in `keep`, returns how many."""
+
+class FileStateBackend(StateBackend):
+    """One JSON file per namespace and one file per blob, for a listener running on a single host."""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._cache = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get_lock(self, namespace):
+        with self._locks_lock:
+            return self._locks.setdefault(namespace, threading.Lock())
+
+    def get_path(self, namespace):
+        return os.path.join(self.base_dir, NAMESPACE_FILES.get(namespace, f"{namespace}.json"))
+
+    def load(self, namespace):
+        """The namespace's entries, re-read only when the file's mtime changed."""
+        file_path = self.get_path(namespace)
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+
+        cached = self._cache.get(namespace)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(file_path, "r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            logging.error("Error loading %s: %s", file_path, e)
+            return cached[1] if cached else {}
+        self._cache[namespace] = (mtime, entries)
+        return entries
+
+    def save(self, namespace, entries):
+        file_path = self.get_path(namespace)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=4)
+        os.replace(tmp_path, file_path)
+        self._cache[namespace] = (os.stat(file_path).st_mtime_ns, entries)
+
+    def get(self, namespace, key, cached=True):
+        return self.load(namespace).get(key)
+
+    def get_many(self, namespace, keys):
+        entries = self.load(namespace)
+        return {key: entries[key] for key in keys if key in entries}
+
+    def get_all(self, namespace):
+        return dict(self.load(namespace))
+
+    def set(self, namespace, key, value):
+        with self.get_lock(namespace):
+            entries = dict(self.load(namespace))
+            entries[key] = value
+            self.save(namespace, entries)
+
+    def update_fields(self, namespace, key, values):
+        with self.get_lock(namespace):
+            entries = self.load(namespace)
+            entry = entries.get(key)
+            if not entry:
+                return False
+            if any(entry.get(field) != value for field, value in values.items()):
+                self.save(namespace, dict(entries, **{key: dict(entry, **values)}))
+            return True
+
+    def delete(self, namespace, key):
+        with self.get_lock(namespace):
+            entries = self.load(namespace)
+            if key not in entries:
+                return
+            entries = dict(entries)
+            del entries[key]
+            self.save(namespace, entries)
+
+    def replace_all(self, namespace, mapping):
+        self.check_replaceable(namespace)
+        with self.get_lock(namespace):
+            self.save(namespace, dict(mapping))
+
+    def expire_entries(self, namespace, ttl):
+        now = time.time()
+        with self.get_lock(namespace):
+            entries = self.load(namespace)
+            live = {
+                key: value for key, value in entries.items()
+                if isinstance(value, dict) and now - (value.get("updated") or 0) <= ttl
+            }
+            if len(live) != len(entries):
+                self.save(namespace, live)
+            return len(entries) - len(live)
+
+    def get_blob_dir(self, namespace):
+        blob_dir = os.path.join(self.base_dir, namespace)
+        os.makedirs(blob_dir, exist_ok=True)
+        return blob_dir
+
+    def get_blob_path(self, namespace, name):
+        return os.path.join(self.get_blob_dir(namespace), f"{name}.bin")
+
+    def append_blob(self, namespace, name, chunks):
+        with open(self.get_blob_path(namespace, name), "ab") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            return f.tell()
+
+    def get_blob_size(self, namespace, name):
+        file_path = self.get_blob_path(namespace, name)
+        return os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+    def read_blob(self, namespace, name):
+        file_path = self.get_blob_path(namespace, name)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    def delete_blob(self, namespace, name):
+        file_path = self.get_blob_path(namespace, name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    def expire_blobs(self, namespace, ttl, keep=()):
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(self.get_blob_dir(namespace)):
+            if not entry.is_file() or os.path.splitext(entry.name)[0] in keep:
+                continue
+            try:
+                if now - entry.stat().st_mtime > ttl:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+class RedisStateBackend(StateBackend):
+    """
+    State kept on a Redis server so any number of listener nodes can serve the same devices.
+
+    Namespaces are hashes, except those in NAMESPACE_TTLS whose entries are keys that expire on their own.
+    Reads of namespaces in CACHE_TTLS are answered from a local copy for a few seconds.
+    """
+
+    def __init__(self, client, prefix="biometric_integration"):
+        """
+        Args:
+            client (redis.Redis): Client returning bytes, i.e. without decode_responses.
+            prefix (str): Prefix of every key the backend writes.
+        """
+        self.client = client
+        self.prefix = prefix
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def hash_key(self, namespace):
+        return f"{self.prefix}:state:{namespace}"
+
+    def entry_key(self, namespace, key):
+        return f"{self.prefix}:state:{namespace}:{key}"
+
+    def blob_key(self, namespace, name):
+        return f"{self.prefix}:blob:{namespace}:{name}"
+
+    def get_cached(self, namespace, key):
+        if namespace not in CACHE_TTLS:
+            return False, None
+        cached = self._cache.get((namespace, key))
+        if cached and cached[0] > time.monotonic():
+            return True, cached[1]
+        return False, None
+
+    def put_cached(self, namespace, key, value):
+        ttl = CACHE_TTLS.get(namespace)
+        if ttl:
+            with self._cache_lock:
+                self._cache[(namespace, key)] = (time.monotonic() + ttl, value)
+
+    def drop_cached(self, namespace, key=None):
+        with self._cache_lock:
+            for cache_key in [cache_key for cache_key in self._cache if cache_key[0] == namespace and key in (None, cache_key[1])]:
+                del self._cache[cache_key]
+
+    @staticmethod
+    def decode(value):
+        return json.loads(value) if value is not None else None
+
+    def get(self, namespace, key, cached=True):
+        if cached:
+            hit, value = self.get_cached(namespace, key)
+            if hit:
+                return value
+        if namespace in NAMESPACE_TTLS:
+            value = self.decode(self.client.get(self.entry_key(namespace, key)))
+        else:
+            value = self.decode(self.client.hget(self.hash_key(namespace), key))
+        self.put_cached(namespace, key, value)
+        return value
+
+    def get_many(self, namespace, keys):
+        values = {}
+        missing = []
+        for key in keys:
+            hit, value = self.get_cached(namespace, key)
+            if hit:
+                if value is not None:
+                    values[key] = value
+            else:
+                missing.append(key)
+
+        if missing:
+            if namespace in NAMESPACE_TTLS:
+                replies = self.client.mget([self.entry_key(namespace, key) for key in missing])
+            else:
+                replies = self.client.hmget(self.hash_key(namespace), missing)
+            for key, reply in zip(missing, replies):
+                value = self.decode(reply)
+                self.put_cached(namespace, key, value)
+                if value is not None:
+                    values[key] = value
+        return values
+
+    def get_all(self, namespace):
+        if namespace not in NAMESPACE_TTLS:
+            entries = self.client.hgetall(self.hash_key(namespace))
+            return {key.decode("utf-8"): self.decode(value) for key, value in entries.items()}
+
+        prefix = self.entry_key(namespace, "")
+        keys = [key.decode("utf-8")[len(prefix):] for key in self.client.scan_iter(match=f"{prefix}*", count=1000)]
+        return self.get_many(namespace, keys)
+
+    def set(self, namespace, key, value):
+        encoded = json.dumps(value)
+        if namespace in NAMESPACE_TTLS:
+            self.client.set(self.entry_key(namespace, key), encoded, ex=NAMESPACE_TTLS[namespace])
+        else:
+            self.client.hset(self.hash_key(namespace), key, encoded)
+        self.put_cached(namespace, key, value)
+
+    def update_fields(self, namespace, key, values):
+        if namespace in NAMESPACE_TTLS:
+            raise ValueError(f"Namespace {namespace} expires per entry, set its entries whole")
+
+        hash_key = self.hash_key(namespace)
+        with self.client.pipeline() as pipe:
+            for _ in range(MAX_UPDATE_RETRIES):
+                try:
+                    # EXEC fails if another node writes the hash after WATCH, the update is then read and tried again
+                    pipe.watch(hash_key)
+                    entry = self.decode(pipe.hget(hash_key, key))
+                    if not entry:
+                        pipe.unwatch()
+                        return False
+                    updated = dict(entry, **values)
+                    if updated == entry:
+                        pipe.unwatch()
+                        self.put_cached(namespace, key, entry)
+                        return True
+                    pipe.multi()
+                    pipe.hset(hash_key, key, json.dumps(updated))
+                    pipe.execute()
+                except redis.WatchError:
+                    continue
+                self.put_cached(namespace, key, updated)
+                return True
+        raise redis.WatchError(f"Entry {key} of {namespace} kept changing, gave up after {MAX_UPDATE_RETRIES} tries")
+
+    def delete(self, namespace, key):
+        if namespace in NAMESPACE_TTLS:
+            self.client.delete(self.entry_key(namespace, key))
+        else:
+            self.client.hdel(self.hash_key(namespace), key)
+        self.drop_cached(namespace, key)
+
+    def replace_all(self, namespace, mapping):
+        self.check_replaceable(namespace)
+
+        hash_key = self.hash_key(namespace)
+        if not mapping:
+            self.client.delete(hash_key)
+        else:
+            # Build the new hash aside and swap it in, RENAME is atomic
+            tmp_key = f"{hash_key}:rebuild:{os.getpid()}:{threading.get_ident()}"
+            pipe = self.client.pipeline()
+            pipe.delete(tmp_key)
+            pipe.hset(tmp_key, mapping={key: json.dumps(value) for key, value in mapping.items()})
+            pipe.rename(tmp_key, hash_key)
+            pipe.execute()
+        self.drop_cached(namespace)
+
+    def expire_entries(self, namespace, ttl):
+        # Entries carry their own expiry
+        return 0
+
+    def append_blob(self, namespace, name, chunks):
+        blob_key = self.blob_key(namespace, name)
+        pipe = self.client.pipeline()
+        for chunk in chunks:
+            if chunk:
+                pipe.append(blob_key, chunk)
+        if namespace in NAMESPACE_TTLS:
+            pipe.expire(blob_key, NAMESPACE_TTLS[namespace])
+        pipe.strlen(blob_key)
+        return pipe.execute()[-1]
+
+    def get_blob_size(self, namespace, name):
+        return self.client.strlen(self.blob_key(namespace, name))
+
+    def read_blob(self, namespace, name):
+        return self.client.get(self.blob_key(namespace, name))
+
+    def delete_blob(self, namespace, name):
+        self.client.delete(self.blob_key(namespace, name))
+
+    def expire_blobs(self, namespace, ttl, keep=()):
+        return 0
+
+def get_state_backend_url():
+    """
+    The configured Redis URL, read from the file since the listener has no site context.
+
+    `true` stands for the bench's own cache server, the `redis_cache` that frappe.conf.redis_cache reads.
+    """
+    config_path = os.path.join(frappe.utils.get_bench_path(), "sites", "common_site_config.json")
+    try:
+        with open(config_path, "r") as f:
+            config = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    url = config.get(STATE_BACKEND_CONFIG_KEY)
+    if url is True:
+        return config.get("redis_cache")
+    return url
+
+def make_state_backend(url=None):
+    """
+    Create the backend for `url`: a redis:// URL for shared state, or None for local files.
+    """
+    if not url:
+        from biometric_integration.services.device_mapping import get_biometric_assets_dir
+
+        return FileStateBackend(get_biometric_assets_dir())
+
+    return RedisStateBackend(redis.Redis.from_url(url))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_state_backend():
+    """The process-wide state backend, as configured in common_site_config.json."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = make_state_backend(get_state_backend_url())
+                logging.info("Using %s for listener state", type(_backend).__name__)
+    return _backend
+
+def set_state_backend(backend):
+    """Use `backend` from now on, e.g. a backend on a test server."""
+    global _backend
+    _backend = backend
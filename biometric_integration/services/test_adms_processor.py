@@ -0,0 +1,61 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest.mock import patch
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.adms_processor import get_stamps, load_adms_stamp_map, parse_attlog, set_stamp
+from biometric_integration.services.punch_records import LOG_TYPE_IN, LOG_TYPE_OUT
+
+
+class TestParseAttlog(FrappeTestCase):
+	def test_parses_every_line(self):
+		records = parse_attlog(
+			"12\t2024-12-20 08:30:00\t0\t1\t0\n"
+			"\n"
+			"7\t2024-12-20 17:05:10\t1\t1\t0\n"
+			"9\t2024-12-20 12:00:00\t4\n"
+		)
+
+		self.assertEqual(
+			[(record.employee_field_value, record.timestamp, record.log_type) for record in records],
+			[
+				(12, datetime(2024, 12, 20, 8, 30), LOG_TYPE_IN),
+				(7, datetime(2024, 12, 20, 17, 5, 10), LOG_TYPE_OUT),
+				(9, datetime(2024, 12, 20, 12, 0), LOG_TYPE_IN),
+			],
+		)
+
+	def test_skips_malformed_lines(self):
+		records = parse_attlog("abc\t2024-12-20 08:30:00\t0\n12\tnot a time\t0\n15\n3\t2024-12-20 09:00:00\n")
+
+		self.assertEqual([record.employee_field_value for record in records], [3])
+		# A line without a status is read as a check-in
+		self.assertEqual(records[0].log_type, LOG_TYPE_IN)
+
+
+class TestAdmsStamps(FrappeTestCase):
+	def setUp(self):
+		self.base_dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.base_dir, "adms_stamps.json")
+		path_patch = patch("biometric_integration.services.adms_processor.get_adms_stamp_map_path", return_value=self.path)
+		path_patch.start()
+		self.addCleanup(path_patch.stop)
+
+	def tearDown(self):
+		shutil.rmtree(self.base_dir, ignore_errors=True)
+
+	def test_stamp_round_trip(self):
+		self.assertEqual(get_stamps("SN1"), {})
+
+		set_stamp("SN1", "ATTLOG", "9999")
+		set_stamp("SN1", "OPERLOG", "12")
+		set_stamp("SN2", "ATTLOG", "5")
+
+		self.assertEqual(get_stamps("SN1"), {"ATTLOG": "9999", "OPERLOG": "12"})
+		self.assertEqual(load_adms_stamp_map(), {"SN1": {"ATTLOG": "9999", "OPERLOG": "12"}, "SN2": {"ATTLOG": "5"}})
+		# Written through a temp file that is renamed into place
+		self.assertEqual(os.listdir(self.base_dir), ["adms_stamps.json"])
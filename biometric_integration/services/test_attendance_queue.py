@@ -0,0 +1,39 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import datetime
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.attendance_queue import (
+	DIRTY_ATTENDANCE_KEY,
+	mark_attendance_dirty,
+	take_dirty_attendance,
+)
+
+
+class TestAttendanceQueue(FrappeTestCase):
+	def setUp(self):
+		frappe.cache().delete_value(DIRTY_ATTENDANCE_KEY)
+
+	def tearDown(self):
+		frappe.cache().delete_value(DIRTY_ATTENDANCE_KEY)
+
+	def test_round_trip(self):
+		day = datetime.date(2026, 10, 19)
+		mark_attendance_dirty([("EMP-1", day), ("EMP-2", "2026-10-19"), ("EMP-1", day)])
+
+		pairs = take_dirty_attendance()
+
+		self.assertEqual(sorted(pairs), [("EMP-1", day), ("EMP-2", day)])
+		self.assertEqual(take_dirty_attendance(), [])
+
+	def test_takes_at_most_count(self):
+		day = datetime.date(2026, 10, 19)
+		mark_attendance_dirty([(f"EMP-{i}", day) for i in range(5)])
+
+		first = take_dirty_attendance(count=3)
+		rest = take_dirty_attendance(count=3)
+
+		self.assertEqual(len(first), 3)
+		self.assertEqual(len(rest), 2)
+		self.assertEqual(len(set(first) | set(rest)), 5)
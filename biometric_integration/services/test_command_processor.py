@@ -0,0 +1,85 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.command_processor import clear_prefetched_commands, handle_device_response
+from biometric_integration.services.command_state import transition_command
+
+TEST_DEVICE = "TEST-COMMAND-DEVICE"
+TEST_USER = "990002"
+
+
+class TestCommandTransitions(FrappeTestCase):
+	def setUp(self):
+		if not frappe.db.exists("Biometric Device", TEST_DEVICE):
+			frappe.get_doc({
+				"doctype": "Biometric Device",
+				"serial": TEST_DEVICE,
+				"device_name": TEST_DEVICE,
+				"brand": "EBKN",
+				"maximum_sync_attempt": 3,
+			}).insert(ignore_permissions=True)
+		if not frappe.db.exists("Biometric Device User", TEST_USER):
+			frappe.get_doc({"doctype": "Biometric Device User", "user_id": TEST_USER}).insert(ignore_permissions=True)
+
+	def tearDown(self):
+		# The handlers commit, so clean up what they wrote
+		frappe.db.rollback()
+		clear_prefetched_commands(TEST_DEVICE)
+		frappe.db.delete("Biometric Device Command", {"biometric_device": TEST_DEVICE})
+		frappe.db.delete("Biometric Device User", {"name": TEST_USER})
+		frappe.db.delete("Biometric Device", {"name": TEST_DEVICE})
+		frappe.db.commit()
+
+	def make_command(self, status="Pending", command_type="Update User Status"):
+		return frappe.get_doc({
+			"doctype": "Biometric Device Command",
+			"biometric_device": TEST_DEVICE,
+			"biometric_device_user": TEST_USER,
+			"brand": "EBKN",
+			"command_type": command_type,
+			"status": status,
+		}).insert(ignore_permissions=True).name
+
+	def get_status(self, command_name):
+		return frappe.db.get_value("Biometric Device Command", command_name, "status")
+
+	def test_transition_is_guarded_by_the_current_status(self):
+		command_name = self.make_command()
+
+		self.assertTrue(transition_command(command_name, "Processing", from_statuses=["Pending", "Reattempt"]))
+		self.assertFalse(transition_command(command_name, "Processing", from_statuses=["Pending", "Reattempt"]))
+		self.assertTrue(transition_command(command_name, "Completed"))
+		# Closed commands never move again
+		self.assertFalse(transition_command(command_name, "Error"))
+		self.assertEqual(self.get_status(command_name), "Completed")
+
+	def test_duplicate_acknowledgement_changes_nothing(self):
+		command_name = self.make_command(status="Processing")
+
+		self.assertEqual(handle_device_response(TEST_DEVICE, command_name, "OK"), {"response_code": "OK"})
+		closed_on = frappe.db.get_value("Biometric Device Command", command_name, "closed_on")
+
+		self.assertEqual(handle_device_response(TEST_DEVICE, command_name, "OK"), {"response_code": "OK"})
+		handle_device_response(TEST_DEVICE, command_name, "ERROR")
+
+		self.assertEqual(self.get_status(command_name), "Completed")
+		self.assertEqual(frappe.db.get_value("Biometric Device Command", command_name, "closed_on"), closed_on)
+
+	def test_acknowledgements_chain_the_queued_commands(self):
+		first = self.make_command(status="Processing")
+		second = self.make_command(command_type="Update User Status")
+		third = self.make_command(command_type="Update User Data")
+
+		reply = handle_device_response(TEST_DEVICE, first, "OK")
+		self.assertEqual((reply["trans_id"], reply["cmd_code"]), (second, "ENABLE_USER"))
+		self.assertEqual(self.get_status(first), "Completed")
+		self.assertEqual(self.get_status(second), "Processing")
+
+		reply = handle_device_response(TEST_DEVICE, second, "OK")
+		self.assertEqual((reply["trans_id"], reply["cmd_code"]), (third, "SET_USER_INFO"))
+		self.assertEqual(self.get_status(third), "Processing")
+
+		self.assertEqual(handle_device_response(TEST_DEVICE, third, "OK"), {"response_code": "OK"})
+		self.assertEqual([self.get_status(command) for command in (first, second, third)], ["Completed"] * 3)
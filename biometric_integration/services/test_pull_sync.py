@@ -0,0 +1,168 @@
+# Copyright (c) 2024, KhaledBinAmir and Contributors
+# See license.txt
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.pull_sync import close_all_connections, fetch_log_page, pull_devices
+
+
+class FakeDeviceServer:
+	"""A local device that serves `logs` over the pull protocol, counting connections and requests."""
+
+	def __init__(self, logs, delay=0, ignore_after=False):
+		self.logs = logs
+		self.delay = delay
+		self.ignore_after = ignore_after
+		self.connections = 0
+		self.requests = 0
+		self.active = 0
+		self.max_active = 0
+		self.lock = threading.Lock()
+
+		fake = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def setup(self):
+				super().setup()
+				with fake.lock:
+					fake.connections += 1
+
+			def do_GET(self):
+				with fake.lock:
+					fake.requests += 1
+					fake.active += 1
+					fake.max_active = max(fake.max_active, fake.active)
+				try:
+					if fake.delay:
+						time.sleep(fake.delay)
+					query = parse_qs(urlparse(self.path).query)
+					after = int(query.get("after", ["0"])[0])
+					limit = int(query.get("limit", ["500"])[0])
+					newer = fake.logs if fake.ignore_after else [log for log in fake.logs if log["id"] > after]
+					body = json.dumps({"logs": newer[:limit], "has_more": len(newer) > limit}).encode()
+					self.send_response(200)
+					self.send_header("Content-Type", "application/json")
+					self.send_header("Content-Length", str(len(body)))
+					self.end_headers()
+					self.wfile.write(body)
+				finally:
+					with fake.lock:
+						fake.active -= 1
+
+			def log_message(self, format, *args):
+				pass
+
+		self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.httpd.daemon_threads = True
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+	@property
+	def port(self):
+		return self.httpd.server_address[1]
+
+	def __enter__(self):
+		self.thread.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def make_logs(count, start_id=1):
+	return [
+		{"id": i, "user_id": str(i % 7 + 1), "io_time": "20241220083000", "io_mode": 1}
+		for i in range(start_id, start_id + count)
+	]
+
+
+def make_device(name, server, last_synced_id=0, brand="Test"):
+	return {
+		"name": name,
+		"brand": brand,
+		"device_ip": "127.0.0.1",
+		"device_port": str(server.port),
+		"last_synced_id": last_synced_id,
+	}
+
+
+class TestPullSync(FrappeTestCase):
+	def setUp(self):
+		fetchers = patch.dict("biometric_integration.services.pull_sync.PULL_FETCHERS", {"Test": fetch_log_page}, clear=True)
+		fetchers.start()
+		self.addCleanup(fetchers.stop)
+
+	def tearDown(self):
+		close_all_connections()
+
+	def test_resumes_from_last_synced_id(self):
+		with FakeDeviceServer(make_logs(10)) as server:
+			result = pull_devices([make_device("D1", server, last_synced_id=6)])["D1"]
+
+		self.assertIsNone(result["error"])
+		self.assertEqual([log["id"] for log in result["records"]], [7, 8, 9, 10])
+		self.assertEqual(result["last_synced_id"], 10)
+
+	def test_pages_share_one_connection(self):
+		with FakeDeviceServer(make_logs(1200)) as server:
+			result = pull_devices([make_device("D1", server)])["D1"]
+
+		self.assertEqual(len(result["records"]), 1200)
+		self.assertEqual(server.requests, 3)
+		self.assertEqual(server.connections, 1)
+
+	def test_stops_when_a_page_brings_nothing_new(self):
+		with FakeDeviceServer(make_logs(600), ignore_after=True) as server:
+			result = pull_devices([make_device("D1", server)])["D1"]
+
+		self.assertIsNone(result["error"])
+		self.assertEqual(len(result["records"]), 500)
+		self.assertEqual(result["last_synced_id"], 500)
+		self.assertEqual(server.requests, 2)
+
+	def test_slow_device_times_out_without_blocking_others(self):
+		with FakeDeviceServer(make_logs(5), delay=2) as slow, FakeDeviceServer(make_logs(5)) as fast:
+			started = time.monotonic()
+			results = pull_devices([make_device("slow", slow), make_device("fast", fast)], device_timeout=0.5)
+			elapsed = time.monotonic() - started
+
+		self.assertIsNotNone(results["slow"]["error"])
+		self.assertEqual(results["slow"]["last_synced_id"], 0)
+		self.assertIsNone(results["fast"]["error"])
+		self.assertEqual(len(results["fast"]["records"]), 5)
+		self.assertLess(elapsed, 2)
+
+	def test_sync_window_bounds_every_worker(self):
+		with FakeDeviceServer(make_logs(5), delay=2) as slow:
+			started = time.monotonic()
+			results = pull_devices([make_device("D1", slow), make_device("D2", slow)], max_concurrency=1, device_timeout=10, window=0.5)
+			elapsed = time.monotonic() - started
+
+		self.assertIsNotNone(results["D1"]["error"])
+		self.assertEqual(results["D2"]["error"], "Sync window exceeded")
+		self.assertLess(elapsed, 2)
+
+	def test_brand_without_fetcher_is_not_polled(self):
+		with FakeDeviceServer(make_logs(5)) as server:
+			result = pull_devices([make_device("D1", server, brand="ZKTeco")])["D1"]
+
+		self.assertIsNotNone(result["error"])
+		self.assertEqual(result["records"], [])
+		self.assertEqual(server.requests, 0)
+
+	def test_concurrency_cap(self):
+		with FakeDeviceServer(make_logs(1), delay=0.2) as server:
+			devices = [make_device(f"D{i}", server) for i in range(12)]
+			results = pull_devices(devices, max_concurrency=4)
+
+		self.assertEqual(len(results), 12)
+		self.assertTrue(all(result["error"] is None for result in results.values()))
+		self.assertLessEqual(server.max_active, 4)
+		self.assertGreater(server.max_active, 1)
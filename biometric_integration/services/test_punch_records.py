@@ -0,0 +1,36 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+from datetime import datetime
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.punch_records import (
+	IO_MODE_IN,
+	LOG_TYPE_IN,
+	LOG_TYPE_OUT,
+	build_punches,
+	normalize_log_types,
+	parse_compact_timestamps,
+	parse_iso_timestamps,
+	parse_user_ids,
+)
+
+
+class TestPunchRecords(FrappeTestCase):
+	def test_rejected_positions(self):
+		user_ids = parse_user_ids(["12", "abc", "7", "9"])
+		timestamps = parse_compact_timestamps(["20241220083000", "20241220083100", "20241399083000", "2024122008"])
+		punches, rejected = build_punches(user_ids, timestamps, [LOG_TYPE_IN] * 4)
+
+		self.assertEqual(rejected, [1, 2, 3])
+		self.assertEqual(len(punches), 1)
+		self.assertEqual(punches[0].employee_field_value, 12)
+		self.assertEqual(punches[0].timestamp, datetime(2024, 12, 20, 8, 30))
+
+	def test_io_mode_as_string_or_number(self):
+		self.assertEqual(normalize_log_types([1, "1", 0, "0", None], IO_MODE_IN), [LOG_TYPE_IN, LOG_TYPE_IN, LOG_TYPE_OUT, LOG_TYPE_OUT, LOG_TYPE_OUT])
+
+	def test_iso_timestamps_need_a_space_separator(self):
+		self.assertEqual(
+			parse_iso_timestamps(["2024-12-20 08:30:00", "2024-12-20T08:30:00", "2024-12-20 08:30", "2024-13-20 08:30:00", None]),
+			[datetime(2024, 12, 20, 8, 30), None, None, None, None],
+		)
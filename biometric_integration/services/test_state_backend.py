@@ -0,0 +1,184 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest.mock import patch
+import frappe
+import redis
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.state_backend import (
+	BLOCK_SEQUENCE,
+	DEVICE_SITE,
+	PARTIAL_DATA,
+	FileStateBackend,
+	RedisStateBackend,
+)
+
+
+class TestRedisStateBackend(FrappeTestCase):
+	"""Runs against the bench's cache server, under a prefix of its own."""
+
+	def setUp(self):
+		self.client = redis.Redis.from_url(frappe.conf.redis_cache)
+		self.prefix = f"test_biometric_state:{uuid.uuid4().hex}"
+		self.backend = RedisStateBackend(self.client, prefix=self.prefix)
+
+	def tearDown(self):
+		keys = list(self.client.scan_iter(match=f"{self.prefix}:*"))
+		if keys:
+			self.client.delete(*keys)
+		self.client.close()
+
+	def test_set_and_get(self):
+		self.backend.set(DEVICE_SITE, "DEV1", {"site_name": "a.local"})
+		self.assertEqual(self.backend.get(DEVICE_SITE, "DEV1", cached=False), {"site_name": "a.local"})
+		self.assertIsNone(self.backend.get(DEVICE_SITE, "DEV2"))
+
+		self.backend.delete(DEVICE_SITE, "DEV1")
+		self.assertIsNone(self.backend.get(DEVICE_SITE, "DEV1"))
+
+	def test_get_many(self):
+		for i in range(20):
+			self.client.hset(f"{self.prefix}:state:device_site", f"DEV{i}", '{"site_name": "a.local"}')
+
+		values = self.backend.get_many(DEVICE_SITE, [f"DEV{i}" for i in range(25)])
+
+		self.assertEqual(len(values), 20)
+		self.assertEqual(values["DEV0"], {"site_name": "a.local"})
+
+	def test_reads_are_cached_briefly(self):
+		self.backend.set(DEVICE_SITE, "DEV1", {"site_name": "a.local"})
+		with patch.object(self.client, "hget", side_effect=AssertionError("read from the server")):
+			for _ in range(10):
+				self.assertEqual(self.backend.get(DEVICE_SITE, "DEV1"), {"site_name": "a.local"})
+
+	def test_replace_all(self):
+		self.backend.set(DEVICE_SITE, "OLD", {"site_name": "a.local"})
+		self.backend.replace_all(DEVICE_SITE, {"DEV1": {"site_name": "b.local"}, "DEV2": {"site_name": "c.local"}})
+
+		self.assertEqual(
+			self.backend.get_all(DEVICE_SITE),
+			{"DEV1": {"site_name": "b.local"}, "DEV2": {"site_name": "c.local"}},
+		)
+		self.assertIsNone(self.backend.get(DEVICE_SITE, "OLD"))
+		self.assertEqual(list(self.client.scan_iter(match=f"{self.prefix}:state:device_site:rebuild:*")), [])
+
+	def test_replace_all_rejects_expiring_namespaces(self):
+		with self.assertRaises(ValueError):
+			self.backend.replace_all(BLOCK_SEQUENCE, {"DEV1": {"blk_no": 1}})
+
+	def test_update_fields(self):
+		self.backend.set(DEVICE_SITE, "DEV1", {"site_name": "a.local", "has_pending_command": 0})
+
+		self.assertTrue(self.backend.update_fields(DEVICE_SITE, "DEV1", {"has_pending_command": 1}))
+		self.assertEqual(
+			self.backend.get(DEVICE_SITE, "DEV1", cached=False), {"site_name": "a.local", "has_pending_command": 1}
+		)
+		self.assertFalse(self.backend.update_fields(DEVICE_SITE, "DEV2", {"has_pending_command": 1}))
+
+	def test_update_fields_keeps_a_concurrent_write(self):
+		self.backend.set(DEVICE_SITE, "DEV1", {"site_name": "a.local", "has_pending_command": 0})
+		other = RedisStateBackend(redis.Redis.from_url(frappe.conf.redis_cache), prefix=self.prefix)
+		decode = self.backend.decode
+		conflicts = []
+
+		def decode_with_conflict(value):
+			if not conflicts:
+				# Another node moves the device between the read and the write
+				conflicts.append(value)
+				other.set(DEVICE_SITE, "DEV1", {"site_name": "b.local", "has_pending_command": 0})
+			return decode(value)
+
+		self.backend.decode = decode_with_conflict
+		try:
+			self.assertTrue(self.backend.update_fields(DEVICE_SITE, "DEV1", {"has_pending_command": 1}))
+		finally:
+			other.client.close()
+
+		self.assertEqual(len(conflicts), 1)
+		self.assertEqual(
+			self.backend.get(DEVICE_SITE, "DEV1", cached=False), {"site_name": "b.local", "has_pending_command": 1}
+		)
+
+	def test_entries_expire_on_their_own(self):
+		self.backend.set(BLOCK_SEQUENCE, "DEV1", {"blk_no": 3})
+		self.assertEqual(self.backend.get_all(BLOCK_SEQUENCE), {"DEV1": {"blk_no": 3}})
+		self.assertGreater(self.client.ttl(f"{self.prefix}:state:block_sequence:DEV1"), 0)
+
+		self.client.pexpire(f"{self.prefix}:state:block_sequence:DEV1", 1)
+		time.sleep(0.05)
+		self.assertEqual(self.backend.get_all(BLOCK_SEQUENCE), {})
+
+	def test_blobs(self):
+		size = self.backend.append_blob(PARTIAL_DATA, "DEV1", [b"abc", b"def"])
+		self.assertEqual(size, 6)
+		self.assertEqual(self.backend.append_blob(PARTIAL_DATA, "DEV1", iter([b"gh"])), 8)
+		self.assertEqual(self.backend.get_blob_size(PARTIAL_DATA, "DEV1"), 8)
+		self.assertEqual(self.backend.read_blob(PARTIAL_DATA, "DEV1"), b"abcdefgh")
+		self.assertGreater(self.client.ttl(f"{self.prefix}:blob:partial_data:DEV1"), 0)
+
+		self.backend.delete_blob(PARTIAL_DATA, "DEV1")
+		self.assertIsNone(self.backend.read_blob(PARTIAL_DATA, "DEV1"))
+
+	def test_nodes_share_state(self):
+		other = RedisStateBackend(redis.Redis.from_url(frappe.conf.redis_cache), prefix=self.prefix)
+		try:
+			self.backend.append_blob(PARTIAL_DATA, "DEV1", [b"first"])
+			other.append_blob(PARTIAL_DATA, "DEV1", [b"second"])
+			self.assertEqual(self.backend.read_blob(PARTIAL_DATA, "DEV1"), b"firstsecond")
+		finally:
+			other.client.close()
+
+
+class TestFileStateBackend(FrappeTestCase):
+	def setUp(self):
+		self.base_dir = tempfile.mkdtemp()
+		self.backend = FileStateBackend(self.base_dir)
+
+	def tearDown(self):
+		shutil.rmtree(self.base_dir, ignore_errors=True)
+
+	def test_keeps_the_listener_file_names(self):
+		self.backend.set(DEVICE_SITE, "DEV1", {"site_name": "a.local"})
+		self.backend.set(BLOCK_SEQUENCE, "DEV1", {"blk_no": 1, "updated": time.time()})
+
+		self.assertTrue(os.path.exists(os.path.join(self.base_dir, "device_site.json")))
+		self.assertTrue(os.path.exists(os.path.join(self.base_dir, "block_sequence_map.json")))
+		self.assertEqual(FileStateBackend(self.base_dir).get_all(DEVICE_SITE), {"DEV1": {"site_name": "a.local"}})
+
+	def test_expires_abandoned_transfers(self):
+		self.backend.set(BLOCK_SEQUENCE, "OLD", {"blk_no": 1, "updated": time.time() - 3600})
+		self.backend.set(BLOCK_SEQUENCE, "NEW", {"blk_no": 1, "updated": time.time()})
+		self.backend.append_blob(PARTIAL_DATA, "OLD", [b"x"])
+		self.backend.append_blob(PARTIAL_DATA, "NEW", [b"y"])
+		old_path = self.backend.get_blob_path(PARTIAL_DATA, "OLD")
+		os.utime(old_path, (time.time() - 3600, time.time() - 3600))
+
+		self.assertEqual(self.backend.expire_entries(BLOCK_SEQUENCE, 900), 1)
+		keep = set(self.backend.get_all(BLOCK_SEQUENCE))
+		self.assertEqual(self.backend.expire_blobs(PARTIAL_DATA, 900, keep=keep), 1)
+		self.assertEqual(self.backend.read_blob(PARTIAL_DATA, "NEW"), b"y")
+		self.assertIsNone(self.backend.read_blob(PARTIAL_DATA, "OLD"))
+
+	def test_update_fields_from_many_threads(self):
+		self.backend.set(DEVICE_SITE, "DEV1", {"site_name": "a.local"})
+		threads = [
+			threading.Thread(target=self.backend.update_fields, args=(DEVICE_SITE, "DEV1", {f"field_{i}": i}))
+			for i in range(20)
+		]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		entry = FileStateBackend(self.base_dir).get(DEVICE_SITE, "DEV1")
+		self.assertEqual(entry, dict({"site_name": "a.local"}, **{f"field_{i}": i for i in range(20)}))
+
+	def test_replace_all_rejects_expiring_namespaces(self):
+		with self.assertRaises(ValueError):
+			self.backend.replace_all(BLOCK_SEQUENCE, {"DEV1": {"blk_no": 1}})
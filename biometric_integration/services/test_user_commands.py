@@ -0,0 +1,33 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import base64
+import json
+from types import SimpleNamespace
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.ebkn_processor import parse_device_data
+from biometric_integration.services.user_commands import encode_device_data, get_target_enabled
+
+
+class TestUserCommands(FrappeTestCase):
+	def test_body_parses_back_to_the_payload(self):
+		template = base64.b64encode(b"\x01\x02\x03\x04").decode("ascii")
+		payload = {
+			"user_id": "7",
+			"user_name": "Test User",
+			"enroll_data_array": [
+				{"backup_number": 0, "enroll_data": template},
+				{"backup_number": 1, "enroll_data": template},
+			],
+		}
+
+		body = encode_device_data(json.loads(json.dumps(payload)))
+
+		self.assertTrue(body.startswith(b'{"user_id": "7"'))
+		self.assertIn(b'"enroll_data": "BIN_2"', body)
+		self.assertEqual(parse_device_data(body), payload)
+
+	def test_target_status_comes_from_the_digest(self):
+		self.assertTrue(get_target_enabled(SimpleNamespace(get=lambda field: "1:abc")))
+		self.assertFalse(get_target_enabled(SimpleNamespace(get=lambda field: "0:abc")))
+		self.assertTrue(get_target_enabled(SimpleNamespace(get=lambda field: None)))
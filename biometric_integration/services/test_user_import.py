@@ -0,0 +1,62 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.user_import import (
+	clear_import,
+	count_spooled,
+	get_next_import_step,
+	handle_import_result,
+	load_cursor,
+	start_user_import,
+)
+
+TEST_DEVICE = "TEST-IMPORT-DEVICE"
+TEST_USERS = ["990011", "990012", "990013"]
+
+
+class TestUserImport(FrappeTestCase):
+	def setUp(self):
+		frappe.get_doc({
+			"doctype": "Biometric Device",
+			"serial": TEST_DEVICE,
+			"device_name": TEST_DEVICE,
+			"brand": "EBKN",
+			"maximum_sync_attempt": 3,
+		}).insert(ignore_permissions=True)
+
+	def tearDown(self):
+		# Imports commit, so clean up what they wrote
+		frappe.db.rollback()
+		clear_import(TEST_DEVICE)
+		frappe.db.delete("Biometric Device User Detail", {"parent": ["in", TEST_USERS]})
+		frappe.db.delete("Biometric Device User", {"name": ["in", TEST_USERS]})
+		frappe.db.delete("Biometric Device Command", {"biometric_device": TEST_DEVICE})
+		frappe.db.delete("Biometric Device", {"name": TEST_DEVICE})
+		frappe.db.commit()
+
+	def test_import_resumes_from_the_cursor(self):
+		command_doc = frappe.get_doc("Biometric Device Command", start_user_import(TEST_DEVICE))
+		self.assertEqual(get_next_import_step(command_doc)["cmd_code"], "GET_USER_ID_LIST")
+		handle_import_result(command_doc, "OK", {"user_id_array": [{"user_id": user_id} for user_id in TEST_USERS]})
+		handle_import_result(command_doc, "OK", {"user_id_array": []})
+		handle_import_result(command_doc, "OK", {"user_id": TEST_USERS[0], "user_name": "First"})
+
+		# The listener restarts: only the cursor and the spool on disk are left
+		command_doc = frappe.get_doc("Biometric Device Command", command_doc.name)
+		self.assertEqual(load_cursor(TEST_DEVICE)["position"], 1)
+		self.assertEqual(count_spooled(TEST_DEVICE), 1)
+		step = get_next_import_step(command_doc)
+		self.assertEqual(step["cmd_code"], "GET_USER_INFO")
+		self.assertEqual(frappe.parse_json(step["body"]), {"user_id": TEST_USERS[1]})
+
+		self.assertIsNotNone(handle_import_result(command_doc, "OK", {"user_id": TEST_USERS[1], "user_name": "Second"}))
+		self.assertIsNone(handle_import_result(command_doc, "OK", {"user_id": TEST_USERS[2], "user_name": "Third"}))
+
+		self.assertIsNone(load_cursor(TEST_DEVICE))
+		self.assertEqual(
+			sorted(frappe.get_all("Biometric Device User", filters={"name": ["in", TEST_USERS]}, pluck="name")),
+			TEST_USERS,
+		)
+		self.assertEqual(frappe.db.count("Biometric Device User Detail", {"parent": ["in", TEST_USERS], "biometric_device": TEST_DEVICE}), 3)
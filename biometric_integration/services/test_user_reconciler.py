@@ -0,0 +1,55 @@
+# Copyright (c) 2026, KhaledBinAmir and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from biometric_integration.services.command_processor import prepare_command_data
+from biometric_integration.services.user_reconciler import make_digest, reconcile_device_users
+
+TEST_DEVICE = "TEST-RECONCILE-DEVICE"
+TEST_USER = "990001"
+
+
+class TestUserReconciler(FrappeTestCase):
+	def setUp(self):
+		frappe.get_doc({
+			"doctype": "Biometric Device",
+			"serial": TEST_DEVICE,
+			"device_name": TEST_DEVICE,
+			"brand": "EBKN",
+			"maximum_sync_attempt": 3,
+		}).insert(ignore_permissions=True)
+		frappe.get_doc({
+			"doctype": "Biometric Device User",
+			"user_id": TEST_USER,
+			# The templates changed since the device was last synced
+			"enroll_template_hash": "new-hash",
+			"devices": [{"biometric_device": TEST_DEVICE, "brand": "EBKN", "allow_user": 1, "synced_digest": make_digest(True, "old-hash")}],
+		}).insert(ignore_permissions=True)
+
+	def tearDown(self):
+		# Reconciliation commits, so clean up what it wrote
+		frappe.db.rollback()
+		frappe.db.delete("Biometric Device Command", {"biometric_device": TEST_DEVICE})
+		frappe.db.delete("Biometric Device User Detail", {"parent": TEST_USER})
+		frappe.db.delete("Biometric Device User", {"name": TEST_USER})
+		frappe.db.delete("Biometric Device", {"name": TEST_DEVICE})
+		frappe.db.commit()
+
+	def test_changed_digest_queues_one_buildable_command(self):
+		stats = reconcile_device_users([TEST_DEVICE])
+
+		self.assertEqual(stats["commands"], {"Update User Data": 1})
+		self.assertEqual(stats["unsupported"], {})
+		commands = frappe.get_all("Biometric Device Command", filters={"biometric_device": TEST_DEVICE}, pluck="name")
+		self.assertEqual(len(commands), 1)
+
+		command_doc = frappe.get_doc("Biometric Device Command", commands[0])
+		self.assertEqual(command_doc.target_digest, make_digest(True, "new-hash"))
+		command_data = prepare_command_data(command_doc)
+		self.assertEqual(command_data["cmd_code"], "SET_USER_INFO")
+		self.assertIn(b'"user_id": "990001"', command_data["body"])
+
+		# The open command covers the user until the device acknowledges it
+		self.assertEqual(reconcile_device_users([TEST_DEVICE])["skipped_open_command"], 1)
+		self.assertEqual(frappe.db.count("Biometric Device Command", {"biometric_device": TEST_DEVICE}), 1)
@@ -0,0 +1,92 @@
+import base64
+import json
+import frappe
+from biometric_integration.services.enroll_templates import get_enroll_templates
+from biometric_integration.services.user_reconciler import parse_digest
+
+# Fields of an EBKN user payload that travel as binary blocks after the JSON, see parse_device_data
+BINARY_FIELDS = ("user_photo", "enroll_data")
+
+def encode_device_data(data):
+    """
+    Build an EBKN body from a payload as parse_device_data returns it: the JSON with each binary field
+    replaced by a BIN_<n> placeholder, followed by the binary blocks in placeholder order.
+
+    Args:
+        data (dict): Payload whose BINARY_FIELDS hold base64 strings.
+
+    Returns:
+        bytes: The body to send to the device.
+    """
+    blocks = []
+
+    def replace_binary(obj):
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if key in BINARY_FIELDS and isinstance(value, str) and value:
+                    blocks.append(base64.b64decode(value))
+                    obj[key] = f"BIN_{len(blocks)}"
+                else:
+                    replace_binary(value)
+        elif isinstance(obj, list):
+            for item in obj:
+                replace_binary(item)
+
+    replace_binary(data)
+    return json.dumps(data).encode("utf-8") + b"".join(blocks)
+
+def get_target_enabled(command_doc):
+    """Whether the command's target digest has the user enabled, enabled if the command carries no digest."""
+    status, _ = parse_digest(command_doc.get("target_digest"))
+    return status != "0"
+
+def get_user_name(device_user):
+    employee = frappe.db.get_value("Biometric Device User", device_user, "employee")
+    return (employee and frappe.db.get_value("Employee", employee, "employee_name")) or ""
+
+def get_set_user_info_command(command_doc):
+    """
+    SET_USER_INFO for a Create User or Update User Data command: the user's name, status and the enroll
+    templates stored in Biometric Device User Template, sent whole so the device ends at the target digest.
+
+    Returns:
+        dict: Command data for the device.
+    """
+    device_user = command_doc.biometric_device_user
+    if not device_user:
+        raise ValueError(f"Command {command_doc.name} has no Biometric Device User")
+
+    user_info = get_enroll_templates(device_user) or {}
+    user_info.update({
+        "user_id": str(frappe.db.get_value("Biometric Device User", device_user, "user_id") or device_user),
+        "user_name": user_info.get("user_name") or get_user_name(device_user),
+        "user_privilege": user_info.get("user_privilege") or "USER",
+        "user_enabled": "yes" if get_target_enabled(command_doc) else "no",
+    })
+    user_info.setdefault("enroll_data_array", [])
+
+    return {
+        "trans_id": command_doc.name,
+        "cmd_code": "SET_USER_INFO",
+        "body": encode_device_data(user_info),
+    }
+
+def get_enable_user_command(command_doc):
+    """
+    ENABLE_USER for an Update User Status command, the templates on the device stay as they are.
+
+    Returns:
+        dict: Command data for the device.
+    """
+    device_user = command_doc.biometric_device_user
+    if not device_user:
+        raise ValueError(f"Command {command_doc.name} has no Biometric Device User")
+
+    return {
+        "trans_id": command_doc.name,
+        "cmd_code": "ENABLE_USER",
+        "body": json.dumps({
+            "user_id": str(frappe.db.get_value("Biometric Device User", device_user, "user_id") or device_user),
+            "enable_flag": "yes" if get_target_enabled(command_doc) else "no",
+        }),
+    }
@@ -0,0 +1,302 @@
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+import frappe
+from frappe.utils import now_datetime
+from biometric_integration.services.command_state import transition_command
+from biometric_integration.services.device_mapping import get_biometric_assets_dir
+from biometric_integration.services.employee_index import resolve_employees
+from biometric_integration.services.enroll_templates import get_template_count, get_template_hash
+from biometric_integration.services.user_reconciler import make_digest
+
+IMPORT_COMMAND_TYPE = "Import Users"
+# Users fetched from the device before they are written with one bulk insert per doctype
+IMPORT_BATCH_SIZE = 100
+
+STAGE_LIST = "list"
+STAGE_FETCH = "fetch"
+# Reply to a result that ended the import with an error
+IMPORT_FAILED = {"response_code": "ERROR"}
+
+# Lock file held while spooled users are written, imports of several devices may link the same user or Employee
+FLUSH_LOCK = "flush"
+
+def get_import_dir():
+    import_dir = os.path.join(get_biometric_assets_dir(), "user_import")
+    os.makedirs(import_dir, exist_ok=True)
+    return import_dir
+
+def get_cursor_path(device_id):
+    return os.path.join(get_import_dir(), f"{device_id}.json")
+
+def get_spool_path(device_id):
+    return os.path.join(get_import_dir(), f"{device_id}.jsonl")
+
+@contextmanager
+def import_lock(name):
+    """
+    Hold an exclusive lock on `<name>.lock` in the import directory.
+
+    Results of a device may be handled by any listener worker, so the lock is a file lock and not a thread lock.
+    """
+    with open(os.path.join(get_import_dir(), f"{name}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def load_cursor(device_id):
+    file_path = get_cursor_path(device_id)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error("Error loading user import cursor of device %s: %s", device_id, e)
+        return None
+
+def save_cursor(device_id, cursor):
+    file_path = get_cursor_path(device_id)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cursor, f)
+    os.replace(tmp_path, file_path)
+
+def clear_import(device_id):
+    for file_path in (get_cursor_path(device_id), get_spool_path(device_id)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def normalize_user_id(user_id):
+    # Realtime enroll data names users by the integer user ID, "00000012" becomes "12"
+    user_id = str(user_id).strip()
+    return str(int(user_id)) if user_id.isdigit() else user_id
+
+def start_user_import(device_id, restart=False):
+    """
+    Queue an Import Users command for an EBKN device, continuing an interrupted import unless `restart` is set.
+
+    Returns:
+        str: Name of the Import Users command.
+    """
+    from biometric_integration.services.command_processor import update_has_pending_command
+
+    open_command = frappe.db.get_value(
+        "Biometric Device Command",
+        {"biometric_device": device_id, "command_type": IMPORT_COMMAND_TYPE, "status": ["in", ["Pending", "Reattempt", "Processing"]]},
+        "name",
+    )
+    if restart:
+        clear_import(device_id)
+    if open_command:
+        return open_command
+
+    command = frappe.get_doc({
+        "doctype": "Biometric Device Command",
+        "biometric_device": device_id,
+        "command_type": IMPORT_COMMAND_TYPE,
+        "status": "Pending",
+        # Let user changes queued by the ERP go first
+        "priority": -1,
+    }).insert(ignore_permissions=True)
+    update_has_pending_command(device_id, 1)
+    frappe.db.commit()
+    return command.name
+
+def get_next_import_step(command_doc):
+    """
+    The next command of an import: list the next packet of user IDs, or fetch the next user's info and templates.
+
+    Returns:
+        dict: Command data for the device.
+    """
+    device_id = command_doc.biometric_device
+    cursor = load_cursor(device_id)
+    if not cursor or cursor.get("command") != command_doc.name:
+        cursor = {"command": command_doc.name, "stage": STAGE_LIST, "packet_id": 1, "user_ids": [], "position": 0, "imported": 0}
+        save_cursor(device_id, cursor)
+
+    if cursor["stage"] == STAGE_LIST:
+        return {
+            "trans_id": command_doc.name,
+            "cmd_code": "GET_USER_ID_LIST",
+            "body": json.dumps({"packet_id": cursor["packet_id"]}),
+        }
+
+    return {
+        "trans_id": command_doc.name,
+        "cmd_code": "GET_USER_INFO",
+        "body": json.dumps({"user_id": cursor["user_ids"][cursor["position"]]}),
+    }
+
+def handle_import_result(command_doc, cmd_return_code, data):
+    """
+    Advance an import with the device's answer to its last step.
+
+    A packet of user IDs is added to the cursor until the device returns an empty packet. Each user's info
+    is appended to the spool file and written to the ERP every IMPORT_BATCH_SIZE users, so an interrupted
+    import resumes from the cursor without losing or repeating work.
+
+    Args:
+        command_doc (Document): The Import Users command.
+        cmd_return_code (str): The device's return code.
+        data (dict): The parsed result, `{"user_id_array": [...]}` for a list packet, the user's info otherwise.
+
+    Returns:
+        dict: Command data of the next step, IMPORT_FAILED if the import was moved to Error,
+            or None when the import is finished.
+    """
+    device_id = command_doc.biometric_device
+    with import_lock(device_id):
+        cursor = load_cursor(device_id)
+        if not cursor or cursor.get("command") != command_doc.name:
+            raise ValueError(f"No user import in progress for command {command_doc.name}")
+
+        if cursor["stage"] == STAGE_LIST:
+            if cmd_return_code != "OK":
+                # Asking again would fail the same way, close the import instead of resending it forever
+                logging.error("Device %s could not list users: %s", device_id, cmd_return_code)
+                clear_import(device_id)
+                transition_command(command_doc.name, "Error", {"device_response": cmd_return_code, "closed_on": now_datetime()})
+                return IMPORT_FAILED
+            # Kept as the device spells them, they are normalized when the users are written
+            user_ids = [
+                str(user.get("user_id") if isinstance(user, dict) else user)
+                for user in (data or {}).get("user_id_array") or []
+            ]
+            if user_ids:
+                cursor["user_ids"].extend(user_ids)
+                cursor["packet_id"] += 1
+            else:
+                cursor["stage"] = STAGE_FETCH
+        else:
+            if cmd_return_code == "OK" and data:
+                with open(get_spool_path(device_id), "a") as f:
+                    f.write(json.dumps(data) + "\n")
+            else:
+                logging.warning("Device %s returned %s for user %s, skipping", device_id, cmd_return_code, cursor['user_ids'][cursor['position']])
+            cursor["position"] += 1
+
+        finished = cursor["stage"] == STAGE_FETCH and cursor["position"] >= len(cursor["user_ids"])
+        spooled = count_spooled(device_id)
+        if spooled and (finished or spooled >= IMPORT_BATCH_SIZE):
+            cursor["imported"] += flush_spool(device_id, command_doc.brand or "EBKN")
+        save_cursor(device_id, cursor)
+
+    if finished:
+        logging.info("Imported %s of %s users from device %s", cursor['imported'], len(cursor['user_ids']), device_id)
+        clear_import(device_id)
+        return None
+    return get_next_import_step(command_doc)
+
+def count_spooled(device_id):
+    file_path = get_spool_path(device_id)
+    if not os.path.exists(file_path):
+        return 0
+    with open(file_path, "r") as f:
+        return sum(1 for _ in f)
+
+def flush_spool(device_id, brand):
+    """
+    Write the spooled users of a device with bulk inserts and empty the spool.
+
+    Users, device rows and templates that already exist are left as they are, so flushing
+    the same spool twice after an interruption is harmless.
+
+    Returns:
+        int: Number of users in the spool.
+    """
+    users = {}
+    with open(get_spool_path(device_id), "r") as f:
+        for line in f:
+            data = json.loads(line)
+            if data.get("user_id") is not None:
+                users[normalize_user_id(data["user_id"])] = data
+
+    if users:
+        # Checking which users and Employees are taken and inserting must not interleave with another device's flush
+        with import_lock(FLUSH_LOCK):
+            insert_imported_users(device_id, brand, users)
+            frappe.db.commit()
+    os.remove(get_spool_path(device_id))
+    return len(users)
+
+def insert_imported_users(device_id, brand, users):
+    """
+    Create Biometric Device Users, their row for the device and their templates for users read from a device.
+
+    Args:
+        device_id (str): The device the users were read from.
+        brand (str): The device brand.
+        users (dict): User ID mapped to the user info the device returned.
+    """
+    user_ids = list(users)
+    now = now_datetime()
+    owner = frappe.session.user
+    standard_fields = ["creation", "modified", "owner", "modified_by", "docstatus"]
+    standard_values = [now, now, owner, owner, 0]
+
+    existing_users = set(frappe.get_all("Biometric Device User", filters={"name": ["in", user_ids]}, pluck="name"))
+    existing_templates = set(frappe.get_all("Biometric Device User Template", filters={"name": ["in", user_ids]}, pluck="name"))
+    device_rows = frappe.get_all(
+        "Biometric Device User Detail",
+        filters={"parenttype": "Biometric Device User", "parent": ["in", user_ids]},
+        fields=["parent", "biometric_device", "idx"],
+    )
+    users_on_device = {row.parent for row in device_rows if row.biometric_device == device_id}
+    last_idx = {}
+    for row in device_rows:
+        last_idx[row.parent] = max(last_idx.get(row.parent, 0), row.idx or 0)
+
+    employees = resolve_employees(user_ids)
+    linked_employees = set(frappe.get_all(
+        "Biometric Device User",
+        filters={"employee": ["in", [employee["name"] for employee in employees.values()] or [""]]},
+        pluck="employee",
+    ))
+
+    user_values, detail_values, template_values = [], [], []
+    for user_id, data in users.items():
+        enroll_data_json = frappe.as_json(data)
+        template_count = get_template_count(data)
+        template_hash = get_template_hash(enroll_data_json) if template_count else ""
+
+        if user_id not in existing_users:
+            employee = employees.get(user_id)
+            employee_id = employee["name"] if employee and employee["name"] not in linked_employees else None
+            if employee_id:
+                linked_employees.add(employee_id)
+            user_values.append([user_id, user_id, employee_id, template_count, template_hash, now] + standard_values)
+
+        if user_id not in users_on_device:
+            # The device already holds this exact state, so reconciliation sees the user as up to date
+            detail_values.append([
+                frappe.generate_hash(length=10), user_id, "Biometric Device User", "devices", last_idx.get(user_id, 0) + 1,
+                device_id, brand, 1, make_digest(True, template_hash),
+            ] + standard_values)
+
+        if user_id not in existing_templates and template_count:
+            template_values.append([user_id, user_id, brand, template_count, template_hash, enroll_data_json] + standard_values)
+
+    if user_values:
+        frappe.db.bulk_insert(
+            "Biometric Device User",
+            fields=["name", "user_id", "employee", "enroll_template_count", "enroll_template_hash", "enroll_data_updated_on"] + standard_fields,
+            values=user_values,
+        )
+    if detail_values:
+        frappe.db.bulk_insert(
+            "Biometric Device User Detail",
+            fields=["name", "parent", "parenttype", "parentfield", "idx", "biometric_device", "brand", "allow_user", "synced_digest"] + standard_fields,
+            values=detail_values,
+        )
+    if template_values:
+        frappe.db.bulk_insert(
+            "Biometric Device User Template",
+            fields=["name", "biometric_device_user", "brand", "template_count", "template_hash", "enroll_data_json"] + standard_fields,
+            values=template_values,
+        )
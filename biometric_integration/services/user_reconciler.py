@@ -0,0 +1,170 @@
+import logging
+import time
+import frappe
+
+# Brands whose terminals accept user commands from the ERP
+USER_SYNC_BRANDS = ["EBKN"]
+OPEN_COMMAND_STATUSES = ["Pending", "Reattempt", "Processing"]
+
+def make_digest(enabled, template_hash):
+    """
+    Digest of a user's state on one device, `<status>:<template hash>`.
+
+    Args:
+        enabled (bool): Whether the user may use the device.
+        template_hash (str): Hash of the user's enroll templates, empty if none.
+    """
+    return f"{1 if enabled else 0}:{template_hash or ''}"
+
+def parse_digest(digest):
+    if not digest or ":" not in digest:
+        return None, None
+    status, template_hash = digest.split(":", 1)
+    return status, template_hash
+
+def get_command_type(synced_digest, target_digest):
+    """
+    The single command that moves a device from `synced_digest` to `target_digest`, or None if it is up to date.
+    """
+    if synced_digest == target_digest:
+        return None
+    synced_status, synced_template = parse_digest(synced_digest)
+    if synced_status is None:
+        return "Create User"
+    target_status, target_template = parse_digest(target_digest)
+    if synced_template != target_template:
+        # A data update carries the status too
+        return "Update User Data"
+    return "Update User Status"
+
+def get_reconcile_devices(device_names=None):
+    filters = {"disabled": 0, "disable_syncing_employees": 0, "brand": ["in", USER_SYNC_BRANDS]}
+    if device_names:
+        filters["name"] = ["in", device_names]
+    return frappe.get_all("Biometric Device", filters=filters, pluck="name")
+
+def get_user_device_states(devices):
+    """
+    ERP state of every user assigned to the given devices, with the template hash from the user's enroll summary
+    so enroll payloads are never loaded.
+    """
+    return frappe.db.sql(
+        """
+        SELECT
+            detail.name AS detail_name, detail.parent AS device_user, detail.biometric_device AS device,
+            detail.allow_user, detail.synced_digest, employee.status AS employee_status,
+            IFNULL(device_user.enroll_template_hash, '') AS template_hash
+        FROM `tabBiometric Device User Detail` detail
+        INNER JOIN `tabBiometric Device User` device_user ON device_user.name = detail.parent
+        LEFT JOIN `tabEmployee` employee ON employee.name = device_user.employee
+        WHERE detail.parenttype = 'Biometric Device User' AND detail.biometric_device IN %(devices)s
+        """,
+        {"devices": tuple(devices)},
+        as_dict=True,
+    )
+
+def get_open_commands(devices):
+    commands = frappe.get_all(
+        "Biometric Device Command",
+        filters={"biometric_device": ["in", devices], "status": ["in", OPEN_COMMAND_STATUSES]},
+        fields=["biometric_device", "biometric_device_user"],
+    )
+    return {(command.biometric_device, command.biometric_device_user) for command in commands}
+
+def reconcile_device_users(device_names=None, dry_run=False):
+    """
+    Compare what each device has acknowledged against ERP state and queue only the commands needed to converge.
+
+    A user whose digest differs and who has no open command on that device gets one
+    Create User, Update User Data or Update User Status command, if the device's brand supports it.
+    Unsupported ones are only counted, a command that can't be sent would stay open forever.
+
+    Args:
+        device_names (list): Only these devices, None for all enabled devices that accept user sync.
+        dry_run (bool): Only count the commands that would be created.
+
+    Returns:
+        dict: Number of devices and users checked, and commands created per command type.
+    """
+    from biometric_integration.services.command_processor import is_command_supported, update_has_pending_command
+
+    started = time.monotonic()
+    devices = get_reconcile_devices(device_names)
+    stats = {
+        "devices": len(devices), "users_checked": 0, "up_to_date": 0, "skipped_open_command": 0,
+        "unsupported": {}, "commands": {},
+    }
+    if not devices:
+        return stats
+    brands = dict(frappe.get_all("Biometric Device", filters={"name": ["in", devices]}, fields=["name", "brand"], as_list=True))
+
+    open_commands = get_open_commands(devices)
+    devices_with_commands = set()
+
+    for state in get_user_device_states(devices):
+        stats["users_checked"] += 1
+        enabled = bool(state.allow_user) and (state.employee_status or "Active") == "Active"
+        target_digest = make_digest(enabled, state.template_hash)
+        command_type = get_command_type(state.synced_digest, target_digest)
+
+        if not command_type:
+            stats["up_to_date"] += 1
+            continue
+        if command_type == "Create User" and not enabled:
+            # Nothing to remove from a device that never had the user
+            stats["up_to_date"] += 1
+            continue
+        if (state.device, state.device_user) in open_commands:
+            stats["skipped_open_command"] += 1
+            continue
+        if not is_command_supported(brands.get(state.device), command_type):
+            stats["unsupported"][command_type] = stats["unsupported"].get(command_type, 0) + 1
+            continue
+
+        stats["commands"][command_type] = stats["commands"].get(command_type, 0) + 1
+        if dry_run:
+            continue
+
+        frappe.get_doc({
+            "doctype": "Biometric Device Command",
+            "biometric_device": state.device,
+            "biometric_device_user": state.device_user,
+            "brand": brands.get(state.device),
+            "command_type": command_type,
+            "status": "Pending",
+            "target_digest": target_digest,
+        }).insert(ignore_permissions=True)
+        devices_with_commands.add(state.device)
+
+    if not dry_run:
+        for device in devices_with_commands:
+            update_has_pending_command(device, 1)
+        frappe.db.commit()
+
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    logging.info("User reconciliation: %s", stats)
+    return stats
+
+def record_synced_digest(biometric_device_user, biometric_device, target_digest):
+    """
+    Store the digest a completed command brought the device to, so the next reconciliation sees it as up to date.
+
+    Args:
+        biometric_device_user (str): The user the command was for.
+        biometric_device (str): The device the command ran on.
+        target_digest (str): The command's target digest.
+    """
+    if not target_digest or not biometric_device_user:
+        return
+
+    frappe.db.set_value(
+        "Biometric Device User Detail",
+        {"parent": biometric_device_user, "biometric_device": biometric_device},
+        "synced_digest",
+        target_digest,
+        update_modified=False,
+    )
+
+def reconcile_all_devices():
+    """Scheduled job that reconciles the users of every device on the current site."""
+    reconcile_device_users()
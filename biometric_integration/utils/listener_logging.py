@@ -0,0 +1,73 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+# biometric_listener.log is rotated at this size, keeping LOG_BACKUP_COUNT old files
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = 10000
+
+request_logger = logging.getLogger("biometric_integration.requests")
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Put records on the queue as they are, so message formatting happens on the writer thread
+    and never on the request thread. Records are dropped, not waited for, when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LazyJSON:
+    """A log argument that is serialized only if and when the record is formatted."""
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, default=str)
+
+def setup_listener_logging(log_file_path, level=logging.INFO):
+    """
+    Send all logging through a queue to a background thread that writes the rotating log file.
+
+    Args:
+        log_file_path (str): Path of biometric_listener.log.
+        level (int|str): Records below this level are discarded before their message is built.
+
+    Returns:
+        QueueListener: The running writer, stop it on shutdown to flush the queue.
+    """
+    file_handler = RotatingFileHandler(log_file_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    writer = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    writer.start()
+    return writer
+
+def log_request(**fields):
+    """
+    Write one structured record for a handled request, e.g. method, path, dev_id, status and latency_ms.
+    """
+    if request_logger.isEnabledFor(logging.INFO):
+        request_logger.info("request %s", LazyJSON(fields))
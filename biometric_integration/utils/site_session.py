@@ -36,7 +36,7 @@ def init_site(device_id: str = None, site_name: str = None):
     frappe.connect()
     # Set an appropriate user
     frappe.set_user('Administrator')
-    logging.info(f"Site context initialized for site {site_name}")
+    logging.info("Site context initialized for site %s", site_name)
 
     return True
 
@@ -50,4 +50,4 @@ def destroy_site():
         logging.info("Site context destroyed.")
     except Exception as e:
         # If frappe wasn't initialized or any other issue occurred
-        logging.debug(f"No active site context to destroy or error occurred: {str(e)}")
\ No newline at end of file
+        logging.debug("No active site context to destroy or error occurred: %s", e)
\ No newline at end of file